@@ -0,0 +1,66 @@
+# Gunicorn settings, read from the working directory by `gunicorn src.app:app`.
+#
+# With preload_app the master imports the app and loads the models and course
+# indexes (preload_courses in settings.txt) before forking the workers. The
+# workers then share those pages with the master copy-on-write instead of
+# each loading its own copy, so memory no longer grows with every worker by
+# the size of the models; the workers start once that is done. PRELOAD=off
+# starts the workers right away and each loads everything itself, in the
+# background. Either way, /ready tells a load balancer when a worker can answer.
+import gc
+import os
+
+# The tokenizers of the models must not start their thread pool in the master.
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+bind = "0.0.0.0:" + os.environ.get("PORT", "8080")
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+# Each worker answers THREADS requests at once: an answer streams for seconds,
+# and concurrent requests in one process share the query micro-batches and the
+# models.
+worker_class = "gthread"
+threads = int(os.environ.get("THREADS", 8))
+timeout = 120
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("LOG_LEVEL", "debug")
+preload_app = os.environ.get("PRELOAD", "on").lower() == "on"
+
+
+def on_starting(server):
+    # Runs in the master before anything else: /metrics must not sum the
+    # snapshots of an earlier server run into this one's.
+    from src.metrics import clear_snapshots
+    from src.settings import project_root
+    clear_snapshots(os.path.join(project_root, "data", "metrics"))
+
+
+def when_ready(server):
+    # Runs in the master once the app is imported, before the workers fork.
+    if server.cfg.preload_app:
+        from src.app import get_registry
+        try:
+            get_registry().preload()
+        except Exception:
+            # The workers load what they need themselves.
+            server.log.exception("Preloading the courses failed.")
+        # Moves everything loaded so far out of the garbage collector's reach,
+        # so collections in the workers do not write to (and so copy) the
+        # shared pages holding those objects.
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    # Each worker creates the engines of the preload courses: threads, sqlite
+    # connections and the LLM client are per process. That runs in the
+    # background, so the worker already answers / and /healthz, and /ready
+    # once it is done.
+    from src.app import start_warming
+
+    def log_result(warmed):
+        if warmed:
+            worker.log.info("Worker %s warmed.", worker.pid)
+        else:
+            worker.log.error("Warming worker %s failed.", worker.pid)
+
+    start_warming(log_result)
@@ -0,0 +1,241 @@
+import os
+import argparse
+import json
+import math
+import time
+import threading
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of a list of values (pct in 0..100).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """
+    Stage durations in seconds from a Server-Timing header ("name;dur=ms, ...").
+    """
+    stages = {}
+    for entry in (header or "").split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if name and key == 'dur':
+                stages[name] = float(value) / 1000.0
+    return stages
+
+def post_chat(url: str, query: str, timeout: float) -> Dict[str, Any]:
+    """
+    Sends one query to /api/chat and returns its status, wall-clock latency and
+    the server's stage timings (with server_timing=on in settings.txt).
+    """
+    body = json.dumps({'query': query}).encode('utf-8')
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    stages = {}
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+            stages = parse_server_timing(resp.headers.get('Server-Timing'))
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return {'status': status, 'latency': time.perf_counter() - start, 'stages': stages}
+
+def scrape_counters(url: str, timeout: float = 10.0) -> Dict[str, float]:
+    """
+    Samples of a Prometheus text endpoint by "name{labels}", or {} if it cannot
+    be read.
+    """
+    counters = {}
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            text = resp.read().decode('utf-8')
+    except Exception:
+        return counters
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            sample, _, value = line.rpartition(' ')
+            try:
+                counters[sample] = float(value)
+            except ValueError:
+                continue
+    return counters
+
+def cache_hits(before: Dict[str, float], after: Dict[str, float]) -> Dict[str, float]:
+    """
+    Answer-cache hits and misses and gate-memo hits between two scrapes.
+    """
+    def delta(prefix, match=''):
+        return sum(value - before.get(sample, 0.0) for sample, value in after.items()
+                   if sample.startswith(prefix) and match in sample)
+    return {
+        'answer cache hits': delta('qa_answer_cache_total', 'result="hit"'),
+        'answer cache misses': delta('qa_answer_cache_total', 'result="miss"'),
+        'gate memo hits': delta('qa_gate_memo_hits_total'),
+    }
+
+def find_processes(match: str) -> List[int]:
+    """
+    Pids of the processes whose command line contains `match` (Linux /proc).
+    """
+    pids = []
+    for entry in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        try:
+            with open(f'/proc/{entry}/cmdline', 'rb') as f:
+                cmdline = f.read().replace(b'\0', b' ').decode('utf-8', 'replace')
+        except OSError:
+            continue
+        if match in cmdline:
+            pids.append(int(entry))
+    return pids
+
+def read_rss(pid: int) -> int:
+    """
+    Resident set size of a process in bytes, 0 if it is gone.
+    """
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+class RssSampler:
+    """
+    Samples the RSS of the server processes in the background and keeps each
+    one's peak.
+    """
+
+    def __init__(self, match: str, interval: float = 0.5):
+        self.match = match
+        self.interval = interval
+        self.peak: Dict[int, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self) -> Dict[int, int]:
+        rss = {pid: read_rss(pid) for pid in find_processes(self.match)}
+        for pid, value in rss.items():
+            self.peak[pid] = max(self.peak.get(pid, 0), value)
+        return rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+def main():
+    """
+    Main routine:
+      1. Reads the benchmark queries, one per line. They should be varied: the
+         answer cache and gate memo (on by default) answer repeated queries
+         without running the pipeline.
+      2. Sends them to a running server's /api/chat at the requested concurrency,
+         after --warmup requests that are not counted.
+      3. Prints request throughput, p50/p95/p99 latency, the same percentiles per
+         pipeline stage from the Server-Timing header (server_timing=on) and the
+         RSS of the server processes (Linux only) before the run and at its peak,
+         and the answer-cache and gate-memo hits during the run from /metrics.
+
+    Run it once against the server before a change and once after to compare.
+    To run offline, start scripts/openai_stub.py and the server with
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 in its environment.
+    """
+    parser = argparse.ArgumentParser(description="Latency benchmark for /api/chat.")
+    parser.add_argument('--url', default='http://127.0.0.1:8080/api/chat')
+    parser.add_argument('--queries', required=True, help="Text file with one query per line.")
+    parser.add_argument('--requests', type=int, default=50, help="Total number of requests to send.")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--warmup', type=int, default=2, help="Requests sent first and not counted.")
+    parser.add_argument('--metrics-url', help="The server's /metrics; by default next to --url.")
+    parser.add_argument('--rss-match', default='src.app',
+                        help="Substring of the server processes' command line, for RSS.")
+    args = parser.parse_args()
+
+    with open(args.queries, 'r', encoding='utf-8') as f:
+        queries = [line.strip() for line in f if line.strip()]
+    if not queries:
+        parser.error(f"No queries in {args.queries}.")
+    if len(set(queries)) < args.requests:
+        print(f"Note: {len(set(queries))} distinct queries for {args.requests} requests; repeated "
+              "ones are answered from the answer cache (answer_cache=off in settings.txt to disable).")
+    metrics_url = args.metrics_url or urllib.parse.urljoin(args.url, '/metrics')
+
+    for i in range(args.warmup):
+        post_chat(args.url, queries[i % len(queries)], args.timeout)
+    rss = RssSampler(args.rss_match)
+    before = rss.sample()
+    rss.start()
+    counters_before = scrape_counters(metrics_url)
+
+    print(f"Sending {args.requests} requests to {args.url} with concurrency {args.concurrency}...")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(
+            lambda i: post_chat(args.url, queries[i % len(queries)], args.timeout),
+            range(args.requests)
+        ))
+    elapsed = time.perf_counter() - start
+    rss.stop()
+    counters_after = scrape_counters(metrics_url)
+
+    ok = [r for r in results if r['status'] == 200]
+    latencies = [r['latency'] for r in ok]
+    errors = len(results) - len(ok)
+    print(f"Completed: {len(ok)} ok, {errors} failed in {elapsed:.2f}s ({len(ok) / elapsed:.2f} QPS)")
+    print(f"p50: {percentile(latencies, 50) * 1000:.0f} ms")
+    print(f"p95: {percentile(latencies, 95) * 1000:.0f} ms")
+    print(f"p99: {percentile(latencies, 99) * 1000:.0f} ms")
+
+    stages = defaultdict(list)
+    for r in ok:
+        for stage, seconds in r['stages'].items():
+            stages[stage].append(seconds)
+    if stages:
+        print(f"{'stage':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for stage, values in stages.items():
+            print(f"{stage:<18}{len(values):>7}{percentile(values, 50) * 1000:>10.1f}"
+                  f"{percentile(values, 95) * 1000:>10.1f}{percentile(values, 99) * 1000:>10.1f}")
+    else:
+        print("No stage timings (set server_timing=on in settings.txt).")
+
+    if counters_after:
+        # Server-wide counts: other traffic during the run is included.
+        hits = cache_hits(counters_before, counters_after)
+        print(", ".join(f"{name}: {count:.0f}" for name, count in hits.items()))
+    else:
+        print(f"No cache counts ({metrics_url} not reachable).")
+
+    if rss.peak:
+        for pid in sorted(rss.peak):
+            print(f"pid {pid}: RSS {before.get(pid, 0) / 2**20:.0f} MB before, {rss.peak[pid] / 2**20:.0f} MB peak")
+        print(f"Total peak RSS: {sum(rss.peak.values()) / 2**20:.0f} MB over {len(rss.peak)} processes")
+    else:
+        print(f"No server processes matching '{args.rss_match}' found for RSS.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+
+from openai import OpenAI
+
+# Make the project root importable so the shared src modules can be used.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.embedding_scheduler import EmbeddingScheduler
+from src.embeddings import load_encoder
+
+# Run in a fresh interpreter so the cold start includes the imports (torch or
+# onnxruntime) as well as loading the model and the first encode.
+COLD_START_SNIPPET = """
+import sys, json, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+from src.embeddings import load_encoder
+encoder = load_encoder(json.loads(sys.argv[2]), sys.argv[1])
+loaded = time.perf_counter()
+encoder.encode(["warm-up query"])
+print(json.dumps({"load": loaded - start, "first_encode": time.perf_counter() - loaded}))
+"""
+
+
+def synthetic_texts(count: int, words_per_text: int) -> list:
+    """
+    Chunk-sized texts of random vocabulary, deterministic across runs.
+    """
+    rng = random.Random(0)
+    vocabulary = [f"term{i}" for i in range(5000)]
+    return [" ".join(rng.choice(vocabulary) for _ in range(words_per_text)) for _ in range(count)]
+
+def run_openai(args, texts: list) -> None:
+    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY", "stub"), base_url=args.base_url, max_retries=0)
+    for concurrency in args.concurrency:
+        scheduler = EmbeddingScheduler(
+            client, args.model,
+            tokens_per_minute=args.tpm,
+            requests_per_minute=args.rpm,
+            max_tokens_per_request=args.max_tokens_per_request,
+            concurrency=concurrency,
+        )
+        start = time.perf_counter()
+        vectors = scheduler.embed(texts)
+        elapsed = time.perf_counter() - start
+        print(f"concurrency={concurrency}: {len(texts)} texts -> {vectors.shape} in {elapsed:.2f}s "
+              f"({len(texts) / elapsed:.1f} texts/s, {scheduler.num_tokens / elapsed:.0f} tokens/s, "
+              f"{scheduler.num_requests} requests, {scheduler.num_rate_limited} rate limited)")
+
+def measure_cold_start(base_dir: str, settings: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, '-c', COLD_START_SNIPPET, base_dir, json.dumps(settings)],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def run_local(args, texts: list) -> None:
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    settings = {'embedding_method': args.backend}
+    if args.onnx_model_dir:
+        settings['onnx_model_dir'] = args.onnx_model_dir
+    if args.threads:
+        settings['onnx_threads'] = str(args.threads)
+
+    cold = measure_cold_start(base_dir, settings)
+    print(f"{args.backend} cold start: {cold['load']:.2f}s import and load, "
+          f"{cold['first_encode'] * 1000:.1f}ms first encode")
+
+    encoder = load_encoder(settings, base_dir)
+    encoder.encode(texts[:8])
+    latencies = []
+    for text in texts[:args.queries]:
+        start = time.perf_counter()
+        encoder.encode([text])
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"single query: p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+          f"max {latencies[-1] * 1000:.1f}ms over {len(latencies)} queries")
+
+    for batch_size in args.batch_sizes:
+        encoder.batch_size = batch_size
+        start = time.perf_counter()
+        vectors = encoder.encode(texts)
+        elapsed = time.perf_counter() - start
+        print(f"batch_size={batch_size}: {len(texts)} texts -> {vectors.shape} in {elapsed:.2f}s "
+              f"({len(texts) / elapsed:.1f} texts/s)")
+
+def main():
+    """
+    Embedding throughput benchmark.
+
+    --backend openai (default) runs the OpenAI embedding scheduler over synthetic
+    chunk-sized texts at each requested concurrency. Start scripts/openai_stub.py
+    first to run it offline, e.g. with the stub's --tpm/--rpm set to the account
+    limits being simulated.
+
+    --backend sentence-transformers or onnx measures a local encoder: cold start
+    in a fresh process, single-query latency, and corpus throughput at each
+    requested batch size. Run both on the same machine to compare them.
+    """
+    parser = argparse.ArgumentParser(description="Embedding throughput benchmark.")
+    parser.add_argument('--backend', default='openai', choices=['openai', 'sentence-transformers', 'onnx'])
+    parser.add_argument('--texts', type=int, default=2000)
+    parser.add_argument('--words', type=int, default=200, help="Words per text.")
+    parser.add_argument('--base-url', default='http://127.0.0.1:8001/v1')
+    parser.add_argument('--model', default='text-embedding-ada-002')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--tpm', type=int, default=1000000, help="Tokens-per-minute budget of the scheduler.")
+    parser.add_argument('--rpm', type=int, default=3000, help="Requests-per-minute budget of the scheduler.")
+    parser.add_argument('--max-tokens-per-request', type=int, default=8000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[16, 64], help="Local encoder batch sizes.")
+    parser.add_argument('--queries', type=int, default=200, help="Single-query encodes timed for local encoders.")
+    parser.add_argument('--onnx-model-dir', default=None, help="Defaults to the onnx_model_dir default.")
+    parser.add_argument('--threads', type=int, default=0, help="ONNX Runtime intra-op threads (0: all cores).")
+    args = parser.parse_args()
+
+    texts = synthetic_texts(args.texts, args.words)
+    if args.backend == 'openai':
+        run_openai(args, texts)
+    else:
+        run_local(args, texts)
+
+if __name__ == "__main__":
+    main()
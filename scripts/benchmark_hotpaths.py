@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+from typing import Callable, List, Dict
+
+import numpy as np
+
+# Make the project root importable so the shared src modules and the
+# prepare_documents script can be used.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from src.batcher import MicroBatcher
+from src.chunk_store import ChunkStore
+from src.engine import load_index_generation, load_reranker
+from src.index_versions import current_version, index_dir
+from src.model_pool import ModelPool
+from src.settings import project_root, read_settings
+from prepare_documents import chunk_document
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of a list of values (pct in 0..100).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+def measure(fn: Callable, calls: List[tuple], warmup: int = 3) -> Dict[str, float]:
+    """
+    Calls fn(*args) for each args tuple in `calls` and returns the p50 and p99
+    latency in milliseconds.
+    """
+    for args in calls[:warmup]:
+        fn(*args)
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - start)
+    return {'p50_ms': percentile(latencies, 50) * 1000, 'p99_ms': percentile(latencies, 99) * 1000}
+
+def synthetic_document(words: int) -> str:
+    rng = random.Random(0)
+    vocabulary = [f"term{i}" for i in range(5000)]
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+def sample_queries(store: ChunkStore, count: int, words: int = 8) -> List[str]:
+    """
+    Runs of words from random chunks, deterministic across runs.
+    """
+    rng = random.Random(0)
+    queries = []
+    for _ in range(count):
+        row = rng.randrange(len(store))
+        chunk_id = int(store.chunk_ids[row]) if store.sorted_ids is not None else row
+        tokens = store.text(chunk_id).split() or ["empty"]
+        start = rng.randrange(max(1, len(tokens) - words))
+        queries.append(" ".join(tokens[start:start + words]))
+    return queries
+
+def run_benchmarks(args) -> Dict[str, Dict[str, float]]:
+    results = {}
+
+    text = synthetic_document(args.document_words)
+    results['chunk_text'] = measure(
+        lambda: chunk_document(text, "benchmark.txt", args.chunk_size, args.overlap),
+        [()] * args.repeat, warmup=1,
+    )
+
+    data_dir = os.path.join(project_root, "data")
+    store_dir = os.path.join(index_dir(data_dir), "chunk_store")
+    results['chunk_store_open'] = measure(lambda: ChunkStore(store_dir).close(), [()] * args.repeat, warmup=1)
+
+    # Only the parts of an engine that are timed: no LLM client, databases or threads.
+    settings = read_settings(os.path.join(project_root, "settings.txt"))
+    generation = load_index_generation(data_dir, settings, current_version(data_dir))
+    models = ModelPool(project_root)
+    encoder = models.encoder(settings)
+    reranker = load_reranker(settings, models)
+    store = generation.chunk_store
+    rng = random.Random(0)
+    ids = [int(store.chunk_ids[rng.randrange(len(store))]) if store.sorted_ids is not None
+           else rng.randrange(len(store)) for _ in range(args.iterations)]
+    results['chunk_lookup'] = measure(store.get, [(idx,) for idx in ids])
+
+    queries = sample_queries(store, args.iterations)
+    results['encode'] = measure(lambda q: encoder.encode([q]), [(q,) for q in queries])
+    if settings.get("query_batching", "on").lower() == "on":
+        # Through the query batcher, as a request alone in the process uses it.
+        batcher = MicroBatcher(encoder.encode, max_batch=int(settings.get("query_batch_max", 16)),
+                               max_wait_ms=float(settings.get("query_batch_wait_ms", 2)), log_every=0)
+        results['embed_query'] = measure(batcher.submit, [(q,) for q in queries])
+        batcher.close()
+
+    vectors = np.vstack([encoder.encode(queries[i:i + 64]) for i in range(0, len(queries), 64)])
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    faiss_index = generation.faiss_index
+    results['faiss_search'] = measure(
+        lambda v: faiss_index.search(v, args.k), [(vectors[i:i + 1],) for i in range(len(vectors))]
+    )
+    batches = [(vectors[i:i + 16],) for i in range(0, len(vectors) - 15, 16)]
+    if batches:
+        results['faiss_search_batch16'] = measure(lambda v: faiss_index.search(v, args.k), batches)
+
+    if reranker:
+        _, neighbours = faiss_index.search(vectors, args.k)
+        pools = [(q, [(int(idx), store.text(int(idx))) for idx in row if idx >= 0 and int(idx) in store])
+                 for q, row in zip(queries, neighbours)]
+        results['rerank'] = measure(reranker.rerank, pools)
+    return results
+
+def main():
+    """
+    Main routine:
+      1. Times the hot paths one at a time: chunking a document (chunk_text),
+         opening the chunk store and looking up chunk metadata, encoding a query,
+         embed_query through the query batcher, FAISS searches of one and of 16
+         queries against the published data/ index, and reranking --k
+         candidates with the cross-encoder (rerank=on). Only the index, encoder
+         and cross-encoder are loaded, so it needs no OpenAI API key and opens
+         none of the caches or session stores.
+      2. Prints the p50 and p99 latency of each.
+      3. With --save, writes the results to a JSON file; with --baseline, compares
+         against such a file and exits with status 1 if any p50 is more than
+         --tolerance slower.
+    """
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the retrieval hot paths.")
+    parser.add_argument('--iterations', type=int, default=200, help="Calls per lookup/encode/search benchmark.")
+    parser.add_argument('--repeat', type=int, default=10, help="Calls per chunking and store-open benchmark.")
+    parser.add_argument('--document-words', type=int, default=100000, help="Words in the chunked document.")
+    parser.add_argument('--chunk-size', type=int, default=200)
+    parser.add_argument('--overlap', type=int, default=100)
+    parser.add_argument('--k', type=int, default=30, help="Neighbours per search (the rerank pool).")
+    parser.add_argument('--save', help="Write the results to this JSON file.")
+    parser.add_argument('--baseline', help="JSON file of an earlier run to compare against.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed p50 slowdown against the baseline.")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    regressions = []
+    print(f"{'benchmark':<22}{'p50 ms':>10}{'p99 ms':>10}{'baseline p50':>14}")
+    for name, result in results.items():
+        line = f"{name:<22}{result['p50_ms']:>10.3f}{result['p99_ms']:>10.3f}"
+        if name in baseline:
+            before = baseline[name]['p50_ms']
+            change = result['p50_ms'] / before - 1 if before else 0.0
+            line += f"{before:>14.3f} ({change:+.0%})"
+            if change > args.tolerance:
+                regressions.append(name)
+        print(line)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.save}")
+    if regressions:
+        print(f"Slower than the baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import os
+import sys
+import math
+import time
+import random
+import argparse
+from typing import List, Dict, Any, Optional
+
+# Make the project root importable so the shared src modules can be used.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.engine import QAEngine
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of a list of values (pct in 0..100).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+def read_queries(path: str) -> List[Dict[str, Any]]:
+    """
+    Reads one query per line. A tab may separate the query from a string that
+    a correct context contains (e.g. a document name or a key term).
+    """
+    queries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            query, _, expected = line.rstrip('\n').partition('\t')
+            queries.append({'query': query.strip(), 'expected_text': expected.strip() or None})
+    return queries
+
+def sample_queries(engine: QAEngine, count: int, words: int) -> List[Dict[str, Any]]:
+    """
+    Known-item queries: a random run of words from a random chunk, expecting that
+    chunk to be retrieved. Deterministic across runs.
+    """
+    rng = random.Random(0)
+    store = engine.chunk_store
+    queries = []
+    for _ in range(count * 10):
+        if len(queries) >= count or not len(store):
+            break
+        row = rng.randrange(len(store))
+        chunk_id = int(store.chunk_ids[row]) if store.sorted_ids is not None else row
+        tokens = store.text(chunk_id).split()
+        if len(tokens) < words:
+            continue
+        start = rng.randrange(len(tokens) - words + 1)
+        queries.append({'query': " ".join(tokens[start:start + words]), 'expected_id': chunk_id})
+    return queries
+
+def is_hit(engine: QAEngine, query: Dict[str, Any], ids: List[int]) -> Optional[bool]:
+    if query.get('expected_id') is not None:
+        return query['expected_id'] in ids
+    if query.get('expected_text'):
+        expected = query['expected_text'].casefold()
+        return any(expected in engine.chunk_store.text(idx).casefold() for idx in ids)
+    return None
+
+def run_retrieval(engine: QAEngine, queries: List[Dict[str, Any]], k: int) -> None:
+    latencies = []
+    hits = []
+    for query in queries:
+        start = time.perf_counter()
+        ids = engine.rank_candidates(query['query'])[:k]
+        latencies.append(time.perf_counter() - start)
+        hit = is_hit(engine, query, ids)
+        if hit is not None:
+            hits.append(hit)
+    recall = f"recall@{k} {sum(hits) / len(hits):.3f} ({len(hits)} judged)" if hits else "no judged queries"
+    print(f"  retrieval: {recall}, p50 {percentile(latencies, 50) * 1000:.1f}ms, "
+          f"p99 {percentile(latencies, 99) * 1000:.1f}ms")
+
+def run_answers(engine: QAEngine, queries: List[Dict[str, Any]]) -> None:
+    latencies = []
+    retried = 0
+    failed = 0
+    for query in queries:
+        start = time.perf_counter()
+        answer = engine.answer(query['query'])
+        latencies.append(time.perf_counter() - start)
+        retried += answer.replaced
+        failed += not answer.verified
+    print(f"  answers: retry rate {retried / len(queries):.1%}, unverified {failed / len(queries):.1%}, "
+          f"p50 {percentile(latencies, 50):.2f}s, p99 {percentile(latencies, 99):.2f}s")
+
+def main():
+    """
+    Main routine:
+      1. Loads the QA engine with the current data and settings.
+      2. Reads a query set (--queries) or samples known-item queries from the chunks.
+      3. For dense, hybrid and (with rerank=on) reranked hybrid retrieval in turn,
+         prints recall and retrieval latency, and with --answer runs the full
+         pipeline to print the verification retry rate and end-to-end latency
+         (this calls the OpenAI API; point OPENAI_BASE_URL at a stub to run it offline).
+    """
+    parser = argparse.ArgumentParser(description="Dense vs hybrid vs reranked retrieval benchmark.")
+    parser.add_argument('--queries', help="Text file with one query per line, optionally 'query<TAB>expected text'.")
+    parser.add_argument('--sample', type=int, default=200, help="Known-item queries to sample without --queries.")
+    parser.add_argument('--words', type=int, default=8, help="Words per sampled query.")
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--answer', action='store_true', help="Also run the full answer pipeline.")
+    args = parser.parse_args()
+
+    engine = QAEngine()
+    if engine.bm25 is None:
+        print("No BM25 index loaded (retrieval=hybrid and data/bm25 are needed). Exiting.")
+        sys.exit(1)
+    # Cached answers and gate verdicts would hide the difference between the runs.
+    engine.answer_cache = None
+    engine.gate_memo = None
+
+    queries = read_queries(args.queries) if args.queries else sample_queries(engine, args.sample, args.words)
+    if not queries:
+        print("No queries. Exiting.")
+        sys.exit(0)
+    print(f"{len(queries)} queries, k={args.k}")
+
+    # Each mode ranks the candidate pool (rerank_pool) and keeps the top k.
+    bm25, reranker = engine.bm25, engine.reranker
+    modes = ["dense", "hybrid"] + (["hybrid+rerank"] if reranker else [])
+    for mode in modes:
+        engine.bm25 = bm25 if mode != "dense" else None
+        engine.reranker = reranker if mode.endswith("+rerank") else None
+        print(f"{mode}:")
+        run_retrieval(engine, queries, args.k)
+        if args.answer:
+            run_answers(engine, queries)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import os
+import sys
+import pickle
+import numpy as np
+
+# Make the project root importable so the shared src modules can be used.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.embedding_store import EmbeddingWriter
+
+# Rows converted per write.
+BATCH_SIZE = 4096
+
+
+def main():
+    """
+    One-off migration for data embedded before the .npy hand-off existed:
+      1. Loads 'data/embedded_data.pkl' (a list of dicts with 'embedding' lists).
+      2. Writes the vectors to 'data/embeddings.npy' and the chunk records to
+         'data/embeddings_meta.jsonl', numbering chunks by position if the
+         pickle has no chunk ids.
+
+    The pickle can be deleted afterwards.
+    """
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    data_dir = os.path.join(base_dir, 'data')
+    pickle_path = os.path.join(data_dir, 'embedded_data.pkl')
+
+    if not os.path.exists(pickle_path):
+        print(f"Could not find {pickle_path}. Nothing to convert.")
+        sys.exit(0)
+
+    print(f"Loading embedded data from {pickle_path}...")
+    with open(pickle_path, 'rb') as f:
+        embedded_data = pickle.load(f)
+    if not embedded_data:
+        print("No embedded data found. Exiting.")
+        sys.exit(0)
+
+    writer = EmbeddingWriter(data_dir, len(embedded_data))
+    for start in range(0, len(embedded_data), BATCH_SIZE):
+        batch = embedded_data[start:start + BATCH_SIZE]
+        for i, record in enumerate(batch):
+            record.setdefault('chunk_id', start + i)
+        vectors = np.array([record['embedding'] for record in batch], dtype=np.float32)
+        writer.write(batch, vectors)
+    writer.close()
+
+    print(f"Done! Converted {len(embedded_data)} embeddings. You can now delete {pickle_path}.")
+
+if __name__ == "__main__":
+    main()
@@ -1,85 +1,289 @@
 import os
-import pickle
 import faiss
 import numpy as np
 import json
 import sys
-from typing import List, Dict, Any
+import shutil
+import argparse
+from typing import Dict, Any
 from typing import Tuple
 
+# Make the project root importable so the shared src modules can be used.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.chunk_store import write_chunk_store
+from src.embedding_store import EMBEDDINGS_FILE, META_FILE, embeddings_exist, open_embeddings, read_embedding_meta
+from src.index_versions import index_dir, new_version_dir, publish_version
 
-def build_faiss_index(embedded_data: List[Dict[str, Any]], embedding_dim: int) -> Tuple[faiss.IndexFlatL2, List[Dict[str, Any]]]:
+# Rows handed to FAISS per add call; slices of the memory-mapped file are not copied.
+ADD_BATCH_SIZE = 65536
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """
+    Hard-links `src` to `dst`, or copies it where links are not supported.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def read_settings(settings_path: str) -> dict:
+    """
+    Reads simple key-value pairs from a settings.txt file.
+    Expected format (one key=value per line).
     """
-    Builds a FAISS index from the embedded data.
-    
-    Returns:
-      - The FAISS index built with L2 distance.
-      - A metadata list where each entry includes:
-          'filename', 'chunk_index', and 'chunk_text'
+    settings = {}
+    with open(settings_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            key, value = line.split('=', 1)
+            settings[key.strip()] = value.strip()
+    return settings
+
+def index_params_from_settings(settings: dict) -> Dict[str, Any]:
+    """
+    Collects the index type and its tuning parameters from settings.txt:
+      - index_type: flat, ivf_flat, ivf_pq or hnsw (default flat)
+      - ivf_nlist, ivf_nprobe: number of IVF lists and lists probed per query
+      - pq_m, pq_nbits: PQ sub-quantizers (must divide the dimension) and bits per code
+      - hnsw_m, hnsw_ef_construction, hnsw_ef_search: HNSW graph degree and search breadth
+      - train_sample_size: vectors sampled to train IVF/PQ quantizers
     """
-    vectors = []
-    metadata = []
+    index_type = settings.get('index_type', 'flat').lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index_type '{index_type}'. Expected one of: {', '.join(INDEX_TYPES)}")
+    return {
+        'index_type': index_type,
+        'ivf_nlist': int(settings.get('ivf_nlist', 1024)),
+        'ivf_nprobe': int(settings.get('ivf_nprobe', 16)),
+        'pq_m': int(settings.get('pq_m', 16)),
+        'pq_nbits': int(settings.get('pq_nbits', 8)),
+        'hnsw_m': int(settings.get('hnsw_m', 32)),
+        'hnsw_ef_construction': int(settings.get('hnsw_ef_construction', 200)),
+        'hnsw_ef_search': int(settings.get('hnsw_ef_search', 64)),
+        'train_sample_size': int(settings.get('train_sample_size', 100000)),
+    }
 
-    for record in embedded_data:
-        # Ensure the embedding is a float32 numpy array (FAISS requires float32)
-        embedding = np.array(record['embedding'], dtype=np.float32)
-        vectors.append(embedding)
-        metadata.append({
-            'filename': record['filename'],
-            'chunk_index': record['chunk_index'],
-            'chunk_text': record['chunk_text']
-        })
+def build_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The parameters of params['index_type'] that are fixed when the index is built;
+    changing one of them needs a new index.
+    """
+    index_type = params['index_type']
+    if index_type == 'hnsw':
+        return {'hnsw_m': params['hnsw_m'], 'hnsw_ef_construction': params['hnsw_ef_construction']}
+    if index_type == 'ivf_flat':
+        return {'ivf_nlist': params['ivf_nlist']}
+    if index_type == 'ivf_pq':
+        return {'ivf_nlist': params['ivf_nlist'], 'pq_m': params['pq_m'], 'pq_nbits': params['pq_nbits']}
+    return {}
 
-    vectors_np = np.vstack(vectors)
-    index = faiss.IndexFlatL2(embedding_dim)  # Simple L2 distance index; for large datasets, consider IVF or HNSW
-    index.add(vectors_np)
+def apply_search_settings(info: Dict[str, Any], params: Dict[str, Any]):
+    """
+    Sets the search-time parameters in the index info from the current settings;
+    they only take effect at query time, so an updated index picks them up too.
+    """
+    if 'nprobe' in info:
+        info['nprobe'] = min(params['ivf_nprobe'], info['nlist'])
+    if 'efSearch' in info:
+        info['efSearch'] = params['hnsw_ef_search']
 
-    return index, metadata
+def create_index(vectors_np: np.ndarray, ids_np: np.ndarray, params: Dict[str, Any]) -> Tuple[faiss.Index, Dict[str, Any]]:
+    """
+    Creates, trains and populates the FAISS index selected by params['index_type'].
+    The index is wrapped in an IndexIDMap so vectors are stored under their chunk
+    ids and can later be added and removed individually.
+
+    Returns the index and the index info to store next to it, which records the
+    index type and the search-time parameters the query side must apply.
+    """
+    num_vectors, embedding_dim = vectors_np.shape
+    index_type = params['index_type']
+    info = {'index_type': index_type, 'dimension': embedding_dim, 'num_vectors': num_vectors,
+            'build_params': build_params(params)}
+
+    if index_type == 'flat':
+        index = faiss.IndexFlatL2(embedding_dim)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(embedding_dim, params['hnsw_m'])
+        index.hnsw.efConstruction = params['hnsw_ef_construction']
+        info.update(hnsw_m=params['hnsw_m'], efSearch=params['hnsw_ef_search'])
+    else:
+        # FAISS wants roughly 39 training points per list; shrink nlist for small corpora.
+        nlist = min(params['ivf_nlist'], max(1, num_vectors // 39))
+        if nlist < params['ivf_nlist']:
+            print(f"Only {num_vectors} vectors; using nlist={nlist} instead of {params['ivf_nlist']}.")
+        quantizer = faiss.IndexFlatL2(embedding_dim)
+        if index_type == 'ivf_flat':
+            index = faiss.IndexIVFFlat(quantizer, embedding_dim, nlist)
+        else:
+            if embedding_dim % params['pq_m'] != 0:
+                raise ValueError(f"pq_m={params['pq_m']} must divide the embedding dimension {embedding_dim}.")
+            index = faiss.IndexIVFPQ(quantizer, embedding_dim, nlist, params['pq_m'], params['pq_nbits'])
+            info.update(pq_m=params['pq_m'], pq_nbits=params['pq_nbits'])
+        info.update(nlist=nlist, nprobe=min(params['ivf_nprobe'], nlist))
+
+    if not index.is_trained:
+        sample_size = min(num_vectors, params['train_sample_size'])
+        rng = np.random.default_rng(0)
+        sample = vectors_np[np.sort(rng.choice(num_vectors, size=sample_size, replace=False))]
+        print(f"Training {index_type} index on {sample_size} sampled vectors...")
+        index.train(sample)
+
+    index = faiss.IndexIDMap(index)
+    for start in range(0, num_vectors, ADD_BATCH_SIZE):
+        end = start + ADD_BATCH_SIZE
+        index.add_with_ids(vectors_np[start:end], ids_np[start:end])
+    return index, info
+
+def load_existing_index(data_dir: str, params: Dict[str, Any], embedding_dim: int):
+    """
+    Loads the published index if it can be updated: it must be an IndexIDMap of
+    the same index type, dimension and build parameters. Returns (index, info) or None.
+    """
+    index_path = os.path.join(index_dir(data_dir), 'faiss_index.bin')
+    info_path = os.path.join(index_dir(data_dir), 'faiss_index_info.json')
+    if not os.path.exists(index_path) or not os.path.exists(info_path):
+        return None
+    with open(info_path, 'r', encoding='utf-8') as f:
+        info = json.load(f)
+    if info.get('index_type') != params['index_type'] or info.get('dimension') != embedding_dim:
+        return None
+    wanted = build_params(params)
+    # Info files written before build_params was recorded only have some of them.
+    stored = info.get('build_params', {key: info[key] for key in ('hnsw_m', 'pq_m', 'pq_nbits') if key in info})
+    changed = [f"{key} {stored[key]} -> {wanted[key]}" for key in stored if key in wanted and stored[key] != wanted[key]]
+    if changed:
+        print(f"Index build parameters changed in settings.txt ({', '.join(changed)}); rebuilding.")
+        return None
+    index = faiss.read_index(index_path)
+    if not isinstance(index, faiss.IndexIDMap):
+        return None
+    return index, info
+
+def update_index(index: faiss.IndexIDMap, vectors_np: np.ndarray, ids_np: np.ndarray) -> Tuple[int, int]:
+    """
+    Brings an existing index in line with the current chunks: removes vectors whose
+    chunk id is gone and adds those whose chunk id is new.
+    Returns (added, removed).
+    """
+    existing = faiss.vector_to_array(index.id_map)
+    stale = np.setdiff1d(existing, ids_np)
+    new = ~np.isin(ids_np, existing)
+    if stale.size:
+        # Raises for index types without removal support (HNSW).
+        index.remove_ids(stale.astype(np.int64))
+    for start in range(0, len(ids_np), ADD_BATCH_SIZE):
+        end = start + ADD_BATCH_SIZE
+        batch_new = new[start:end]
+        if batch_new.any():
+            index.add_with_ids(np.ascontiguousarray(vectors_np[start:end][batch_new]), ids_np[start:end][batch_new])
+    return int(new.sum()), int(stale.size)
 
 def main():
     """
     Main routine:
-      1. Loads the embedded data from 'data/embedded_data.pkl'
-      2. Builds a FAISS index and corresponding metadata structure.
-      3. Saves the FAISS index as 'faiss_index.bin' and metadata as 'faiss_metadata.json' in the 'data/' folder.
+      1. Memory-maps the embeddings in 'data/embeddings.npy' and reads the chunk ids
+         from the 'data/embeddings_meta.jsonl' sidecar.
+      2. Updates a copy of the published FAISS index (removing vectors of deleted or
+         changed chunks, adding new ones), or builds a new index of the configured
+         index_type when there is none, the type or a build parameter (ivf_nlist, pq_m,
+         pq_nbits, hnsw_m, hnsw_ef_construction) changed, or --full is given. The
+         search parameters (ivf_nprobe, hnsw_ef_search) are taken from settings.txt
+         on every build.
+      3. Saves the FAISS index as 'faiss_index.bin', the chunk metadata as the memory-mapped
+         chunk store 'chunk_store/', the index type/search parameters as
+         'faiss_index_info.json', a copy of the BM25 index from 'data/bm25/' and links to
+         the embeddings it was built from in a new version directory 'data/index/<version>/'.
+      4. Publishes the version by replacing 'data/index/CURRENT'; running servers load it
+         in the background and switch over without a restart. Only the newest
+         index_versions_kept versions are kept.
     """
+    parser = argparse.ArgumentParser(description="Build the FAISS index and chunk store.")
+    parser.add_argument('--full', action='store_true', help="Rebuild the index from scratch.")
+    parser.add_argument('--course',
+                        help="Build the course bundle in courses/<course>/ instead of the default course.")
+    args = parser.parse_args()
+
     # Set base directory (parent of scripts/)
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    data_dir = os.path.join(base_dir, 'data')
-    embedded_data_path = os.path.join(data_dir, 'embedded_data.pkl')
+    bundle_dir = os.path.join(base_dir, 'courses', args.course) if args.course else base_dir
+    data_dir = os.path.join(bundle_dir, 'data')
+    settings = read_settings(os.path.join(bundle_dir, 'settings.txt'))
+    params = index_params_from_settings(settings)
 
-    if not os.path.exists(embedded_data_path):
-        print(f"Could not find {embedded_data_path}. Please run your embedding script first.")
+    if not embeddings_exist(data_dir):
+        if os.path.exists(os.path.join(data_dir, 'embedded_data.pkl')):
+            print("Found data/embedded_data.pkl from an older version. Please run scripts/convert_embedded_pickle.py first.")
+        else:
+            print(f"Could not find embeddings in {data_dir}. Please run your embedding script first.")
         sys.exit(0)
 
     # 1. Load the embedded data
-    print(f"Loading embedded data from {embedded_data_path}...")
-    with open(embedded_data_path, 'rb') as f:
-        embedded_data = pickle.load(f)
-    if not embedded_data:
+    print(f"Loading embeddings from {data_dir}...")
+    vectors_np = open_embeddings(data_dir)
+    ids_np = np.fromiter((record['chunk_id'] for record in read_embedding_meta(data_dir)), dtype=np.int64)
+    if not len(ids_np):
         print("No embedded data found. Exiting.")
         sys.exit(0)
 
-    # Determine embedding dimension from the first record
-    first_embedding = embedded_data[0]['embedding']
-    embedding_dim = len(first_embedding)
+    embedding_dim = vectors_np.shape[1]
     print(f"Detected embedding dimension: {embedding_dim}")
 
-    # 2. Build the FAISS index
-    print("Building FAISS index...")
-    faiss_index, metadata_list = build_faiss_index(embedded_data, embedding_dim)
-    print(f"Index built and populated with {len(metadata_list)} vectors.")
+    # 2. Update or build the FAISS index
+    existing = None if args.full else load_existing_index(data_dir, params, embedding_dim)
+    faiss_index = None
+    if existing:
+        faiss_index, index_info = existing
+        try:
+            added, removed = update_index(faiss_index, vectors_np, ids_np)
+            print(f"Updated existing {params['index_type']} index: {added} vectors added, {removed} removed.")
+        except RuntimeError as e:
+            print(f"Cannot update the existing index in place ({e}); rebuilding.")
+            faiss_index = None
+    if faiss_index is None:
+        print(f"Building FAISS index ({params['index_type']})...")
+        faiss_index, index_info = create_index(vectors_np, ids_np, params)
+    index_info['num_vectors'] = int(faiss_index.ntotal)
+    apply_search_settings(index_info, params)
+    print(f"Index ready with {faiss_index.ntotal} vectors.")
 
-    # 3. Save the FAISS index and metadata
-    faiss_index_path = os.path.join(data_dir, 'faiss_index.bin')
-    metadata_path = os.path.join(data_dir, 'faiss_metadata.json')
+    # 3. Save the FAISS index and metadata as a new version; files a server has open
+    # are never written to.
+    version, version_dir = new_version_dir(data_dir)
+    faiss_index_path = os.path.join(version_dir, 'faiss_index.bin')
+    chunk_store_dir = os.path.join(version_dir, 'chunk_store')
+    index_info_path = os.path.join(version_dir, 'faiss_index_info.json')
 
     print(f"Saving FAISS index to {faiss_index_path}...")
     faiss.write_index(faiss_index, faiss_index_path)
 
-    print(f"Saving metadata to {metadata_path}...")
-    with open(metadata_path, 'w', encoding='utf-8') as f:
-        json.dump(metadata_list, f, ensure_ascii=False, indent=2)
+    print(f"Saving chunk store to {chunk_store_dir}...")
+    write_chunk_store(chunk_store_dir, read_embedding_meta(data_dir))
+
+    print(f"Saving index info to {index_info_path}...")
+    with open(index_info_path, 'w', encoding='utf-8') as f:
+        json.dump(index_info, f, indent=2)
+
+    # scripts/generate_quizzes.py clusters the embeddings of the version it serves.
+    # embed_documents.py replaces these files rather than writing to them, so links
+    # keep this version's contents.
+    for name in (EMBEDDINGS_FILE, META_FILE):
+        link_or_copy(os.path.join(data_dir, name), os.path.join(version_dir, name))
+
+    bm25_dir = os.path.join(data_dir, 'bm25')
+    if os.path.isdir(bm25_dir):
+        print(f"Copying the BM25 index from {bm25_dir}...")
+        shutil.copytree(bm25_dir, os.path.join(version_dir, 'bm25'))
+
+    # 4. Switch servers to the new version
+    publish_version(data_dir, version, keep=int(settings.get('index_versions_kept', 3)))
+    print(f"Published index version {version}.")
 
     print("Done! FAISS index and metadata are ready for retrieval.")
 
@@ -1,17 +1,22 @@
 import os
 import csv
-import pickle
 import sys
-import time
+import argparse
+from functools import partial
 import numpy as np
 from typing import List, Dict, Any
 
+# Make the project root importable so the shared src modules can be used.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.manifest import load_manifest, save_manifest
+from src.embedding_store import EmbeddingWriter, embeddings_exist, open_embeddings, read_embedding_meta
+from src.embedding_scheduler import EmbeddingScheduler
+# Local encoders (SentenceTransformer or ONNX Runtime)
+from src.embeddings import load_encoder, encoder_id
+
 # For OpenAI embeddings
 from openai import OpenAI
 
-# For SentenceTransformer embeddings
-from sentence_transformers import SentenceTransformer
-
 def read_settings(settings_path: str) -> dict:
     """
     Reads simple key-value pairs from a settings.txt file.
@@ -32,90 +37,74 @@ def read_chopped_csv(csv_path: str) -> List[Dict[str, Any]]:
     Reads chunked data from a CSV file.
     Returns a list of dicts like:
       [
-        {'filename': 'doc.pdf', 'chunk_index': 0, 'chunk_text': '...'},
+        {'filename': 'doc.pdf', 'chunk_index': 0, 'chunk_text': '...', 'chunk_id': 0},
         ...
       ]
+    CSVs written before chunk ids existed get their row number as chunk id.
     """
     data = []
     with open(csv_path, 'r', encoding='utf-8') as f:
         reader = csv.DictReader(f)
-        for row in reader:
+        for i, row in enumerate(reader):
             data.append({
                 'filename': row['filename'],
                 'chunk_index': int(row['chunk_index']),
-                'chunk_text': row['chunk_text']
+                'chunk_text': row['chunk_text'],
+                'chunk_id': int(row['chunk_id']) if row.get('chunk_id') else i
             })
     return data
 
-def embed_with_openai(texts: List[str], model: str, max_tokens_per_batch: int, client: OpenAI) -> List[Dict[str, Any]]:
+def load_previous_embeddings(data_dir: str) -> tuple:
     """
-    Batches texts based on a maximum token count and sends them to the OpenAI API.
-    Uses a simple token count estimation (splitting on whitespace).
+    Memory-maps the embeddings written by the previous run.
+    Returns (vectors, {chunk_id: row}), or (None, {}) if there are none.
     """
-    def count_tokens(text: str) -> int:
-        return len(text.split())
-
-    embeddings = []
-    batch = []
-    current_tokens = 0
-    for text in texts:
-        tokens = count_tokens(text)
-        if current_tokens + tokens > max_tokens_per_batch:
-            # Process the current batch
-            response = client.embeddings.create(model=model, input=batch)
-            embeddings.extend(response.data)
-            batch = []
-            current_tokens = 0
-            print("Waiting 60 seconds before sending next batch...")
-            time.sleep(60)
-        batch.append(text)
-        current_tokens += tokens
-    if batch:
-        response = client.embeddings.create(model=model, input=batch)
-        embeddings.extend(response.data)
-    return embeddings
-
-def generate_embeddings_openai(data: List[Dict[str, Any]], model_name: str, max_tokens_per_batch: int, client: OpenAI) -> List[Dict[str, Any]]:
+    if not embeddings_exist(data_dir):
+        return None, {}
+    rows = {record['chunk_id']: i for i, record in enumerate(read_embedding_meta(data_dir))}
+    return open_embeddings(data_dir), rows
+
+def generate_embeddings_openai(texts: List[str], scheduler: EmbeddingScheduler) -> np.ndarray:
     """
-    Generates embeddings using OpenAI's API.
+    Generates embeddings using OpenAI's API, paced by the scheduler's rate limits.
     """
-    texts = [d['chunk_text'] for d in data]
-    print(f"Generating embeddings using OpenAI model: {model_name} ...")
-    embeddings_response = embed_with_openai(texts, model=model_name, max_tokens_per_batch=max_tokens_per_batch, client=client)
-    for i, emb in enumerate(embeddings_response):
-        data[i]['embedding'] = emb['embedding']
-    return data
+    return scheduler.embed(texts)
 
-def generate_embeddings_sentence_transformer(data: List[Dict[str, Any]], model_name: str) -> List[Dict[str, Any]]:
+def generate_embeddings_local(texts: List[str], encoder) -> np.ndarray:
     """
-    Generates embeddings using a SentenceTransformer model.
+    Generates embeddings using a local encoder from src.embeddings
+    (SentenceTransformer or the quantized ONNX export).
     """
-    model = SentenceTransformer(model_name)
-    texts = [d['chunk_text'] for d in data]
-    print(f"Generating embeddings using SentenceTransformer model: {model_name} ...")
-    embeddings = model.encode(texts, batch_size=16, show_progress_bar=True)
-    for i, emb in enumerate(embeddings):
-        data[i]['embedding'] = emb.tolist()  # convert numpy array to list for serialization
-    return data
+    return encoder.encode(texts)
 
 def main():
     """
     Main routine:
       1. Reads chunked text from 'data/chopped_text.csv'.
-      2. Generates embeddings using either OpenAI or SentenceTransformer (based on settings).
-      3. Saves the resulting data (with text and embeddings) to 'data/embedded_data.pkl'.
+      2. Reuses the previous embeddings of chunks that are unchanged (same chunk id and
+         embedding model) and generates embeddings for the rest using OpenAI,
+         SentenceTransformer or the quantized ONNX export (based on settings).
+      3. Streams the float32 vectors to 'data/embeddings.npy' and the chunk records to the
+         'data/embeddings_meta.jsonl' sidecar, one batch at a time.
     """
+    parser = argparse.ArgumentParser(description="Embed the chunked course documents.")
+    parser.add_argument('--full', action='store_true', help="Re-embed every chunk.")
+    parser.add_argument('--course',
+                        help="Build the course bundle in courses/<course>/ instead of the default course.")
+    args = parser.parse_args()
+
     # Determine the project base directory (parent of the 'scripts' folder)
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    settings_path = os.path.join(base_dir, 'settings.txt')
-    data_dir = os.path.join(base_dir, 'data')
+    # A course bundle has its own settings and data; models stay in the project.
+    bundle_dir = os.path.join(base_dir, 'courses', args.course) if args.course else base_dir
+    settings_path = os.path.join(bundle_dir, 'settings.txt')
+    data_dir = os.path.join(bundle_dir, 'data')
     chopped_csv_path = os.path.join(data_dir, 'chopped_text.csv')
-    output_pickle_path = os.path.join(data_dir, 'embedded_data.pkl')
 
     # Read settings
     settings = read_settings(settings_path)
 
-    # Determine which embedding method to use: "openai" or "sentence-transformers"
+    # Determine which embedding method to use: "openai", "sentence-transformers" or "onnx"
     embedding_method = settings.get("embedding_method", "sentence-transformers").lower()
 
     # Read chunked text data
@@ -128,7 +117,17 @@ def main():
         print("No data found in CSV. Exiting.")
         sys.exit(0)
 
-    if embedding_method == "openai":
+    embedding_model = encoder_id(settings)
+
+    # Only chunks without an embedding from the same model need to be embedded.
+    manifest = load_manifest(data_dir)
+    previous_vectors, previous_rows = None, {}
+    if not args.full and manifest.get('embedding_model') == embedding_model:
+        previous_vectors, previous_rows = load_previous_embeddings(data_dir)
+    num_to_embed = sum(1 for record in chopped_data if record['chunk_id'] not in previous_rows)
+    print(f"Reusing {len(chopped_data) - num_to_embed} embeddings; {num_to_embed} chunks to embed.")
+
+    if num_to_embed and embedding_method == "openai":
         # Load OpenAI API key from APIkey.txt
         api_key_path = os.path.join(base_dir, "APIkey.txt")
         if not os.path.exists(api_key_path):
@@ -136,24 +135,60 @@ def main():
             sys.exit(0)
         with open(api_key_path, 'r') as key_file:
             api_key = key_file.read().strip()
-        client = OpenAI(api_key=api_key)  # Initialize the OpenAI client here.
+        # Rate limits are handled by the scheduler, not the client's own retries.
+        client = OpenAI(api_key=api_key, max_retries=0)  # Initialize the OpenAI client here.
         model_name = settings.get("openai_embedding_model", "text-embedding-ada-002")
-        max_tokens_per_batch = int(settings.get("max_tokens_per_batch", 250000))
-        embedded_data = generate_embeddings_openai(chopped_data, model_name, max_tokens_per_batch, client)
+        scheduler = EmbeddingScheduler(
+            client,
+            model_name,
+            tokens_per_minute=int(settings.get("openai_embedding_tpm", 1000000)),
+            requests_per_minute=int(settings.get("openai_embedding_rpm", 3000)),
+            max_tokens_per_request=int(settings.get("max_tokens_per_batch", 250000)),
+            concurrency=int(settings.get("openai_embedding_concurrency", 4)),
+        )
+        print(f"Generating embeddings using OpenAI model: {model_name} ...")
+        encode = partial(generate_embeddings_openai, scheduler=scheduler)
+        # Large enough for several requests to be in flight per write batch.
+        write_batch = int(settings.get("openai_embedding_write_batch", 8192))
+    elif num_to_embed:
+        # Local SentenceTransformer or ONNX embeddings
+        try:
+            encoder = load_encoder(settings, base_dir)
+        except FileNotFoundError as e:
+            print(e)
+            sys.exit(1)
+        print(f"Generating embeddings using {embedding_method} model: {encoder.name} ...")
+        encode = partial(generate_embeddings_local, encoder=encoder)
+        write_batch = int(settings.get("embedding_write_batch", 1024))
     else:
-        # Default to SentenceTransformer embeddings
-        model_name = settings.get("sentence_transformer_model", "sentence-transformers/all-MiniLM-L6-v2")
-        embedded_data = generate_embeddings_sentence_transformer(chopped_data, model_name)
-
-    # Save the embedded data to a pickle file
-    os.makedirs(data_dir, exist_ok=True)
-    with open(output_pickle_path, 'wb') as f:
-        pickle.dump(embedded_data, f)
-
-    print(f"Successfully wrote embeddings to {output_pickle_path}")
-    print("Sample record:", embedded_data[0])
+        encode = None
+        write_batch = len(chopped_data)
+
+    # Stream the vectors to disk one batch at a time, copying reused rows from the
+    # previous (memory-mapped) file and embedding the rest.
+    writer = EmbeddingWriter(data_dir, len(chopped_data))
+    for start in range(0, len(chopped_data), write_batch):
+        batch = chopped_data[start:start + write_batch]
+        missing = [i for i, record in enumerate(batch) if record['chunk_id'] not in previous_rows]
+        new_vectors = encode([batch[i]['chunk_text'] for i in missing]) if missing else None
+        dim = new_vectors.shape[1] if new_vectors is not None else previous_vectors.shape[1]
+        vectors = np.empty((len(batch), dim), dtype=np.float32)
+        if missing:
+            vectors[missing] = new_vectors
+        reused = [i for i, record in enumerate(batch) if record['chunk_id'] in previous_rows]
+        if reused:
+            vectors[reused] = previous_vectors[[previous_rows[batch[i]['chunk_id']] for i in reused]]
+        writer.write(batch, vectors)
+        print(f"Wrote {writer.rows_written}/{len(chopped_data)} embeddings.")
+    # Release the previous file's mapping before it is replaced.
+    previous_vectors = None
+    writer.close()
+
+    manifest['embedding_model'] = embedding_model
+    save_manifest(data_dir, manifest)
+
+    print(f"Successfully wrote {len(chopped_data)} embeddings of dimension {dim} to {data_dir}")
     print("Done!")
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,159 @@
+import os
+import csv
+import sys
+import json
+import argparse
+import numpy as np
+from typing import List
+
+# Make the project root importable so the shared src modules can be used.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.embeddings import (
+    DEFAULT_SENTENCE_MODEL, DEFAULT_ONNX_MODEL_DIR,
+    ONNX_MODEL_FILE, ONNX_CONFIG_FILE, OnnxEncoder,
+)
+
+# Minimum cosine similarity between the torch and ONNX embedding of any text.
+PARITY_THRESHOLD = 0.99
+
+# Used for the parity check when there is no chopped_text.csv yet.
+SAMPLE_TEXTS = [
+    "What is the marginal cost of electricity generation?",
+    "Какво е пределна цена на електроенергията?",
+    "The day-ahead market clears once per day for every hour of the following day.",
+    "Балансиращият пазар компенсира отклоненията между график и реално производство.",
+    "a",
+    " ".join(["Long input that is truncated at the model's maximum sequence length."] * 60),
+]
+
+
+def read_settings(settings_path: str) -> dict:
+    """
+    Reads simple key-value pairs from a settings.txt file.
+    Expected format (one key=value per line).
+    """
+    settings = {}
+    with open(settings_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            key, value = line.split('=', 1)
+            settings[key.strip()] = value.strip()
+    return settings
+
+def parity_texts(csv_path: str, limit: int) -> List[str]:
+    """
+    Up to `limit` chunks of the course material, plus fixed samples covering both
+    languages, a one-token input and an input longer than the model accepts.
+    """
+    texts = list(SAMPLE_TEXTS)
+    if os.path.exists(csv_path):
+        with open(csv_path, 'r', encoding='utf-8') as f:
+            for i, row in enumerate(csv.DictReader(f)):
+                if i >= limit:
+                    break
+                texts.append(row['chunk_text'])
+    return texts
+
+def export(st_model, model_name: str, output_dir: str) -> None:
+    """
+    Exports the transformer of a SentenceTransformer model to ONNX, quantizes its
+    weights to int8 and writes the tokenizer and pooling settings next to it.
+    """
+    import torch
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+    fp32_path = os.path.join(output_dir, 'model.onnx')
+
+    dummy = tokenizer(["export sample"], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in dummy]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(dummy[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+        )
+    print(f"Exported fp32 model to {fp32_path}")
+
+    quantize_dynamic(fp32_path, os.path.join(output_dir, ONNX_MODEL_FILE), weight_type=QuantType.QInt8)
+    print(f"Wrote int8 model to {os.path.join(output_dir, ONNX_MODEL_FILE)}")
+
+    tokenizer.save_pretrained(output_dir)
+    pooling = st_model[1]
+    if getattr(pooling, 'pooling_mode_mean_tokens', True) is not True:
+        print("Warning: the model does not use mean pooling; the ONNX encoder always mean-pools.")
+    config = {
+        'source_model': model_name,
+        'dimension': st_model.get_sentence_embedding_dimension(),
+        'max_seq_length': st_model.max_seq_length,
+        'normalize': any(type(module).__name__ == 'Normalize' for module in st_model),
+        'pad_token': tokenizer.pad_token,
+        'pad_token_id': tokenizer.pad_token_id,
+    }
+    with open(os.path.join(output_dir, ONNX_CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+
+def check_parity(st_model, output_dir: str, texts: List[str]) -> float:
+    """
+    Embeds the texts with both models and returns the lowest cosine similarity.
+    """
+    reference = np.asarray(st_model.encode(texts, batch_size=16, show_progress_bar=False), dtype=np.float32)
+    candidate = OnnxEncoder(output_dir).encode(texts)
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate /= np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines = (reference * candidate).sum(axis=1)
+    print(f"Cosine similarity over {len(texts)} texts: min {cosines.min():.4f}, "
+          f"mean {cosines.mean():.4f}, worst text #{int(cosines.argmin())}")
+    return float(cosines.min())
+
+def main():
+    """
+    Main routine:
+      1. Loads the SentenceTransformer model named in settings.txt.
+      2. Exports its transformer to ONNX and quantizes it to int8 in
+         'models/all-MiniLM-L6-v2-onnx' (or onnx_model_dir from settings).
+      3. Checks parity: every text's ONNX embedding must have cosine similarity
+         >= 0.99 with the torch embedding, using chunks from 'data/chopped_text.csv'
+         when available. Exits with status 1 otherwise.
+
+    Set embedding_method=onnx in settings.txt to use the export, then re-run
+    embed_documents.py and create_final_data.py, since queries and corpus must be
+    embedded by the same model.
+    """
+    parser = argparse.ArgumentParser(description="Export the sentence embedding model to quantized ONNX.")
+    parser.add_argument('--check-only', action='store_true', help="Only run the parity check on an existing export.")
+    parser.add_argument('--parity-texts', type=int, default=500, help="Course chunks used for the parity check.")
+    args = parser.parse_args()
+
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    settings = read_settings(os.path.join(base_dir, 'settings.txt'))
+    model_name = settings.get("sentence_transformer_model", DEFAULT_SENTENCE_MODEL)
+    output_dir = os.path.join(base_dir, settings.get("onnx_model_dir", DEFAULT_ONNX_MODEL_DIR))
+
+    from sentence_transformers import SentenceTransformer
+    print(f"Loading SentenceTransformer model: {model_name} ...")
+    st_model = SentenceTransformer(model_name, device='cpu')
+
+    if not args.check_only:
+        os.makedirs(output_dir, exist_ok=True)
+        export(st_model, model_name, output_dir)
+
+    texts = parity_texts(os.path.join(base_dir, 'data', 'chopped_text.csv'), args.parity_texts)
+    worst = check_parity(st_model, output_dir, texts)
+    if worst < PARITY_THRESHOLD:
+        print(f"Parity check failed: minimum cosine {worst:.4f} < {PARITY_THRESHOLD}.")
+        sys.exit(1)
+    print("Parity check passed.")
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
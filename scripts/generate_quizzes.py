@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import argparse
+
+# Make the project root importable so the shared src modules can be used.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.embedding_store import embeddings_exist
+from src.engine import QAEngine
+from src.quiz_generation import CHUNKS_PER_QUIZ, generate_quizzes, plan_missing
+from src.settings import DEFAULT_COURSE
+
+
+def main():
+    """
+    Main routine:
+      1. Loads the course's engine on the published index; opening its quiz bank
+         (data/quiz_bank.sqlite) carries the quizzes of an earlier index version
+         whose chunks are unchanged over to this one and drops the rest.
+      2. Clusters the embeddings of the indexed chunks with FAISS k-means into
+         --clusters clusters (default: the square root of the number of chunks).
+      3. Plans up to --per-cluster quizzes per cluster, each from the
+         --chunks-per-quiz chunks nearest the centroid that no stored quiz was
+         written from yet, so repeated runs only fill the gaps.
+      4. Generates them with the m: prompt, --concurrency at a time, and stores
+         each with its chunk ids and topic embedding under the index version.
+         Servers pick them up on their next m: request.
+
+    Run it once to fill the bank. Servers that switch to a new index version
+    regenerate the quizzes it dropped in the background (quiz_refill in
+    settings.txt), the same way.
+    """
+    parser = argparse.ArgumentParser(description="Pre-generate multiple-choice quizzes for m: requests.")
+    parser.add_argument('--course',
+                        help="Generate for the course bundle in courses/<course>/ instead of the default course.")
+    parser.add_argument('--clusters', type=int, help="Number of chunk clusters (default: sqrt of the chunk count).")
+    parser.add_argument('--per-cluster', type=int, help="Quizzes per cluster (quiz_per_cluster in settings.txt, default 2).")
+    parser.add_argument('--chunks-per-quiz', type=int, default=CHUNKS_PER_QUIZ)
+    parser.add_argument('--max-quizzes', type=int, default=0, help="Generate at most this many (0: no limit).")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=60.0, help="Seconds per quiz completion.")
+    parser.add_argument('--regenerate', action='store_true',
+                        help="Delete the stored quizzes of this index version first.")
+    parser.add_argument('--dry-run', action='store_true', help="Print the plan without generating anything.")
+    args = parser.parse_args()
+
+    # Set base directory (parent of scripts/)
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    bundle_dir = os.path.join(base_dir, 'courses', args.course) if args.course else base_dir
+    data_dir = os.path.join(bundle_dir, 'data')
+    if not embeddings_exist(data_dir):
+        print(f"Could not find embeddings in {data_dir}. Please run your embedding script first.")
+        sys.exit(0)
+
+    # 1. Load the engine and refresh the quiz bank
+    engine = QAEngine(os.path.join(bundle_dir, 'settings.txt'), data_dir, course_id=args.course or DEFAULT_COURSE)
+    bank = engine.quiz_bank
+    if bank is None:
+        print("quiz_bank is off in settings.txt; nothing to do.")
+        sys.exit(0)
+    # The whole run stays on the version loaded here, even if a newer one is
+    # published meanwhile: quizzes belong to the version their chunks come from.
+    with engine.pinned_index():
+        if args.regenerate:
+            print(f"Deleted {bank.clear()} quizzes of index version {engine.index_version}.")
+        version = engine.index_version
+
+        # 2-3. Cluster the indexed chunks and plan the quizzes still missing
+        print("Clustering the indexed chunks...")
+        vectors, ids, groups = plan_missing(engine, args.clusters, args.per_cluster, args.chunks_per_quiz)
+        if not len(ids):
+            print("No indexed chunks found. Exiting.")
+            sys.exit(0)
+        if args.max_quizzes:
+            groups = groups[:args.max_quizzes]
+        print(f"Index version {version}: {bank.count(version)} quizzes stored, {len(groups)} to generate.")
+        if args.dry_run or not groups:
+            engine.close()
+            return
+
+        # 4. Generate and store them
+        start = time.time()
+
+        def report(done, failed):
+            if done % 50 == 0:
+                print(f"{done}/{len(groups)} quizzes generated...")
+
+        done, failed = generate_quizzes(engine, vectors, ids, groups, version, args.concurrency, args.timeout,
+                                        on_done=report)
+
+        print(f"Generated {done} quizzes in {time.time() - start:.1f}s ({failed} failed); "
+              f"{bank.count(version)} stored for index version {version}.")
+    engine.close()
+
+if __name__ == "__main__":
+    main()
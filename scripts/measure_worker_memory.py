@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import subprocess
+import urllib.request
+from typing import Dict, List
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read_memory(pid: int) -> Dict[str, int]:
+    """
+    RSS, PSS, USS (private pages) and shared pages of a process in bytes,
+    from /proc/<pid>/smaps_rollup (Linux 4.14+).
+    """
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    except OSError:
+        return {'rss': 0, 'pss': 0, 'uss': 0, 'shared': 0}
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'uss': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+        'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+    }
+
+def child_pids(pid: int) -> List[int]:
+    """
+    Pids of the processes whose parent is `pid`.
+    """
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                # The command name in parentheses can contain spaces.
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return children
+
+def send_queries(url: str, queries: List[str], timeout: float):
+    for query in queries:
+        body = json.dumps({'query': query}).encode('utf-8')
+        req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                resp.read()
+        except Exception as e:
+            print(f"  request failed: {e}")
+
+def measure(workers: int, preload: bool, args) -> Dict[str, float]:
+    """
+    Starts gunicorn with `workers` workers, waits until every worker has
+    warmed up (and answered --requests queries), and returns the memory of
+    the master and the workers in MB.
+    """
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), PRELOAD='on' if preload else 'off', LOG_LEVEL='info')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(project_root, 'gunicorn.conf.py'),
+         '-b', f'127.0.0.1:{args.port}', 'src.app:app'],
+        cwd=project_root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    warmed = threading.Semaphore(0)
+
+    def read_log():
+        for line in server.stderr:
+            if ' warmed.' in line or 'Warming worker' in line:
+                warmed.release()
+            if args.verbose:
+                sys.stderr.write(line)
+
+    threading.Thread(target=read_log, daemon=True).start()
+    try:
+        deadline = time.time() + args.startup_timeout
+        for _ in range(workers):
+            if not warmed.acquire(timeout=max(0.0, deadline - time.time())):
+                raise RuntimeError(f"Workers not warmed within {args.startup_timeout:.0f}s; rerun with --verbose.")
+        if args.requests:
+            queries = [args.query] * args.requests
+            send_queries(f'http://127.0.0.1:{args.port}/api/chat', queries, args.timeout)
+        time.sleep(args.settle)
+
+        master = read_memory(server.pid)
+        worker_memory = [read_memory(pid) for pid in child_pids(server.pid)]
+        mb = 2 ** 20
+        mean = lambda key: sum(m[key] for m in worker_memory) / max(1, len(worker_memory)) / mb
+        return {
+            'workers': len(worker_memory),
+            'preload': preload,
+            'worker_uss_mb': mean('uss'),
+            'worker_pss_mb': mean('pss'),
+            'worker_rss_mb': mean('rss'),
+            'master_rss_mb': master['rss'] / mb,
+            'total_pss_mb': (master['pss'] + sum(m['pss'] for m in worker_memory)) / mb,
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+def main():
+    """
+    Main routine:
+      1. For each worker count in --workers and each of --preload on/off, starts
+         gunicorn with gunicorn.conf.py on --port and waits until every worker
+         has created the engines of the preload courses.
+      2. Optionally sends --requests queries to /api/chat, so the pages a
+         request touches are counted too (start scripts/openai_stub.py and set
+         OPENAI_BASE_URL=http://127.0.0.1:8001/v1 to run offline).
+      3. Prints the mean unique (USS), proportional (PSS) and resident (RSS)
+         memory per worker, and the total PSS of master and workers: the memory
+         the server really uses. Linux only.
+    """
+    parser = argparse.ArgumentParser(description="Per-worker memory of the gunicorn server.")
+    parser.add_argument('--workers', default='1,4,8', help="Comma-separated worker counts.")
+    parser.add_argument('--preload', default='on,off', help="Comma-separated preload modes (on/off).")
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--requests', type=int, default=0, help="Queries sent before measuring.")
+    parser.add_argument('--query', default="What is gradient descent?")
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--startup-timeout', type=float, default=600.0)
+    parser.add_argument('--settle', type=float, default=2.0, help="Seconds to wait before measuring.")
+    parser.add_argument('--save', help="Write the results to this JSON file.")
+    parser.add_argument('--verbose', action='store_true', help="Show the server log.")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'workers':>8}{'preload':>9}{'USS/worker':>12}{'PSS/worker':>12}{'RSS/worker':>12}"
+          f"{'master RSS':>12}{'total PSS':>11}")
+    for workers in [int(n) for n in args.workers.split(',')]:
+        for mode in args.preload.split(','):
+            result = measure(workers, mode.strip().lower() == 'on', args)
+            results.append(result)
+            print(f"{result['workers']:>8}{'on' if result['preload'] else 'off':>9}"
+                  f"{result['worker_uss_mb']:>10.0f}MB{result['worker_pss_mb']:>10.0f}MB"
+                  f"{result['worker_rss_mb']:>10.0f}MB{result['master_rss_mb']:>10.0f}MB"
+                  f"{result['total_pss_mb']:>9.0f}MB")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.save}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import os
+import sys
+import json
+
+# Make the project root importable so the shared src modules can be used.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.chunk_store import write_chunk_store
+
+
+def main():
+    """
+    One-off migration for data built before the chunk store existed:
+      1. Loads 'data/faiss_metadata.json' (a list of chunk dicts in vector-id order).
+      2. Writes the same chunks to the memory-mapped chunk store 'data/chunk_store/'.
+
+    The existing faiss_index.bin is kept as is; vector ids line up because the
+    chunk order is preserved. The JSON file can be deleted afterwards.
+    """
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    data_dir = os.path.join(base_dir, 'data')
+    metadata_path = os.path.join(data_dir, 'faiss_metadata.json')
+    chunk_store_dir = os.path.join(data_dir, 'chunk_store')
+
+    if not os.path.exists(metadata_path):
+        print(f"Could not find {metadata_path}. Nothing to migrate.")
+        sys.exit(0)
+
+    print(f"Loading metadata from {metadata_path}...")
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+
+    print(f"Writing chunk store to {chunk_store_dir}...")
+    count = write_chunk_store(chunk_store_dir, metadata)
+    print(f"Done! Migrated {count} chunks. You can now delete {metadata_path}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import itertools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+# Make the project root importable so the shared src modules can be used.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.embedding_scheduler import TokenBucket
+
+
+def fake_embedding(text: str, dim: int) -> np.ndarray:
+    """
+    Deterministic unit vector for a text, so repeated runs embed identically.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+def fake_reply(messages: list, words: int) -> str:
+    """
+    Deterministic answer-like text for a conversation.
+    """
+    seed = hashlib.sha256(json.dumps(messages, sort_keys=True).encode('utf-8')).digest()
+    rng = random.Random(seed)
+    vocabulary = ("the model", "gradient", "loss", "layer", "is", "updates", "each", "weights",
+                  "training", "data", "so", "we", "compute", "error", "and", "then")
+    return " ".join(rng.choice(vocabulary) for _ in range(words)).capitalize() + "."
+
+
+class StubState:
+    """
+    Configuration and rate limits shared by all request handler threads.
+    """
+
+    def __init__(self, args):
+        self.latency = args.latency_ms / 1000.0
+        self.jitter = args.jitter_ms / 1000.0
+        self.dim = args.dim
+        self.reply_words = args.reply_words
+        self.token_delay = args.token_ms / 1000.0
+        self.yes_rate = args.yes_rate
+        self.tokens = TokenBucket(args.tpm) if args.tpm else None
+        self.requests = TokenBucket(args.rpm) if args.rpm else None
+        self.lock = threading.Lock()
+        self.num_requests = 0
+        self.num_rate_limited = 0
+        self.ids = itertools.count()
+
+    def sleep(self):
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def admit(self, tokens: int) -> float:
+        """
+        Returns 0 if the request fits the configured limits, otherwise the
+        number of seconds the client should wait.
+        """
+        with self.lock:
+            self.num_requests += 1
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            wait = bucket.try_acquire(amount) if bucket else 0.0
+            if wait:
+                with self.lock:
+                    self.num_rate_limited += 1
+                return wait
+        return 0.0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state: StubState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if self.path.rstrip('/').endswith('/embeddings'):
+            self.handle_embeddings(request)
+        elif self.path.rstrip('/').endswith('/chat/completions'):
+            self.handle_chat(request)
+        else:
+            self.send_json(404, {'error': {'message': f'Unknown endpoint {self.path}'}})
+
+    def rate_limited(self, tokens: int) -> bool:
+        wait = self.state.admit(tokens)
+        if wait:
+            self.send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}},
+                           headers={'retry-after-ms': str(int(wait * 1000)), 'x-ratelimit-reset-tokens': f'{wait:.3f}s'})
+        return bool(wait)
+
+    def handle_embeddings(self, request):
+        inputs = request.get('input', [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        # Rough token count; the stub only needs it for rate limiting.
+        tokens = sum(len(text.split()) for text in inputs)
+        if self.rate_limited(tokens):
+            return
+        self.state.sleep()
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text, self.state.dim)
+            if request.get('encoding_format') == 'base64':
+                embedding = base64.b64encode(vector.tobytes()).decode('ascii')
+            else:
+                embedding = vector.tolist()
+            data.append({'object': 'embedding', 'index': i, 'embedding': embedding})
+        self.send_json(200, {
+            'object': 'list',
+            'data': data,
+            'model': request.get('model', 'stub'),
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+        })
+
+    def handle_chat(self, request):
+        messages = request.get('messages', [])
+        tokens = sum(len(str(message.get('content', '')).split()) for message in messages)
+        if self.rate_limited(tokens):
+            return
+        # Yes/no gates ask for a handful of tokens; anything else gets an answer.
+        if (request.get('max_tokens') or 1000) <= 5:
+            content = "Yes" if random.random() < self.state.yes_rate else "No"
+        else:
+            content = fake_reply(messages, self.state.reply_words)
+        completion_id = f"chatcmpl-stub{next(self.state.ids)}"
+        model = request.get('model', 'stub')
+        self.state.sleep()
+        if not request.get('stream'):
+            self.send_json(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': tokens, 'completion_tokens': len(content.split()),
+                          'total_tokens': tokens + len(content.split())},
+            })
+            return
+        # Server-sent events, one word per chunk; the connection closes at the end.
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        pieces = [{'role': 'assistant', 'content': ''}]
+        pieces += [{'content': word + " "} for word in content.split()]
+        for i, delta in enumerate(pieces + [{}]):
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': None if delta else 'stop'}],
+            }
+            if i > 1 and delta:
+                time.sleep(self.state.token_delay)
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def main():
+    """
+    Local stand-in for the OpenAI API, for benchmarks that must run offline.
+    Serves POST /v1/embeddings with deterministic vectors and
+    POST /v1/chat/completions, streamed or not, with configurable latency, and
+    optional tokens/requests-per-minute limits answered with 429s and retry
+    headers like the real API.
+
+    Chat requests with max_tokens <= 5 are taken for the yes/no gates and
+    answered "Yes" with probability --yes-rate, else "No"; other requests get
+    --reply-words words of deterministic text, streamed --token-ms apart.
+
+    Point a client at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+    """
+    parser = argparse.ArgumentParser(description="Offline OpenAI API stub.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency-ms', type=float, default=200.0, help="Latency added to every request.")
+    parser.add_argument('--jitter-ms', type=float, default=50.0, help="Uniform +/- jitter on the latency.")
+    parser.add_argument('--dim', type=int, default=1536, help="Embedding dimension.")
+    parser.add_argument('--reply-words', type=int, default=120, help="Words in a chat answer.")
+    parser.add_argument('--token-ms', type=float, default=10.0, help="Delay between streamed answer words.")
+    parser.add_argument('--yes-rate', type=float, default=0.9, help="Share of yes/no gates answered Yes.")
+    parser.add_argument('--tpm', type=int, default=0, help="Tokens per minute before answering 429 (0: unlimited).")
+    parser.add_argument('--rpm', type=int, default=0, help="Requests per minute before answering 429 (0: unlimited).")
+    args = parser.parse_args()
+
+    StubHandler.state = StubState(args)
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"OpenAI stub listening on http://{args.host}:{args.port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        state = StubHandler.state
+        print(f"Served {state.num_requests} requests, {state.num_rate_limited} rate limited.", flush=True)
+
+if __name__ == "__main__":
+    main()
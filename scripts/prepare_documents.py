@@ -3,16 +3,16 @@ import re
 import csv
 import glob
 import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import PyPDF2
 import docx
 
-# Optionally, if you want more robust tokenization you could uncomment the next lines:
-import nltk
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
-from nltk.tokenize import word_tokenize
+# Make the project root importable so the shared src modules can be used.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.manifest import load_manifest, save_manifest, file_sha256
+from src.bm25 import write_bm25_index
 
 def read_settings(settings_path: str) -> dict:
     """
@@ -29,14 +29,19 @@ def read_settings(settings_path: str) -> dict:
             settings[key.strip()] = value.strip()
     return settings
 
-def extract_text_from_pdf(pdf_path: str) -> str:
+def count_pdf_pages(pdf_path: str) -> int:
+    with open(pdf_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+def extract_text_from_pdf(pdf_path: str, start_page: int = 0, end_page: int = None) -> str:
     """
     Extracts text from a PDF file using PyPDF2.
+    Only pages [start_page, end_page) are read when a range is given.
     """
     text_content = []
     with open(pdf_path, 'rb') as file:
         reader = PyPDF2.PdfReader(file)
-        for page in reader.pages:
+        for page in reader.pages[start_page:end_page]:
             page_text = page.extract_text()
             if page_text:
                 text_content.append(page_text)
@@ -75,8 +80,6 @@ def chunk_text(text: str, chunk_size: int = 200, overlap: int = 100, title: str
     
     You can adjust chunk_size and overlap as needed.
     """
-    # If you prefer robust tokenization, replace the next line with:
-    # words = word_tokenize(text)
     words = text.split()
     chunks = []
     start = 0
@@ -91,24 +94,146 @@ def chunk_text(text: str, chunk_size: int = 200, overlap: int = 100, title: str
         start += (chunk_size - overlap)
     return chunks
 
+def extract_text(fpath: str) -> str:
+    """
+    Extracts the raw text of a PDF, DOCX, TXT or TEX file.
+    Returns None for unsupported file types.
+    """
+    ext = os.path.splitext(fpath)[1].lower()
+    if ext == '.pdf':
+        return extract_text_from_pdf(fpath)
+    elif ext == '.docx':
+        return extract_text_from_docx(fpath)
+    elif ext == '.txt':
+        return extract_text_from_txt(fpath)
+    elif ext == '.tex':
+        return extract_text_from_tex(fpath)
+    return None
+
+def chunk_document(text: str, filename: str, chunk_size: int, overlap: int) -> list:
+    """
+    Cleans up whitespace and splits a document into (filename, chunk_index, chunk_text) rows.
+    """
+    text = re.sub(r'\s+', ' ', text).strip()
+    chunks = chunk_text(text, chunk_size=chunk_size, overlap=overlap, title=filename)
+    return [(filename, i, chunk) for i, chunk in enumerate(chunks)]
+
+def process_file(fpath: str, chunk_size: int, overlap: int) -> tuple:
+    """
+    Extracts and chunks one file. Returns (rows, seconds), or (None, seconds)
+    if the file type is not supported.
+    """
+    start = time.perf_counter()
+    text = extract_text(fpath)
+    if text is None:
+        return None, time.perf_counter() - start
+    rows = chunk_document(text, os.path.basename(fpath), chunk_size, overlap)
+    return rows, time.perf_counter() - start
+
+def extract_pdf_range(fpath: str, start_page: int, end_page: int) -> tuple:
+    """
+    Extracts one page range of a large PDF. Returns (text, seconds).
+    """
+    start = time.perf_counter()
+    text = extract_text_from_pdf(fpath, start_page, end_page)
+    return text, time.perf_counter() - start
+
+def timed_chunk_document(text: str, filename: str, chunk_size: int, overlap: int) -> tuple:
+    start = time.perf_counter()
+    rows = chunk_document(text, filename, chunk_size, overlap)
+    return rows, time.perf_counter() - start
+
+def process_files_parallel(files: list, chunk_size: int, overlap: int, workers: int, pages_per_task: int) -> list:
+    """
+    Processes files in a process pool. Whole files are one task each; PDFs longer
+    than `pages_per_task` pages are split into page-range tasks whose texts are
+    joined in page order before chunking.
+
+    Returns a list of (rows, seconds) in the order of `files`, where seconds is
+    the worker time spent on that file.
+    """
+    results = [None] * len(files)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        file_futures = {}
+        range_futures = {}
+        for i, fpath in enumerate(files):
+            num_pages = count_pdf_pages(fpath) if fpath.lower().endswith('.pdf') else 0
+            if num_pages > pages_per_task:
+                range_futures[i] = [
+                    pool.submit(extract_pdf_range, fpath, start, min(start + pages_per_task, num_pages))
+                    for start in range(0, num_pages, pages_per_task)
+                ]
+            else:
+                file_futures[i] = pool.submit(process_file, fpath, chunk_size, overlap)
+
+        # Chunk split PDFs once all of their page ranges are extracted.
+        chunk_futures = {}
+        for i, futures in range_futures.items():
+            parts = [f.result() for f in futures]
+            text = "\n".join(text for text, _ in parts if text)
+            extract_seconds = sum(seconds for _, seconds in parts)
+            chunk_futures[i] = (pool.submit(timed_chunk_document, text, os.path.basename(files[i]), chunk_size, overlap), extract_seconds)
+
+        for i, future in file_futures.items():
+            results[i] = future.result()
+        for i, (future, extract_seconds) in chunk_futures.items():
+            rows, seconds = future.result()
+            results[i] = (rows, extract_seconds + seconds)
+    return results
+
+def read_previous_chunks(csv_path: str) -> dict:
+    """
+    Reads the chunks written by the previous run, keyed by chunk id.
+    CSVs from before chunk ids existed cannot be reused and yield {}.
+    """
+    if not os.path.exists(csv_path):
+        return {}
+    chunks = {}
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        if 'chunk_id' not in (reader.fieldnames or []):
+            return {}
+        for row in reader:
+            chunks[int(row['chunk_id'])] = (row['filename'], int(row['chunk_index']), row['chunk_text'])
+    return chunks
+
 def main():
     """
     Main routine to process course documents:
       1. Read settings from settings.txt.
       2. Recursively gather documents from the specified documents folder.
-      3. Split each document's text into overlapping chunks.
-      4. Write all chunks to a single CSV file in the 'data/' folder.
+      3. Skip documents whose content hash matches 'data/manifest.json' and split
+         new or changed documents into overlapping chunks, optionally in a
+         process pool (--workers N), across files and page ranges of large PDFs.
+      4. Write all chunks, each with a stable chunk id, to a single CSV file in the
+         'data/' folder and record each document's hash and chunk ids in the manifest.
+      5. Build the BM25 keyword index over all chunks in 'data/bm25/', used next to
+         the FAISS index for hybrid retrieval.
     """
+    parser = argparse.ArgumentParser(description="Extract and chunk course documents.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes (default 1: process files sequentially).")
+    parser.add_argument('--pages-per-task', type=int, default=50,
+                        help="With --workers > 1, PDFs longer than this are split into page ranges of this size.")
+    parser.add_argument('--full', action='store_true',
+                        help="Re-extract every document instead of skipping unchanged ones.")
+    parser.add_argument('--course',
+                        help="Build the course bundle in courses/<course>/ instead of the default course.")
+    args = parser.parse_args()
+
     # Determine base directory (assumes this script is in 'scripts/')
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # A course bundle has its own settings, documents and data.
+    bundle_dir = os.path.join(base_dir, 'courses', args.course) if args.course else base_dir
     
-    settings_path = os.path.join(base_dir, 'settings.txt')
+    settings_path = os.path.join(bundle_dir, 'settings.txt')
     settings = read_settings(settings_path)
     print("Loaded settings:", settings)
     
     # Use the 'filedirectory' from settings (default to 'documents' if not specified)
-    documents_dir = os.path.join(base_dir, settings.get("filedirectory", "documents"))
-    output_csv_path = os.path.join(base_dir, 'data', 'chopped_text.csv')
+    documents_dir = os.path.join(bundle_dir, settings.get("filedirectory", "documents"))
+    data_dir = os.path.join(bundle_dir, 'data')
+    output_csv_path = os.path.join(data_dir, 'chopped_text.csv')
     
     # Optional: allow chunking parameters to be set in settings.txt
     try:
@@ -133,43 +258,87 @@ def main():
         print(f"No documents found in {documents_dir}. Exiting.")
         sys.exit(0)
 
-    # 3. Process and chunk each file
-    all_chunks = []  # Will store tuples: (filename, chunk_index, chunk_text)
+    # 3. Skip unchanged files, then process and chunk the rest
+    manifest = load_manifest(data_dir)
+    chunking = {'chunk_size': chunk_size, 'overlap': overlap}
+    # Changing the chunking parameters invalidates every previous chunk.
+    reuse = not args.full and manifest.get('chunking') == chunking
+    previous_chunks = read_previous_chunks(output_csv_path) if reuse else {}
+    hashes = {}
+    unchanged = {}
+    to_process = []
     for fpath in files:
-        ext = os.path.splitext(fpath)[1].lower()
-        print(f"Processing: {fpath}")
-        text = ""
-        if ext == '.pdf':
-            text = extract_text_from_pdf(fpath)
-        elif ext == '.docx':
-            text = extract_text_from_docx(fpath)
-        elif ext == '.txt':
-            text = extract_text_from_txt(fpath)
-        elif ext == '.tex':
-            text = extract_text_from_tex(fpath)
+        rel_path = os.path.relpath(fpath, documents_dir)
+        hashes[fpath] = file_sha256(fpath)
+        entry = manifest['files'].get(rel_path)
+        if (entry and entry['sha256'] == hashes[fpath]
+                and all(cid in previous_chunks for cid in entry['chunk_ids'])):
+            unchanged[fpath] = entry['chunk_ids']
         else:
-            print(f"Skipping unsupported file: {fpath}")
-            continue
+            to_process.append(fpath)
+    print(f"{len(unchanged)} unchanged, {len(to_process)} new or changed documents.")
 
-        # Clean up whitespace
-        text = re.sub(r'\s+', ' ', text).strip()
+    start = time.perf_counter()
+    if args.workers > 1 and to_process:
+        print(f"Processing {len(to_process)} files with {args.workers} workers...")
+        results = process_files_parallel(to_process, chunk_size, overlap, args.workers, args.pages_per_task)
+    else:
+        results = []
+        for fpath in to_process:
+            print(f"Processing: {fpath}")
+            results.append(process_file(fpath, chunk_size, overlap))
+    processed = dict(zip(to_process, results))
 
-        # Split text into chunks and add a title prefix
-        filename_only = os.path.basename(fpath)
-        chunks = chunk_text(text, chunk_size=chunk_size, overlap=overlap, title=filename_only)
-
-        for i, chunk in enumerate(chunks):
-            all_chunks.append((filename_only, i, chunk))
+    # New and changed documents get fresh chunk ids, so their old vectors are
+    # removed from the index and the new ones added.
+    all_chunks = []  # Will store tuples: (filename, chunk_index, chunk_text, chunk_id)
+    files_manifest = {}
+    next_chunk_id = manifest['next_chunk_id']
+    for fpath in files:
+        rel_path = os.path.relpath(fpath, documents_dir)
+        if fpath in unchanged:
+            chunk_ids = unchanged[fpath]
+            all_chunks.extend(previous_chunks[cid] + (cid,) for cid in chunk_ids)
+        else:
+            rows, seconds = processed[fpath]
+            if rows is None:
+                print(f"Skipping unsupported file: {fpath}")
+                continue
+            print(f"  {os.path.basename(fpath)}: {len(rows)} chunks in {seconds:.2f}s")
+            chunk_ids = list(range(next_chunk_id, next_chunk_id + len(rows)))
+            next_chunk_id += len(rows)
+            all_chunks.extend(row + (cid,) for row, cid in zip(rows, chunk_ids))
+        files_manifest[rel_path] = {
+            'sha256': hashes[fpath],
+            'filename': os.path.basename(fpath),
+            'chunk_ids': chunk_ids,
+        }
+    print(f"Processed {len(to_process)} files in {time.perf_counter() - start:.2f}s")
+    deleted = set(manifest['files']) - set(files_manifest)
+    if deleted:
+        print(f"Dropped {len(deleted)} deleted documents: {', '.join(sorted(deleted))}")
 
     # 4. Write all chunks to CSV in the 'data/' folder
-    os.makedirs(os.path.dirname(output_csv_path), exist_ok=True)
+    os.makedirs(data_dir, exist_ok=True)
     with open(output_csv_path, 'w', encoding='utf-8', newline='') as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(["filename", "chunk_index", "chunk_text"])
+        writer.writerow(["filename", "chunk_index", "chunk_text", "chunk_id"])
         for entry in all_chunks:
             writer.writerow(entry)
 
-    print(f"Done! Wrote {len(all_chunks)} total chunks to {output_csv_path}")
+    manifest['files'] = files_manifest
+    manifest['chunking'] = chunking
+    manifest['next_chunk_id'] = next_chunk_id
+    save_manifest(data_dir, manifest)
+    print(f"Wrote {len(all_chunks)} total chunks to {output_csv_path}")
+
+    # 5. Rebuild the keyword index; it is small next to the embeddings, so this is
+    # not worth doing incrementally.
+    start = time.perf_counter()
+    bm25_dir = os.path.join(data_dir, 'bm25')
+    write_bm25_index(bm25_dir, ((entry[3], entry[2]) for entry in all_chunks),
+                     k1=float(settings.get('bm25_k1', 1.2)), b=float(settings.get('bm25_b', 0.75)))
+    print(f"Done! Built the BM25 index in {bm25_dir} in {time.perf_counter() - start:.2f}s")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from typing import Optional
+
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+
+def index_fingerprint(faiss_index_path):
+    """
+    Identifies one build of faiss_index.bin; changes whenever the index is rebuilt.
+    """
+    st = os.stat(faiss_index_path)
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+
+def context_key(previous_context):
+    """
+    Identifies the previous turn's context a follow-up was answered with; ""
+    for a question answered on its own.
+    """
+    if not previous_context:
+        return ""
+    return hashlib.sha256(previous_context.encode("utf-8")).hexdigest()
+
+
+# Nearest entries looked at per lookup, for those stored after another context.
+LOOKUP_CANDIDATES = 4
+
+
+class SemanticCache:
+    """
+    Cache of verified answers keyed on query embeddings.
+
+    Entries live in a sqlite file so they survive restarts and are shared by
+    all worker processes. Each process keeps an in-memory FAISS mirror of the
+    embeddings for the similarity lookup and picks up rows written by other
+    workers on the next lookup. An answer to a follow-up is stored with the
+    context_key() of the previous turn it used, a standalone answer with "",
+    and a lookup only matches entries of the context it is given: a follow-up
+    is only served answers given after that same previous turn. Each entry
+    keeps the chunk ids its reply was given with, so a hit can carry the
+    conversation on without a search. Entries expire
+    after `ttl` seconds, the least
+    recently used ones are evicted beyond `max_entries`, and entries built
+    against a different index version are dropped on open and on reload.
+    """
+
+    def __init__(self, path, dim, index_version, threshold=0.95, ttl=7 * 24 * 3600, max_entries=5000):
+        self.dim = dim
+        self.index_version = index_version
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._mirror = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        self._last_id = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " index_version TEXT NOT NULL,"
+            " embedding BLOB NOT NULL,"
+            " question TEXT NOT NULL,"
+            " reply TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " context TEXT NOT NULL DEFAULT '',"
+            " chunk_ids TEXT NOT NULL DEFAULT '[]')"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(answers)")]
+        if "context" not in columns:
+            # Caches written before follow-up answers were cached.
+            self._conn.execute("ALTER TABLE answers ADD COLUMN context TEXT NOT NULL DEFAULT ''")
+        if "chunk_ids" not in columns:
+            # Caches written before entries kept their chunk ids.
+            self._conn.execute("ALTER TABLE answers ADD COLUMN chunk_ids TEXT NOT NULL DEFAULT '[]'")
+        # Answers built against an older index may cite chunks that no longer exist.
+        deleted = self._conn.execute("DELETE FROM answers WHERE index_version != ?", (index_version,)).rowcount
+        self._conn.commit()
+        if deleted:
+            logger.info("Invalidated %d cached answers from a previous index build.", deleted)
+        self._sync()
+
+    def set_index_version(self, index_version):
+        """
+        Switches to a reloaded index: entries of other versions are dropped
+        and new ones are stored under `index_version`.
+        """
+        with self._lock:
+            self.index_version = index_version
+            self._mirror.reset()
+            self._last_id = 0
+            deleted = self._conn.execute("DELETE FROM answers WHERE index_version != ?", (index_version,)).rowcount
+            self._conn.commit()
+            if deleted:
+                logger.info("Invalidated %d cached answers from a previous index build.", deleted)
+            self._sync()
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.array(embedding, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _sync(self):
+        # Mirror rows added since the last sync, including those written by other workers.
+        rows = self._conn.execute(
+            "SELECT id, embedding FROM answers WHERE id > ? AND index_version = ? ORDER BY id",
+            (self._last_id, self.index_version)
+        ).fetchall()
+        if not rows:
+            return
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        vectors = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        self._mirror.add_with_ids(vectors, ids)
+        self._last_id = int(ids[-1])
+
+    def lookup(self, embedding, context="") -> Optional[dict]:
+        """
+        Returns the most similar past question asked after the same `context`
+        (a context_key(); "" for questions on their own) as a dict with
+        "reply" and "chunk_ids", if it is at least `threshold` cosine-similar
+        and still fresh.
+        """
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            self._sync()
+            if self._mirror.ntotal:
+                scores, ids = self._mirror.search(query, LOOKUP_CANDIDATES)
+                for score, entry_id in zip(scores[0], ids[0]):
+                    entry_id = int(entry_id)
+                    if entry_id < 0 or score < self.threshold:
+                        break
+                    row = self._conn.execute(
+                        "SELECT reply, created, context, chunk_ids FROM answers WHERE id = ?", (entry_id,)
+                    ).fetchone()
+                    if not row or row[1] + self.ttl <= now:
+                        # Expired, or evicted by another worker.
+                        self._mirror.remove_ids(np.array([entry_id], dtype=np.int64))
+                        continue
+                    if row[2] != context:
+                        continue
+                    self._conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (now, entry_id))
+                    self._conn.commit()
+                    self.hits += 1
+                    return {"reply": row[0], "chunk_ids": json.loads(row[3])}
+            self.misses += 1
+            return None
+
+    def store(self, embedding, question, reply, index_version=None, context="", chunk_ids=()):
+        vector = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            if index_version is not None and index_version != self.index_version:
+                # Answered from an index that has been reloaded since.
+                return
+            self._conn.execute(
+                "INSERT INTO answers (index_version, embedding, question, reply, created, last_used, context,"
+                " chunk_ids) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.index_version, vector.tobytes(), question, reply, now, now, context,
+                 json.dumps([int(i) for i in chunk_ids]))
+            )
+            self._evict(now)
+            self._conn.commit()
+            self._sync()
+
+    def _evict(self, now):
+        expired = self._conn.execute("SELECT id FROM answers WHERE created <= ?", (now - self.ttl,)).fetchall()
+        overflow = self._conn.execute(
+            "SELECT id FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?", (self.max_entries,)
+        ).fetchall()
+        stale = {row[0] for row in expired} | {row[0] for row in overflow}
+        if stale:
+            self._conn.executemany("DELETE FROM answers WHERE id = ?", [(i,) for i in stale])
+            self._mirror.remove_ids(np.array(sorted(stale), dtype=np.int64))
+
+    def close(self):
+        with self._lock:
+            self._mirror.reset()
+            self._conn.close()
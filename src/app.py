@@ -1,56 +1,213 @@
 import os
-import subprocess
-from flask import Flask, render_template, request, jsonify
+import re
+import sys
+import json
+import threading
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
+
+# Add the project root to sys.path so that config.py and the src package can be imported
+# both under gunicorn ("src.app:app") and when running this file directly.
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+# Only light modules are imported here: the engine and its dependencies load
+# in the background (see start_warming()), so the port is bound and / and
+# /healthz answer right away.
+from src.courses import CourseRegistry, UnknownCourse
+from src.settings import DEFAULT_COURSE, read_settings
+from src.sessions import new_session_id
+from src.metrics import metrics, clear_snapshots
 
 # Configure Flask to look for templates in the project root's "templates" folder.
-template_dir = os.path.join(os.path.dirname(__file__), '..', 'templates')
+template_dir = os.path.join(project_root, 'templates')
 app = Flask(__name__, template_folder=template_dir)
 
+# One course registry per worker process: each course's index and metadata are
+# loaded on its first request and reused by every request after it, and all
+# courses share the models.
+_registry = None
+_registry_lock = threading.Lock()
+
+METRICS_DIR = os.path.join(project_root, 'data', 'metrics')
+
+def enable_metrics_snapshots():
+    """
+    Makes each server process write its metrics where /metrics on any worker
+    can sum them. Only the server does this, not the CLI or scripts.
+    """
+    settings = read_settings(os.path.join(project_root, 'settings.txt'))
+    snapshot_interval = float(settings.get('metrics_snapshot_interval', 5))
+    if snapshot_interval > 0:
+        metrics.enable_snapshots(METRICS_DIR, snapshot_interval)
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                enable_metrics_snapshots()
+                _registry = CourseRegistry(project_root)
+    return _registry
+
+def start_warming(on_done=None):
+    """
+    Loads the preload courses (preload_courses in settings.txt) in a background
+    thread; /ready answers 200 once they are loaded.
+    """
+    get_registry().start_warming(on_done)
+
+def get_engine(course_id=None):
+    return get_registry().engine(course_id)
+
+def unknown_course(course_id):
+    return jsonify({'error': f'Unknown course {course_id}'}), 404
+
+SESSION_COOKIE = 'session_id'
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+def get_session_id(data):
+    """
+    The conversation's session id from the cookie (browsers) or the JSON body
+    (other clients), or a new one.
+    """
+    session_id = request.cookies.get(SESSION_COOKIE) or data.get('session_id') or ''
+    return session_id if SESSION_ID_PATTERN.match(session_id) else new_session_id()
+
+def set_session_cookie(response, session_id):
+    # A browser-session cookie; the server expires the conversation itself.
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax')
+    return response
+
+def server_timing(timings):
+    """
+    A Server-Timing header value with the request's stage timings in milliseconds.
+    """
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
 @app.route('/')
-def index():
-    return render_template('index.html')
+@app.route('/courses/<course_id>/')
+def index(course_id=DEFAULT_COURSE):
+    try:
+        get_registry().paths(course_id)
+    except UnknownCourse:
+        return unknown_course(course_id)
+    return render_template('index.html', course_id=course_id)
 
 @app.route('/api/chat', methods=['POST'])
-def chat_api():
+@app.route('/courses/<course_id>/api/chat', methods=['POST'])
+def chat_api(course_id=None):
+    """
+    Answers {"query": ...} for the course in the URL, else the body's "course"
+    field, else the default course.
+    """
     data = request.get_json()
     query = data.get('query')
     if not query:
         return jsonify({'error': 'No query provided'}), 400
 
+    course_id = course_id or str(data.get('course') or DEFAULT_COURSE)
+    session_id = get_session_id(data)
     try:
-        # Path to your unmodified main.py (which is in the same directory as app.py)
-        main_py_path = os.path.join(os.path.dirname(__file__), 'main.py')
-
-        # Run main.py as a subprocess.
-        # It is expected that main.py uses input() to read the query and then prints the result,
-        # including a line starting with "Final Answer:".
-        proc = subprocess.run(
-            ['python', main_py_path],
-            input=query.encode('utf-8'),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=60
-        )
-        stdout = proc.stdout.decode('utf-8')
-        stderr = proc.stderr.decode('utf-8')
-
-        if stderr:
-            return jsonify({'error': stderr.strip()}), 500
-
-        # Parse stdout to extract the final answer.
-        # The original main.py is assumed to print "Final Answer:" before the reply.
-        parts = stdout.split("Final Answer:")
-        if len(parts) > 1:
-            reply = parts[1].strip()
-        else:
-            reply = stdout.strip()
-
-        return jsonify({'response': reply})
+        engine = get_engine(course_id)
+        answer = engine.answer(query, session_id=session_id)
+        response = jsonify({'response': answer.reply, 'session_id': session_id})
+        if engine.server_timing:
+            response.headers['Server-Timing'] = server_timing(answer.timings)
+        return set_session_cookie(response, session_id)
+    except UnknownCourse:
+        return unknown_course(course_id)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-if __name__ == '__main__':
-    app.run(debug=True)
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+@app.route('/courses/<course_id>/api/chat/stream', methods=['POST'])
+def chat_stream_api(course_id=None):
+    """
+    Same as /api/chat, but answers with server-sent events: "stage" events as the
+    pipeline progresses, "token" events with pieces of the answer, and a final
+    "done" event with the verified/replaced flags, the context tokens used and
+    the final response. Headers go out before the stages run, so with
+    server_timing=on the stage timings come in the "done" event instead of a
+    Server-Timing header.
+    """
+    data = request.get_json()
+    query = data.get('query')
+    if not query:
+        return jsonify({'error': 'No query provided'}), 400
 
+    course_id = course_id or str(data.get('course') or DEFAULT_COURSE)
+    try:
+        get_registry().paths(course_id)
+    except UnknownCourse:
+        return unknown_course(course_id)
+    session_id = get_session_id(data)
+
+    def generate():
+        try:
+            engine = get_engine(course_id)
+            for event in engine.stream(query, session_id=session_id):
+                if event['type'] == 'stage':
+                    yield sse('stage', {'stage': event['stage']})
+                elif event['type'] == 'token':
+                    yield sse('token', {'text': event['text']})
+                elif event['type'] == 'done':
+                    answer = event['answer']
+                    done = {
+                        'response': answer.reply,
+                        'verified': answer.verified,
+                        'replaced': answer.replaced,
+                        'context_tokens': answer.context_tokens,
+                    }
+                    if engine.server_timing:
+                        done['timings'] = {stage: round(seconds * 1000, 1) for stage, seconds in answer.timings.items()}
+                    yield sse('done', done)
+        except Exception as e:
+            yield sse('error', {'error': str(e)})
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    return set_session_cookie(response, session_id)
+
+@app.route('/healthz')
+def healthz():
+    """
+    Liveness: the process is up and serving requests.
+    """
+    return jsonify({'status': 'ok'})
 
+@app.route('/ready')
+def ready():
+    """
+    Readiness: 200 once the preload courses are loaded, 503 while they load
+    or if loading them failed.
+    """
+    registry = get_registry()
+    # Servers started without gunicorn.conf.py warm on the first probe.
+    registry.start_warming()
+    if registry.ready():
+        return jsonify({'status': 'ready', 'courses': registry.loaded()})
+    if registry.warm_error is not None:
+        return jsonify({'status': 'failed', 'error': str(registry.warm_error)}), 503
+    return jsonify({'status': 'warming'}), 503
 
+@app.route('/metrics')
+def metrics_api():
+    """
+    Stage latency histograms and pipeline counters of all workers, in the
+    Prometheus text format.
+    """
+    # Creating the registry starts this worker's snapshots.
+    get_registry()
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+if __name__ == '__main__':
+    # The reloader serves the app from a child process, marked by WERKZEUG_RUN_MAIN.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_warming()
+    else:
+        # A new server run: its /metrics starts from zero.
+        clear_snapshots(METRICS_DIR)
+    app.run(debug=True)
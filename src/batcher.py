@@ -0,0 +1,149 @@
+import time
+import queue
+import logging
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_CLOSE = object()
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls into batches for a function that is much cheaper
+    per item when given many items at once (an encoder, a FAISS search).
+
+    Callers block in submit(item). A worker thread takes the first waiting item,
+    keeps collecting until `max_batch` items are queued or `max_wait_ms` have
+    passed since that item arrived, calls `process(items)` once and hands each
+    caller its own entry of the returned list. If `process` raises, every caller
+    in the batch gets the exception.
+
+    Requests that may submit items run inside request(). Waiting only pays off
+    while other requests are running, so once the batch holds as many items as
+    there are running requests, it is processed right away.
+
+    Batch sizes and the time items spend queued are recorded for stats().
+    After close(), queued items are still processed and later calls run
+    `process` directly in the caller's thread.
+    """
+
+    def __init__(self, process, max_batch=16, max_wait_ms=2.0, name="batcher", log_every=1000):
+        self.process = process
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self.log_every = log_every
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._active = 0
+        self.num_batches = 0
+        self.num_items = 0
+        self.batch_sizes = Counter()
+        # Queue waits of the most recent items, for percentiles.
+        self.waits = deque(maxlen=10000)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        with self._lock:
+            queued = not self._closed
+            if queued:
+                self._queue.put((item, future, time.perf_counter()))
+        if queued:
+            return future.result()
+        return self.process([item])[0]
+
+    @contextmanager
+    def request(self):
+        """
+        Counts the block as a running request that may submit items.
+        """
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def close(self):
+        """
+        Stops the worker thread once the queued items are processed.
+        """
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(_CLOSE)
+
+    def _collect(self):
+        """
+        Returns the next batch and whether the batcher was closed after it.
+        """
+        first = self._queue.get()
+        if first is _CLOSE:
+            return [], True
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            # No other running request could add an item: take only what is queued.
+            wait = remaining > 0 and self._active > len(batch)
+            try:
+                entry = self._queue.get(block=wait, timeout=remaining if wait else None)
+            except queue.Empty:
+                break
+            if entry is _CLOSE:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _run(self):
+        closed = False
+        while not closed:
+            batch, closed = self._collect()
+            if not batch:
+                break
+            started = time.perf_counter()
+            with self._lock:
+                self.num_batches += 1
+                self.num_items += len(batch)
+                self.batch_sizes[len(batch)] += 1
+                self.waits.extend(started - enqueued for _, _, enqueued in batch)
+                log = self.log_every and self.num_batches % self.log_every == 0
+            try:
+                results = self.process([item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            if log:
+                logger.info("%s: %s", self.name, self.format_stats())
+
+    def stats(self):
+        with self._lock:
+            waits = np.array(self.waits) if self.waits else np.zeros(1)
+            return {
+                "batches": self.num_batches,
+                "items": self.num_items,
+                "mean_batch_size": self.num_items / self.num_batches if self.num_batches else 0.0,
+                "max_batch_size": max(self.batch_sizes) if self.batch_sizes else 0,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "queue_wait_p50_ms": float(np.percentile(waits, 50)) * 1000,
+                "queue_wait_p99_ms": float(np.percentile(waits, 99)) * 1000,
+            }
+
+    def format_stats(self):
+        stats = self.stats()
+        return (f"{stats['items']} items in {stats['batches']} batches "
+                f"(mean {stats['mean_batch_size']:.1f}, max {stats['max_batch_size']}), "
+                f"queue wait p50 {stats['queue_wait_p50_ms']:.2f}ms, p99 {stats['queue_wait_p99_ms']:.2f}ms")
@@ -0,0 +1,145 @@
+import os
+import re
+import json
+import shutil
+from collections import Counter
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+# Files making up a BM25 index directory.
+TERMS_FILE = "terms.json"           # vocabulary, sorted; term i owns postings[starts[i]:starts[i + 1]]
+STARTS_FILE = "starts.npy"          # int64[terms + 1]
+POSTING_DOCS_FILE = "docs.npy"      # int32[postings]; document row of each posting
+POSTING_TFS_FILE = "tfs.npy"        # uint16[postings]; term frequency in that document
+DOC_IDS_FILE = "doc_ids.npy"        # int64[docs]; chunk id of each document row
+DOC_LENGTHS_FILE = "doc_lengths.npy"  # int32[docs]; tokens per document
+META_FILE = "bm25.json"             # k1, b, average document length
+
+# Unicode word characters, so Cyrillic terms and codes like "EC-203" split the same way.
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.casefold())
+
+
+def write_bm25_index(index_dir: str, documents: Iterable[Tuple[int, str]], k1: float = 1.2, b: float = 0.75) -> int:
+    """
+    Builds a BM25 inverted index over (chunk_id, text) pairs and writes it as
+    flat arrays that BM25Index memory-maps. Returns the number of documents.
+
+    The files are written to a new directory that then takes the place of
+    `index_dir`: a server memory-mapping the old files keeps reading them.
+    """
+    final_dir = index_dir
+    index_dir = f"{final_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.makedirs(index_dir)
+    postings = {}
+    doc_ids = []
+    doc_lengths = []
+    for row, (chunk_id, text) in enumerate(documents):
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((row, tf))
+        doc_ids.append(int(chunk_id))
+        doc_lengths.append(sum(counts.values()))
+
+    terms = sorted(postings)
+    starts = np.zeros(len(terms) + 1, dtype=np.int64)
+    starts[1:] = np.cumsum([len(postings[term]) for term in terms])
+    docs = np.empty(starts[-1], dtype=np.int32)
+    tfs = np.empty(starts[-1], dtype=np.uint16)
+    for i, term in enumerate(terms):
+        entries = np.array(postings[term], dtype=np.int64).reshape(-1, 2)
+        docs[starts[i]:starts[i + 1]] = entries[:, 0]
+        tfs[starts[i]:starts[i + 1]] = np.minimum(entries[:, 1], np.iinfo(np.uint16).max)
+
+    np.save(os.path.join(index_dir, STARTS_FILE), starts)
+    np.save(os.path.join(index_dir, POSTING_DOCS_FILE), docs)
+    np.save(os.path.join(index_dir, POSTING_TFS_FILE), tfs)
+    np.save(os.path.join(index_dir, DOC_IDS_FILE), np.array(doc_ids, dtype=np.int64))
+    np.save(os.path.join(index_dir, DOC_LENGTHS_FILE), np.array(doc_lengths, dtype=np.int32))
+    with open(os.path.join(index_dir, TERMS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(terms, f, ensure_ascii=False)
+    with open(os.path.join(index_dir, META_FILE), 'w', encoding='utf-8') as f:
+        average = float(np.mean(doc_lengths)) if doc_lengths else 0.0
+        json.dump({'k1': k1, 'b': b, 'avg_doc_length': average}, f)
+
+    # A directory cannot replace a non-empty one in a single rename, so the old
+    # one is moved aside first and deleted after.
+    old_dir = f"{final_dir}.old-{os.getpid()}"
+    if os.path.isdir(final_dir):
+        os.rename(final_dir, old_dir)
+    os.rename(index_dir, final_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return len(doc_ids)
+
+
+def bm25_index_exists(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(index_dir, META_FILE))
+
+
+class BM25Index:
+    """
+    Read-only BM25 index written by write_bm25_index. The postings are
+    memory-mapped; a query only reads the postings of its own terms.
+    """
+
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, TERMS_FILE), 'r', encoding='utf-8') as f:
+            self.term_ids = {term: i for i, term in enumerate(json.load(f))}
+        with open(os.path.join(index_dir, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.k1 = meta['k1']
+        self.b = meta['b']
+        self.avg_doc_length = meta['avg_doc_length'] or 1.0
+        self.starts = np.load(os.path.join(index_dir, STARTS_FILE), mmap_mode='r')
+        self.docs = np.load(os.path.join(index_dir, POSTING_DOCS_FILE), mmap_mode='r')
+        self.tfs = np.load(os.path.join(index_dir, POSTING_TFS_FILE), mmap_mode='r')
+        self.doc_ids = np.load(os.path.join(index_dir, DOC_IDS_FILE), mmap_mode='r')
+        self.doc_lengths = np.load(os.path.join(index_dir, DOC_LENGTHS_FILE), mmap_mode='r')
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the chunk ids and scores of the `k` best matching documents,
+        best first. Documents sharing no term with the query are not returned.
+        """
+        num_docs = len(self.doc_ids)
+        rows = []
+        weights = []
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.starts[term_id], self.starts[term_id + 1]
+            docs = np.asarray(self.docs[start:end])
+            tfs = np.asarray(self.tfs[start:end], dtype=np.float32)
+            idf = np.log(1.0 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_lengths[docs] / self.avg_doc_length)
+            rows.append(docs)
+            weights.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        unique_rows, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights)).astype(np.float32)
+        top = np.argsort(-scores, kind='stable')[:k]
+        return np.asarray(self.doc_ids[unique_rows[top]]), scores[top]
+
+
+def reciprocal_rank_fusion(rankings: List[Tuple[Iterable[int], float]], k: int = 60) -> List[int]:
+    """
+    Fuses ranked id lists, given as (ids, weight) pairs, by weighted reciprocal
+    rank: each id scores sum(weight / (k + rank)) over the lists containing it.
+    Returns ids best first; ties keep the order of first appearance.
+    """
+    scores = {}
+    for ids, weight in rankings:
+        for rank, chunk_id in enumerate(ids, start=1):
+            chunk_id = int(chunk_id)
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + weight / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,126 @@
+import os
+import json
+import mmap
+from typing import Iterable, List, Dict, Any
+
+import numpy as np
+
+# Files making up a chunk store directory.
+TEXT_FILE = "text.bin"            # UTF-8 chunk texts, back to back
+OFFSETS_FILE = "offsets.npy"      # uint64[n + 1]; chunk i is text[offsets[i]:offsets[i + 1]]
+FILE_IDS_FILE = "file_ids.npy"    # int32[n]; position in filenames.json
+CHUNK_INDEX_FILE = "chunk_index.npy"  # int32[n]; chunk number within its file
+FILENAMES_FILE = "filenames.json"
+CHUNK_IDS_FILE = "chunk_ids.npy"  # int64[n]; chunk id (= FAISS vector id) of each row
+SORTED_IDS_FILE = "sorted_ids.npy"    # int64[n]; chunk ids in ascending order
+SORTED_ROWS_FILE = "sorted_rows.npy"  # int64[n]; row holding sorted_ids[j]
+
+
+def write_chunk_store(store_dir: str, records: Iterable[Dict[str, Any]]) -> int:
+    """
+    Writes chunk records ('filename', 'chunk_index', 'chunk_text' and optionally
+    'chunk_id') as a columnar chunk store. Records without a 'chunk_id' get their
+    position as id. Returns the number of chunks written.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    offsets = [0]
+    chunk_ids = []
+    file_ids = []
+    chunk_indexes = []
+    filenames: List[str] = []
+    filename_ids: Dict[str, int] = {}
+
+    with open(os.path.join(store_dir, TEXT_FILE), 'wb') as text_file:
+        for record in records:
+            encoded = record['chunk_text'].encode('utf-8')
+            text_file.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+            filename = record['filename']
+            if filename not in filename_ids:
+                filename_ids[filename] = len(filenames)
+                filenames.append(filename)
+            file_ids.append(filename_ids[filename])
+            chunk_indexes.append(int(record['chunk_index']))
+            chunk_ids.append(int(record.get('chunk_id', len(chunk_ids))))
+
+    np.save(os.path.join(store_dir, OFFSETS_FILE), np.array(offsets, dtype=np.uint64))
+    np.save(os.path.join(store_dir, FILE_IDS_FILE), np.array(file_ids, dtype=np.int32))
+    np.save(os.path.join(store_dir, CHUNK_INDEX_FILE), np.array(chunk_indexes, dtype=np.int32))
+    ids = np.array(chunk_ids, dtype=np.int64)
+    order = np.argsort(ids, kind='stable')
+    np.save(os.path.join(store_dir, CHUNK_IDS_FILE), ids)
+    np.save(os.path.join(store_dir, SORTED_IDS_FILE), ids[order])
+    np.save(os.path.join(store_dir, SORTED_ROWS_FILE), order.astype(np.int64))
+    with open(os.path.join(store_dir, FILENAMES_FILE), 'w', encoding='utf-8') as f:
+        json.dump(filenames, f, ensure_ascii=False)
+    return len(file_ids)
+
+
+class ChunkStore:
+    """
+    Read-only view of a chunk store. The text blob and the column arrays are
+    memory-mapped, so opening is constant time and a lookup only touches the
+    pages of the chunks it returns. Chunks are looked up by chunk id, which is
+    the vector id returned by the FAISS index; text() and get() raise KeyError
+    for an id the store does not contain.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.offsets = np.load(os.path.join(store_dir, OFFSETS_FILE), mmap_mode='r')
+        self.file_ids = np.load(os.path.join(store_dir, FILE_IDS_FILE), mmap_mode='r')
+        self.chunk_indexes = np.load(os.path.join(store_dir, CHUNK_INDEX_FILE), mmap_mode='r')
+        # Stores written before chunk ids existed use row numbers as ids.
+        self.sorted_ids = None
+        if os.path.exists(os.path.join(store_dir, SORTED_IDS_FILE)):
+            self.chunk_ids = np.load(os.path.join(store_dir, CHUNK_IDS_FILE), mmap_mode='r')
+            self.sorted_ids = np.load(os.path.join(store_dir, SORTED_IDS_FILE), mmap_mode='r')
+            self.sorted_rows = np.load(os.path.join(store_dir, SORTED_ROWS_FILE), mmap_mode='r')
+        with open(os.path.join(store_dir, FILENAMES_FILE), 'r', encoding='utf-8') as f:
+            self.filenames = json.load(f)
+        self._text_file = open(os.path.join(store_dir, TEXT_FILE), 'rb')
+        size = os.fstat(self._text_file.fileno()).st_size
+        # mmap cannot map an empty file.
+        self._text = mmap.mmap(self._text_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return len(self.file_ids)
+
+    def row(self, chunk_id: int) -> int:
+        """
+        Returns the row holding `chunk_id`, or -1 if the store does not contain it.
+        """
+        if self.sorted_ids is None:
+            return int(chunk_id) if 0 <= chunk_id < len(self) else -1
+        pos = int(np.searchsorted(self.sorted_ids, chunk_id))
+        if pos < len(self.sorted_ids) and self.sorted_ids[pos] == chunk_id:
+            return int(self.sorted_rows[pos])
+        return -1
+
+    def __contains__(self, chunk_id: int) -> bool:
+        return self.row(chunk_id) >= 0
+
+    def _existing_row(self, chunk_id: int) -> int:
+        i = self.row(chunk_id)
+        if i < 0:
+            # Typically an id kept from another index version.
+            raise KeyError(f"Chunk {chunk_id} is not in the chunk store {self.store_dir}.")
+        return i
+
+    def text(self, chunk_id: int) -> str:
+        i = self._existing_row(chunk_id)
+        return self._text[int(self.offsets[i]):int(self.offsets[i + 1])].decode('utf-8')
+
+    def get(self, chunk_id: int) -> Dict[str, Any]:
+        i = self._existing_row(chunk_id)
+        return {
+            'chunk_id': int(chunk_id),
+            'filename': self.filenames[self.file_ids[i]],
+            'chunk_index': int(self.chunk_indexes[i]),
+            'chunk_text': self._text[int(self.offsets[i]):int(self.offsets[i + 1])].decode('utf-8'),
+        }
+
+    def close(self):
+        if isinstance(self._text, mmap.mmap):
+            self._text.close()
+        self._text_file.close()
@@ -0,0 +1,136 @@
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import List
+
+from src.tokens import load_encoding, count_tokens
+
+# Prefix prepare_documents.py puts on every chunk; merged passages carry it once.
+TITLE_PREFIX = "This text comes from the document {}. "
+PASSAGE_SEPARATOR = "\n\n"
+
+
+@dataclass
+class PackedContext:
+    text: str
+    # Tokens of `text` under the chat model's tokenizer.
+    tokens: int
+    # Chunks included in full or in part, in ranking order.
+    chunk_ids: List[int] = field(default_factory=list)
+    # Number of ranked candidates consumed; the rest can feed another pack.
+    consumed: int = 0
+
+
+def overlap_length(previous: List[str], following: List[str]) -> int:
+    """
+    Length of the longest run of words that ends `previous` and starts `following`.
+    """
+    for m in range(min(len(previous), len(following)), 0, -1):
+        if previous[-m] == following[0] and previous[-m:] == following[:m]:
+            return m
+    return 0
+
+
+class ContextPacker:
+    """
+    Assembles prompt context from ranked chunks under a token budget.
+
+    Chunks from the same file are ordered by chunk_index; neighbouring chunks
+    have the words they share with their predecessor removed and are merged
+    into one passage with a single title line. Passages appear in the order of
+    their best-ranked chunk. Candidates are added in ranking order while the
+    rendered context fits the budget; the first one that does not fit is cut at
+    a word boundary to fill what is left.
+    """
+
+    def __init__(self, chunk_store, model: str, budget: int):
+        self.chunk_store = chunk_store
+        self.budget = budget
+        self.encoding = load_encoding(model)
+
+    def count(self, text: str) -> int:
+        return count_tokens(self.encoding, text)
+
+    def _words(self, chunk_id: int) -> dict:
+        record = self.chunk_store.get(chunk_id)
+        text = record['chunk_text']
+        prefix = TITLE_PREFIX.format(record['filename'])
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+        return {'chunk_id': chunk_id, 'filename': record['filename'],
+                'chunk_index': record['chunk_index'], 'words': text.split()}
+
+    def render(self, chunks: List[dict]) -> str:
+        """
+        Renders chunks (in ranking order) as deduplicated, merged passages.
+        """
+        by_file = defaultdict(list)
+        for rank, chunk in enumerate(chunks):
+            by_file[chunk['filename']].append((chunk['chunk_index'], rank, chunk['words']))
+        passages = []
+        for filename, items in by_file.items():
+            items.sort(key=lambda item: item[0])
+            passage = None
+            for index, rank, words in items:
+                # Only consecutive chunks continue a passage; the words shared by
+                # chunks further apart are not an overlap.
+                if passage and index - passage['last_index'] == 1:
+                    passage['words'].extend(words[overlap_length(passage['last_words'], words):])
+                    passage['rank'] = min(passage['rank'], rank)
+                else:
+                    passage = {'filename': filename, 'rank': rank, 'words': list(words)}
+                    passages.append(passage)
+                passage['last_index'] = index
+                passage['last_words'] = words
+        passages.sort(key=lambda p: p['rank'])
+        return PASSAGE_SEPARATOR.join(
+            TITLE_PREFIX.format(p['filename']) + " ".join(p['words']) for p in passages if p['words']
+        )
+
+    def pack(self, chunk_ids: List[int], budget: int = None) -> PackedContext:
+        budget = self.budget if budget is None else budget
+        selected = []
+        text, tokens = "", 0
+        consumed = 0
+        for chunk_id in chunk_ids:
+            chunk = self._words(chunk_id)
+            consumed += 1
+            candidate = self.render(selected + [chunk])
+            candidate_tokens = self.count(candidate)
+            if candidate_tokens <= budget:
+                selected.append(chunk)
+                text, tokens = candidate, candidate_tokens
+                continue
+            # Keep the longest prefix of this chunk's words that still fits.
+            low, high = 0, len(chunk['words'])
+            while low < high:
+                middle = (low + high + 1) // 2
+                partial = dict(chunk, words=chunk['words'][:middle])
+                if self.count(self.render(selected + [partial])) <= budget:
+                    low = middle
+                else:
+                    high = middle - 1
+            if low:
+                selected.append(dict(chunk, words=chunk['words'][:low]))
+                text = self.render(selected)
+                tokens = self.count(text)
+            else:
+                consumed -= 1
+            break
+        return PackedContext(text=text, tokens=tokens,
+                             chunk_ids=[chunk['chunk_id'] for chunk in selected], consumed=consumed)
+
+    def truncate(self, text: str, budget: int) -> str:
+        """
+        Cuts text to at most `budget` tokens at a word boundary.
+        """
+        if self.count(text) <= budget:
+            return text
+        words = text.split(" ")
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count(" ".join(words[:middle])) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return " ".join(words[:low])
@@ -0,0 +1,206 @@
+import os
+import re
+import logging
+import threading
+from collections import OrderedDict
+
+from src.settings import DEFAULT_COURSE, read_settings, project_root
+from src.model_pool import ModelPool
+from src.metrics import metrics
+from src.index_versions import index_dir
+
+logger = logging.getLogger(__name__)
+
+# src.engine, and with it numpy, faiss and openai, is imported when the first
+# course loads, so the web app can take requests while that happens.
+
+# Course bundles: courses/<course id>/settings.txt and courses/<course id>/data/,
+# built by the scripts with --course <course id>.
+COURSES_DIR = "courses"
+COURSE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# Index files read into memory when a course loads.
+RESIDENT_FILES = ("faiss_index.bin", os.path.join("bm25", "terms.json"))
+# Memory-mapped chunk store; counted whole, as requests touch any of its pages.
+CHUNK_STORE_DIR = "chunk_store"
+
+
+class UnknownCourse(KeyError):
+    pass
+
+
+def course_footprint(data_dir) -> int:
+    """
+    Estimated resident bytes of a loaded course: the size of the files it
+    reads into memory and of its chunk store. The BM25 postings and the
+    in-memory vector mirrors of the answer cache (answer_cache_max_entries
+    at most) and the quiz bank are not counted.
+    """
+    directory = index_dir(data_dir)
+    paths = [os.path.join(directory, name) for name in RESIDENT_FILES]
+    chunk_store_dir = os.path.join(directory, CHUNK_STORE_DIR)
+    if os.path.isdir(chunk_store_dir):
+        paths += [os.path.join(chunk_store_dir, name) for name in os.listdir(chunk_store_dir)]
+    return sum(os.path.getsize(path) for path in paths if os.path.isfile(path))
+
+
+class CourseRegistry:
+    """
+    Serves many courses from one process.
+
+    The default course is settings.txt and data/ in the project root; every
+    courses/<course id>/ with a settings.txt is another one. A course's engine
+    is created on its first request. All engines share one ModelPool, so the
+    embedding model, the cross-encoder and the LLM connections are loaded
+    once however many courses are served.
+
+    When the loaded courses' footprints add up to more than
+    course_memory_budget_mb (0: no limit), the least recently used ones are
+    evicted; the course
+    just requested always stays. Loads and evictions are counted in the
+    qa_course_loads_total and qa_course_evictions_total metrics.
+
+    Under gunicorn (see gunicorn.conf.py), preload() loads the models and
+    indexes of the preload_courses in the master before it forks, so every
+    worker shares them; start_warming() then creates those courses' engines
+    in each worker in the background, and ready() reports when it is done.
+    """
+
+    def __init__(self, base_dir=project_root):
+        self.base_dir = base_dir
+        settings = read_settings(os.path.join(base_dir, "settings.txt"))
+        # Compared with the sum of course_footprint(), which leaves out the cache mirrors.
+        self.memory_budget = int(float(settings.get("course_memory_budget_mb", 0)) * 2**20)
+        # Comma-separated course ids, or "all".
+        self.preload_courses = settings.get("preload_courses", DEFAULT_COURSE)
+        self.models = ModelPool(base_dir, max_workers=int(settings.get("classifier_workers", 8)))
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        # course id -> (engine, footprint), least recently used first.
+        self._engines = OrderedDict()
+        # course id -> index generation loaded by preload(), until its engine is created.
+        self._preloaded = {}
+        self._warming = None
+        self._warmed = threading.Event()
+        self.warm_error = None
+
+    def paths(self, course_id):
+        """
+        Returns the (settings path, data dir) of a course.
+        """
+        if course_id == DEFAULT_COURSE:
+            return os.path.join(self.base_dir, "settings.txt"), os.path.join(self.base_dir, "data")
+        if not COURSE_ID_PATTERN.match(course_id):
+            raise UnknownCourse(course_id)
+        course_dir = os.path.join(self.base_dir, COURSES_DIR, course_id)
+        if not os.path.isfile(os.path.join(course_dir, "settings.txt")):
+            raise UnknownCourse(course_id)
+        return os.path.join(course_dir, "settings.txt"), os.path.join(course_dir, "data")
+
+    def course_ids(self):
+        courses_dir = os.path.join(self.base_dir, COURSES_DIR)
+        if not os.path.isdir(courses_dir):
+            return [DEFAULT_COURSE]
+        return [DEFAULT_COURSE] + sorted(
+            name for name in os.listdir(courses_dir)
+            if name != DEFAULT_COURSE and COURSE_ID_PATTERN.match(name)
+            and os.path.isfile(os.path.join(courses_dir, name, "settings.txt"))
+        )
+
+    def preload_ids(self):
+        if self.preload_courses.strip().lower() == "all":
+            return self.course_ids()
+        return [course_id.strip() for course_id in self.preload_courses.split(",") if course_id.strip()]
+
+    def preload(self):
+        """
+        Loads the shared models and the indexes of the preload courses without
+        creating their engines; safe to call before forking.
+        """
+        from src.engine import preload_course
+        for course_id in self.preload_ids():
+            settings_path, data_dir = self.paths(course_id)
+            with metrics.span("preload_course"):
+                self._preloaded[course_id] = preload_course(settings_path, data_dir, self.models)
+            logger.info("Preloaded course %s.", course_id)
+
+    def warm(self) -> bool:
+        """
+        Creates the engines of the preload courses; returns whether all loaded.
+        """
+        try:
+            for course_id in self.preload_ids():
+                self.engine(course_id)
+        except Exception as e:
+            self.warm_error = e
+            logger.exception("Warming the courses failed; they load on their first request.")
+            return False
+        finally:
+            self._warmed.set()
+        return True
+
+    def start_warming(self, on_done=None):
+        """
+        Runs warm() in a background thread, once; on_done(result) is called
+        when it finishes.
+        """
+        def run():
+            result = self.warm()
+            if on_done:
+                on_done(result)
+
+        with self._lock:
+            if self._warming is None:
+                self._warming = threading.Thread(target=run, name="warm-courses", daemon=True)
+                self._warming.start()
+
+    def ready(self) -> bool:
+        return self._warmed.is_set() and self.warm_error is None
+
+    def loaded(self):
+        with self._lock:
+            return list(self._engines)
+
+    def engine(self, course_id=None):
+        """
+        Returns the course's engine, loading it if needed. Raises UnknownCourse.
+        """
+        course_id = course_id or DEFAULT_COURSE
+        with self._lock:
+            if course_id in self._engines:
+                self._engines.move_to_end(course_id)
+                return self._engines[course_id][0]
+        settings_path, data_dir = self.paths(course_id)
+        with self._lock:
+            load_lock = self._load_locks.setdefault(course_id, threading.Lock())
+
+        # Other courses keep serving while this one loads.
+        with load_lock:
+            with self._lock:
+                if course_id in self._engines:
+                    self._engines.move_to_end(course_id)
+                    return self._engines[course_id][0]
+            from src.engine import QAEngine
+            with metrics.span("load_course"):
+                engine = QAEngine(settings_path, data_dir, models=self.models, course_id=course_id,
+                                  index=self._preloaded.pop(course_id, None))
+            footprint = course_footprint(data_dir)
+            metrics.inc("qa_course_loads_total", course=course_id)
+            logger.info("Loaded course %s (%.0f MB).", course_id, footprint / 2**20)
+            with self._lock:
+                self._engines[course_id] = (engine, footprint)
+                self._evict()
+            return engine
+
+    def _evict(self):
+        # Called with the lock held; the most recently used course is never evicted.
+        total = sum(footprint for _, footprint in self._engines.values())
+        while self.memory_budget and total > self.memory_budget and len(self._engines) > 1:
+            course_id, (engine, footprint) = self._engines.popitem(last=False)
+            engine.close()
+            total -= footprint
+            metrics.inc("qa_course_evictions_total", course=course_id)
+            logger.info("Evicted course %s (%.0f MB) to stay within the memory budget.",
+                        course_id, footprint / 2**20)
+        metrics.set("qa_courses_loaded", len(self._engines))
+        metrics.set("qa_courses_loaded_bytes", total)
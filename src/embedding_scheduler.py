@@ -0,0 +1,175 @@
+import re
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+import openai
+
+from src.tokens import load_encoding, count_tokens
+
+logger = logging.getLogger(__name__)
+
+# OpenAI accepts at most this many inputs in one embeddings request.
+MAX_INPUTS_PER_REQUEST = 2048
+
+
+class TokenBucket:
+    """
+    Refills continuously at `per_minute` units per minute up to `per_minute`.
+    acquire() blocks until the requested amount is available.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, amount: float) -> float:
+        """
+        Takes `amount` if available and returns 0, otherwise returns the
+        seconds until it will be.
+        """
+        # A single request larger than the bucket would otherwise wait forever.
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.level >= amount:
+                self.level -= amount
+                return 0.0
+            return (amount - self.level) / self.rate
+
+    def acquire(self, amount: float) -> None:
+        while True:
+            wait = self.try_acquire(amount)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def drain(self) -> None:
+        """
+        Empties the bucket, e.g. after the server reported a rate limit.
+        """
+        with self._lock:
+            self.level = 0.0
+            self.updated = time.monotonic()
+
+
+def parse_duration(value: str) -> float:
+    """
+    Parses OpenAI reset durations such as "20ms", "1s" or "6m0s" into seconds.
+    """
+    units = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|s|m|h)', value or '')
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def retry_delay(headers, attempt: int) -> float:
+    """
+    Seconds to wait after a 429, from the retry headers when present and
+    exponential backoff otherwise.
+    """
+    if headers is not None:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000.0
+        retry_after = headers.get('retry-after')
+        if retry_after and retry_after.replace('.', '', 1).isdigit():
+            return float(retry_after)
+        reset = max(parse_duration(headers.get('x-ratelimit-reset-tokens')),
+                    parse_duration(headers.get('x-ratelimit-reset-requests')))
+        if reset:
+            return reset
+    return min(60.0, 2.0 ** attempt)
+
+
+class EmbeddingScheduler:
+    """
+    Embeds texts through the OpenAI embeddings API as fast as the account's
+    limits allow.
+
+    Texts are split into requests of at most `max_tokens_per_request` tokens
+    (counted with the model's tokenizer). Up to `concurrency` requests are in
+    flight at once, each admitted by a tokens-per-minute and a requests-per-minute
+    bucket. A 429 drains both buckets and waits for the time given in the retry
+    headers before trying the request again.
+    """
+
+    def __init__(self, client, model: str, tokens_per_minute: int, requests_per_minute: int,
+                 max_tokens_per_request: int = 250000, concurrency: int = 4, max_retries: int = 8):
+        self.client = client
+        self.model = model
+        self.max_tokens_per_request = max_tokens_per_request
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.requests = TokenBucket(requests_per_minute)
+        self.encoding = load_encoding(model)
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+        self.num_requests = 0
+        self.num_rate_limited = 0
+        self.num_tokens = 0
+
+    def count_tokens(self, text: str) -> int:
+        return count_tokens(self.encoding, text)
+
+    def make_batches(self, texts: List[str]) -> List[Tuple[int, int, int]]:
+        """
+        Splits texts into consecutive (start, end, tokens) request batches.
+        """
+        batches = []
+        start = 0
+        tokens = 0
+        for i, text in enumerate(texts):
+            count = self.count_tokens(text)
+            if i > start and (tokens + count > self.max_tokens_per_request or i - start >= MAX_INPUTS_PER_REQUEST):
+                batches.append((start, i, tokens))
+                start, tokens = i, 0
+            tokens += count
+        if start < len(texts):
+            batches.append((start, len(texts), tokens))
+        return batches
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Returns one float32 embedding row per text, in input order.
+        """
+        batches = self.make_batches(texts)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = [pool.submit(self._embed_batch, texts[start:end], tokens) for start, end, tokens in batches]
+            return np.vstack([future.result() for future in futures])
+
+    def _wait_for_resume(self) -> None:
+        with self._lock:
+            delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _embed_batch(self, batch: List[str], tokens: int) -> np.ndarray:
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_resume()
+            self.requests.acquire(1)
+            self.tokens.acquire(tokens)
+            try:
+                response = self.client.embeddings.create(model=self.model, input=batch)
+            except openai.RateLimitError as e:
+                delay = retry_delay(getattr(e.response, 'headers', None), attempt)
+                with self._lock:
+                    self.num_rate_limited += 1
+                    self._resume_at = max(self._resume_at, time.monotonic() + delay)
+                self.tokens.drain()
+                self.requests.drain()
+                logger.warning("Rate limited; retrying in %.1fs.", delay)
+                continue
+            with self._lock:
+                self.num_requests += 1
+                self.num_tokens += tokens
+            data = sorted(response.data, key=lambda item: item.index)
+            return np.array([item.embedding for item in data], dtype=np.float32)
+        raise RuntimeError(f"Embedding request still rate limited after {self.max_retries} retries.")
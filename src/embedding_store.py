@@ -0,0 +1,75 @@
+import os
+import json
+from typing import Iterator, Dict, Any, List
+
+import numpy as np
+
+# Hand-off from embed_documents.py to create_final_data.py.
+EMBEDDINGS_FILE = "embeddings.npy"        # float32[n, dim], memory-mappable
+META_FILE = "embeddings_meta.jsonl"       # one chunk record per row, same order
+
+
+class EmbeddingWriter:
+    """
+    Writes embeddings row by row into a preallocated .npy file plus the JSON-lines
+    metadata sidecar, so no more than one batch is held in memory. The files
+    only replace the previous ones when close() is called.
+    """
+
+    def __init__(self, data_dir: str, num_rows: int):
+        self.data_dir = data_dir
+        self.num_rows = num_rows
+        self.rows_written = 0
+        self._vectors = None
+        os.makedirs(data_dir, exist_ok=True)
+        self._vectors_tmp = os.path.join(data_dir, EMBEDDINGS_FILE + '.tmp')
+        self._meta_tmp = os.path.join(data_dir, META_FILE + '.tmp')
+        self._meta = open(self._meta_tmp, 'w', encoding='utf-8')
+
+    def write(self, records: List[Dict[str, Any]], vectors: np.ndarray) -> None:
+        if self._vectors is None:
+            # The dimension is only known once the first batch is embedded.
+            self._vectors = np.lib.format.open_memmap(
+                self._vectors_tmp, mode='w+', dtype=np.float32, shape=(self.num_rows, vectors.shape[1])
+            )
+        end = self.rows_written + len(records)
+        self._vectors[self.rows_written:end] = vectors
+        for record in records:
+            self._meta.write(json.dumps({
+                'chunk_id': record['chunk_id'],
+                'filename': record['filename'],
+                'chunk_index': record['chunk_index'],
+                'chunk_text': record['chunk_text'],
+            }, ensure_ascii=False) + '\n')
+        self.rows_written = end
+
+    def close(self) -> None:
+        if self.rows_written != self.num_rows:
+            raise ValueError(f"Expected {self.num_rows} rows, wrote {self.rows_written}.")
+        self._meta.close()
+        if self._vectors is not None:
+            self._vectors.flush()
+            del self._vectors
+            os.replace(self._vectors_tmp, os.path.join(self.data_dir, EMBEDDINGS_FILE))
+        os.replace(self._meta_tmp, os.path.join(self.data_dir, META_FILE))
+
+
+def embeddings_exist(data_dir: str) -> bool:
+    return (os.path.exists(os.path.join(data_dir, EMBEDDINGS_FILE))
+            and os.path.exists(os.path.join(data_dir, META_FILE)))
+
+
+def open_embeddings(data_dir: str) -> np.ndarray:
+    """
+    Memory-maps the embedding matrix; slices are read from disk on access.
+    """
+    return np.load(os.path.join(data_dir, EMBEDDINGS_FILE), mmap_mode='r')
+
+
+def read_embedding_meta(data_dir: str) -> Iterator[Dict[str, Any]]:
+    """
+    Streams the chunk records in embedding-row order.
+    """
+    with open(os.path.join(data_dir, META_FILE), 'r', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
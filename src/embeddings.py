@@ -0,0 +1,112 @@
+import os
+import json
+from typing import List
+
+import numpy as np
+
+DEFAULT_SENTENCE_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_ONNX_MODEL_DIR = "models/all-MiniLM-L6-v2-onnx"
+
+# Files written by scripts/export_onnx.py.
+ONNX_MODEL_FILE = "model_quantized.onnx"
+ONNX_TOKENIZER_FILE = "tokenizer.json"
+ONNX_CONFIG_FILE = "onnx_config.json"
+
+
+class SentenceTransformerEncoder:
+    """
+    PyTorch encoder through sentence-transformers. torch is only imported when
+    this encoder is created.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 16):
+        from sentence_transformers import SentenceTransformer
+        self.name = model_name
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        embeddings = self.model.encode(texts, batch_size=self.batch_size, show_progress_bar=False)
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+class OnnxEncoder:
+    """
+    Int8-quantized ONNX Runtime export of a sentence-transformers model, as
+    written by scripts/export_onnx.py. Reproduces the model's tokenization,
+    mean pooling and normalization without importing torch.
+    """
+
+    def __init__(self, model_dir: str, batch_size: int = 64, num_threads: int = 0):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.name = model_dir
+        self.batch_size = batch_size
+        with open(os.path.join(model_dir, ONNX_CONFIG_FILE), 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, ONNX_TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=self.config['max_seq_length'])
+        self.tokenizer.enable_padding(pad_id=self.config.get('pad_token_id', 0),
+                                      pad_token=self.config.get('pad_token', '[PAD]'))
+
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, ONNX_MODEL_FILE), options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        batches = [self._encode_batch(texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size)]
+        return np.vstack(batches) if batches else np.zeros((0, self.config['dimension']), dtype=np.float32)
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feed = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self.input_names:
+            feed['token_type_ids'] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        token_embeddings = self.session.run(None, feed)[0]
+
+        # Mean pooling over real (non-padding) tokens, as in the Pooling module.
+        mask = attention_mask[:, :, None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        embeddings = summed / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config.get('normalize', True):
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32)
+
+
+def load_encoder(settings: dict, base_dir: str):
+    """
+    Creates the local encoder selected by `embedding_method` in settings.txt:
+    "sentence-transformers" (default) or "onnx".
+    """
+    method = settings.get("embedding_method", "sentence-transformers").lower()
+    if method == "onnx":
+        model_dir = os.path.join(base_dir, settings.get("onnx_model_dir", DEFAULT_ONNX_MODEL_DIR))
+        if not os.path.exists(os.path.join(model_dir, ONNX_MODEL_FILE)):
+            raise FileNotFoundError(f"ONNX model not found in {model_dir}. Please run scripts/export_onnx.py first.")
+        return OnnxEncoder(model_dir,
+                           batch_size=int(settings.get("embedding_batch_size", 64)),
+                           num_threads=int(settings.get("onnx_threads", 0)))
+    if method == "sentence-transformers":
+        return SentenceTransformerEncoder(settings.get("sentence_transformer_model", DEFAULT_SENTENCE_MODEL),
+                                          batch_size=int(settings.get("embedding_batch_size", 16)))
+    raise ValueError(f"embedding_method '{method}' has no local encoder.")
+
+
+def encoder_id(settings: dict) -> str:
+    """
+    Identifies the embedding model in the manifest, so a change of backend or
+    model triggers re-embedding.
+    """
+    method = settings.get("embedding_method", "sentence-transformers").lower()
+    if method == "onnx":
+        return f"onnx:{settings.get('onnx_model_dir', DEFAULT_ONNX_MODEL_DIR)}"
+    if method == "openai":
+        return f"openai:{settings.get('openai_embedding_model', 'text-embedding-ada-002')}"
+    return f"{method}:{settings.get('sentence_transformer_model', DEFAULT_SENTENCE_MODEL)}"
@@ -0,0 +1,969 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import weakref
+import threading
+import contextvars
+import dataclasses
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import config
+import openai
+import numpy as np
+import faiss
+
+from src.chunk_store import ChunkStore
+from src.answer_cache import SemanticCache, context_key, index_fingerprint
+from src.quiz_bank import QuizBank
+from src.gate_memo import GateMemo
+from src.batcher import MicroBatcher
+from src.bm25 import BM25Index, bm25_index_exists, reciprocal_rank_fusion
+from src.rerank import DEFAULT_RERANK_MODEL, DEFAULT_MAX_LENGTH
+from src.context import ContextPacker
+from src.sessions import SessionStore
+from src.llm import LLMTimeout
+from src.model_pool import ModelPool
+from src.metrics import metrics, request_timings
+from src.index_versions import current_version, index_dir
+from src.settings import DEFAULT_COURSE, project_root, read_settings
+
+logger = logging.getLogger(__name__)
+
+# (engine, IndexGeneration) a request runs against, set for its whole duration.
+_pinned_index = contextvars.ContextVar("pinned_index", default=None)
+
+CHAT_MODEL = "gpt-4o-mini"
+FALLBACK_REPLY = "I'm sorry but I cannot answer that question. Can you rephrase or ask an alternative?"
+
+# Held by the one process of a server that regenerates a course's quizzes.
+QUIZ_REFILL_LOCK = "quiz_refill.lock"
+
+# Histogram buckets for query batch sizes and for context tokens per prompt.
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+CONTEXT_TOKEN_BUCKETS = (250, 500, 1000, 1500, 2000, 3000, 4000, 8000)
+
+if config.OPENAI_API_KEY:
+    openai.api_key = config.OPENAI_API_KEY
+    os.environ["OPENAI_API_KEY"] = config.OPENAI_API_KEY
+
+
+def load_faiss_resources(data_dir):
+    faiss_index_path = os.path.join(data_dir, "faiss_index.bin")
+    chunk_store_dir = os.path.join(data_dir, "chunk_store")
+    if not os.path.exists(faiss_index_path):
+        raise FileNotFoundError("FAISS index not found. Please run the load processed data script first.")
+    if not os.path.isdir(chunk_store_dir):
+        if os.path.exists(os.path.join(data_dir, "faiss_metadata.json")):
+            raise FileNotFoundError("Chunk store not found. Please run scripts/migrate_metadata.py to convert faiss_metadata.json.")
+        raise FileNotFoundError("Chunk store not found. Please run the load processed data script first.")
+    info = load_index_info(data_dir)
+    index = faiss.read_index(faiss_index_path, faiss_io_flags(info.get("index_type", "flat")))
+    apply_search_params(index, info)
+    return index, ChunkStore(chunk_store_dir)
+
+
+def faiss_io_flags(index_type):
+    """
+    The read_index flags that memory-map an index of `index_type` rather than
+    copying it into the heap, so all processes serving it share one copy in
+    the page cache. IO_FLAG_MMAP maps the inverted lists of IVF indexes;
+    flat and HNSW codes are only mapped by IO_FLAG_MMAP_IFC (faiss >= 1.11).
+    With older faiss they are read into the heap, and gunicorn workers share
+    them only when the master preloaded them (copy-on-write).
+    """
+    if index_type.startswith("ivf"):
+        return faiss.IO_FLAG_MMAP
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+
+def load_index_info(data_dir):
+    """
+    Reads the index type and search parameters written by create_final_data.py.
+    Indexes built before index types were selectable have no info file and are flat.
+    """
+    info_path = os.path.join(data_dir, "faiss_index_info.json")
+    if not os.path.exists(info_path):
+        return {"index_type": "flat"}
+    with open(info_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def apply_search_params(index, info):
+    params = faiss.ParameterSpace()
+    if "nprobe" in info:
+        params.set_index_parameter(index, "nprobe", info["nprobe"])
+    if "efSearch" in info:
+        params.set_index_parameter(index, "efSearch", info["efSearch"])
+    logger.info("Loaded %s index with %d vectors.", info.get("index_type", "flat"), index.ntotal)
+
+
+def parse_question_type(user_input):
+    """
+    Splits the question-type prefix off the raw user input:
+    "m:" for multiple choice, "a:" for answer-check, otherwise normal.
+    """
+    user_input = user_input.strip()
+    if user_input.lower().startswith("m:"):
+        return "multiple_choice", user_input[2:].strip()
+    if user_input.lower().startswith("a:"):
+        return "answer_check", user_input[2:].strip()
+    return "normal", user_input
+
+
+@dataclass
+class Answer:
+    reply: str
+    question_type: str
+    # Verification result; None when the question type is not verified (m:).
+    verified: Optional[bool] = None
+    # True when the first reply failed verification and was replaced.
+    replaced: bool = False
+    # True when the reply was served from the semantic answer cache, or for m:
+    # from the quiz bank.
+    cached: bool = False
+    # Context to carry into the next question as `last_session` (None for a:).
+    session_context: Optional[str] = None
+    # Chat-model tokens of the retrieved context in the prompt(s), first and retry.
+    context_tokens: list = field(default_factory=list)
+    # Ids of the chunks the final reply was given with.
+    context_ids: list = field(default_factory=list)
+    # Quiz bank id of an m: reply, so its session is not served it again.
+    quiz_id: Optional[int] = None
+    # Wall-clock seconds spent per pipeline stage (spans of the same stage add
+    # up; parallel stages overlap), and in the whole request as "total".
+    timings: dict = field(default_factory=dict)
+
+
+@dataclass
+class IndexGeneration:
+    """
+    One loaded version of a course's index files. Requests keep using the
+    generation they started with while a newer one is swapped in; it is freed
+    when the last of them finishes.
+    """
+    version: str
+    faiss_index: Any
+    chunk_store: ChunkStore
+    bm25: Optional[BM25Index]
+    context_packer: ContextPacker
+
+
+def load_index_generation(data_dir, settings, version=None) -> IndexGeneration:
+    """
+    Loads the index files of `version` (None: the flat layout in data/).
+    """
+    directory = index_dir(data_dir, version)
+    faiss_index, chunk_store = load_faiss_resources(directory)
+    bm25 = None
+    # "hybrid" fuses the FAISS ranking with the BM25 keyword index built by
+    # prepare_documents.py; "dense" uses FAISS alone.
+    if settings.get("retrieval", "hybrid").lower() == "hybrid":
+        bm25_dir = os.path.join(directory, "bm25")
+        if bm25_index_exists(bm25_dir):
+            bm25 = BM25Index(bm25_dir)
+        else:
+            logger.warning("No BM25 index in %s; using dense retrieval only. "
+                           "Run scripts/prepare_documents.py to build it.", bm25_dir)
+    # Context is packed into a token budget of the chat model's tokenizer
+    # rather than a fixed number of chunks.
+    budget = int(settings.get("context_token_budget", 1500))
+    return IndexGeneration(
+        version=version or index_fingerprint(os.path.join(directory, "faiss_index.bin")),
+        faiss_index=faiss_index,
+        chunk_store=chunk_store,
+        bm25=bm25,
+        context_packer=ContextPacker(chunk_store, CHAT_MODEL, budget=budget),
+    )
+
+
+def is_current(generation, data_dir) -> bool:
+    """
+    Whether `generation` is still the index published in `data_dir`.
+    """
+    version = current_version(data_dir)
+    if version is None:
+        flat_index_path = os.path.join(data_dir, "faiss_index.bin")
+        if not os.path.exists(flat_index_path):
+            return False
+        version = index_fingerprint(flat_index_path)
+    return generation.version == version
+
+
+def load_reranker(settings, models):
+    """
+    The course's cross-encoder from the `models` pool, or None with rerank=off.
+    """
+    if settings.get("rerank", "on").lower() != "on":
+        return None
+    return models.reranker(settings.get("rerank_model", DEFAULT_RERANK_MODEL),
+                           batch_size=int(settings.get("rerank_batch_size", 32)),
+                           max_length=int(settings.get("rerank_max_length", DEFAULT_MAX_LENGTH)))
+
+
+def preload_course(settings_path, data_dir, models) -> IndexGeneration:
+    """
+    Loads the parts of a course's engine that processes forked afterwards can
+    share: its models, into `models`, and its memory-mapped index, returned
+    for QAEngine(index=...). Runs no inference, starts no threads and opens no
+    connections or databases, so the gunicorn master can call it before
+    forking the workers.
+    """
+    settings = read_settings(settings_path)
+    # ONNX Runtime sessions keep thread pools that do not survive a fork; each
+    # worker creates its own.
+    if settings.get("embedding_method", "sentence-transformers").lower() != "onnx":
+        models.encoder(settings)
+    load_reranker(settings, models)
+    return load_index_generation(data_dir, settings, current_version(data_dir))
+
+
+class QAEngine:
+    """
+    Long-lived question-answering engine.
+
+    Loads the settings, embedding model, FAISS index and chunk store once
+    and answers any number of questions against them. One instance is meant
+    to be shared by all requests handled by a process for its course.
+
+    Engines of several courses share the models and the LLM client of the
+    `models` pool passed to them (see src/courses.py).
+
+    A background thread watches data/index/CURRENT. When create_final_data.py
+    publishes a new version, it is loaded next to the one being served and
+    swapped in; requests already running finish on the version they started
+    with, and cached answers of the old version are dropped.
+    """
+
+    def __init__(self, settings_path=None, data_dir=None, models=None, course_id=DEFAULT_COURSE, index=None):
+        settings_path = settings_path or os.path.join(project_root, "settings.txt")
+        data_dir = data_dir or os.path.join(project_root, "data")
+        self.course_id = course_id
+        self.data_dir = data_dir
+        self.settings = read_settings(settings_path)
+        self.models = models or ModelPool(project_root, max_workers=int(self.settings.get("classifier_workers", 8)))
+        # `index` is a generation loaded by preload_course() before a fork. A
+        # worker respawned after a reload is handed the one the master preloaded,
+        # which must not reach the answer cache or quiz bank below: they would
+        # drop or move the entries of the published version.
+        if index is not None and not is_current(index, data_dir):
+            logger.info("Preloaded index version %s is no longer published; loading the current one.",
+                        index.version)
+            index = None
+        self._index = index
+        if self._index is None:
+            with metrics.span("load_index"):
+                self._index = load_index_generation(data_dir, self.settings, current_version(data_dir))
+        # Queries must be embedded by the same backend as the corpus.
+        self.encoder = self.models.encoder(self.settings)
+        self.hybrid_pool = int(self.settings.get("hybrid_pool", 20))
+        self.rrf_k = int(self.settings.get("rrf_k", 60))
+        self.dense_weight = float(self.settings.get("dense_weight", 1.0))
+        self.bm25_weight = float(self.settings.get("bm25_weight", 1.0))
+        # Each request retrieves one pool of rerank_pool candidates, optionally
+        # reordered by a cross-encoder; the answer context is packed from its head
+        # and the retry after a failed verification from the candidates after that.
+        self.rerank_pool = int(self.settings.get("rerank_pool", 20))
+        self.reranker = load_reranker(self.settings, self.models)
+        self.session_token_budget = int(self.settings.get("session_token_budget", 1000))
+        # Concurrent requests share one encode and one multi-row search; a
+        # request alone in the process does not wait for a batch.
+        self.query_batcher = None
+        if self.settings.get("query_batching", "on").lower() == "on":
+            self.query_batcher = MicroBatcher(
+                self._embed_and_search,
+                max_batch=int(self.settings.get("query_batch_max", 16)),
+                max_wait_ms=float(self.settings.get("query_batch_wait_ms", 2)),
+                name="query batcher",
+            )
+        # "reretrieve" searches again when a classifier rewrites the question;
+        # "speculative" keeps the retrieval started on the raw question.
+        self.rewrite_retrieval = self.settings.get("rewrite_retrieval", "reretrieve").lower()
+        # Runs the classifier gates and speculative retrieval concurrently.
+        self._executor = self.models.executor
+        self.answer_cache = None
+        if self.settings.get("answer_cache", "on").lower() == "on":
+            self.answer_cache = SemanticCache(
+                os.path.join(data_dir, "answer_cache.sqlite"),
+                dim=self.faiss_index.d,
+                index_version=self.index_version,
+                threshold=float(self.settings.get("answer_cache_threshold", 0.95)),
+                ttl=float(self.settings.get("answer_cache_ttl", 7 * 24 * 3600)),
+                max_entries=int(self.settings.get("answer_cache_max_entries", 5000)),
+            )
+        # m: requests are served from quizzes pre-generated by
+        # scripts/generate_quizzes.py when one is close enough to the topic.
+        self.quiz_bank = None
+        if self.settings.get("quiz_bank", "on").lower() == "on":
+            self.quiz_bank = QuizBank(
+                os.path.join(data_dir, "quiz_bank.sqlite"),
+                dim=self.faiss_index.d,
+                index_version=self.index_version,
+                threshold=float(self.settings.get("quiz_threshold", 0.6)),
+                candidates=int(self.settings.get("quiz_candidates", 5)),
+                ttl=float(self.settings.get("quiz_max_age_days", 30)) * 24 * 3600,
+            )
+            self.quiz_bank.refresh(self.chunk_store)
+        # Quizzes a reload drops are regenerated in the background.
+        self.quiz_refill = self.settings.get("quiz_refill", "on").lower() == "on"
+        self._refilling = threading.Lock()
+        # One pooled async client for all LLM calls. Each stage gets its own
+        # deadline, cut short by what is left of the request budget.
+        self.llm = self.models.llm(
+            CHAT_MODEL,
+            max_connections=int(self.settings.get("llm_max_connections", 100)),
+            hedge_percentile=float(self.settings.get("hedge_percentile", 95)),
+        )
+        self.request_budget = float(self.settings.get("request_budget", 45))
+        self.stage_timeouts = {
+            "classifier": float(self.settings.get("classifier_timeout", 3)),
+            "answer": float(self.settings.get("answer_timeout", 25)),
+            "verify": float(self.settings.get("verify_timeout", 4)),
+        }
+        # A retry after a failed verification needs at least this much budget left.
+        self.retry_min_budget = float(self.settings.get("retry_min_budget", 10))
+        # Per-request stage timings in responses (Server-Timing header).
+        self.server_timing = self.settings.get("server_timing", "off").lower() == "on"
+        # Conversation turns per session id, shared by all worker processes.
+        self.sessions = SessionStore(
+            os.path.join(data_dir, "sessions.sqlite"),
+            ttl=float(self.settings.get("session_ttl", 3600)),
+            max_turns=int(self.settings.get("session_max_turns", 5)),
+            max_sessions=int(self.settings.get("session_max_sessions", 10000)),
+        )
+        self.gate_memo = None
+        if self.settings.get("gate_memo", "on").lower() == "on":
+            self.gate_memo = GateMemo(
+                os.path.join(data_dir, "gate_memo.sqlite"),
+                max_entries=int(self.settings.get("gate_memo_max_entries", 20000)),
+            )
+        self._reload_lock = threading.Lock()
+        self._failed_version = None
+        self._closed = threading.Event()
+        # Requests in flight; the stores are closed once the engine is closed
+        # and the last of them has finished.
+        self._active = 0
+        self._active_lock = threading.Lock()
+        self._stores_closed = False
+        reload_interval = float(self.settings.get("index_reload_interval", 5))
+        if reload_interval > 0:
+            threading.Thread(target=self._watch_index, args=(reload_interval,),
+                             name=f"index-watch-{course_id}", daemon=True).start()
+
+    @property
+    def index(self) -> IndexGeneration:
+        """
+        The index generation of the current request, or the newest one outside requests.
+        """
+        pinned = _pinned_index.get()
+        if pinned is not None and pinned[0] is self:
+            return pinned[1]
+        return self._index
+
+    @contextmanager
+    def pinned_index(self):
+        """
+        Keeps the code in the block (and tasks it submits) on one index generation.
+        """
+        generation = self.index
+        token = _pinned_index.set((self, generation))
+        try:
+            yield generation
+        finally:
+            _pinned_index.reset(token)
+
+    @property
+    def faiss_index(self):
+        return self.index.faiss_index
+
+    @property
+    def chunk_store(self):
+        return self.index.chunk_store
+
+    @property
+    def context_packer(self):
+        return self.index.context_packer
+
+    @property
+    def index_version(self):
+        return self.index.version
+
+    @property
+    def bm25(self):
+        return self.index.bm25
+
+    @bm25.setter
+    def bm25(self, value):
+        # Lets benchmarks switch hybrid retrieval off and on.
+        self._index = dataclasses.replace(self._index, bm25=value)
+
+    def reload_index(self, version=None) -> bool:
+        """
+        Loads `version` (default: the published one) while the current one keeps
+        serving, then switches new requests to it. Returns whether it switched.
+        """
+        version = version or current_version(self.data_dir)
+        with self._reload_lock:
+            old = self._index
+            if not version or version == old.version:
+                return False
+            try:
+                with metrics.span("load_index"):
+                    generation = load_index_generation(self.data_dir, self.settings, version)
+                if generation.faiss_index.d != old.faiss_index.d:
+                    raise ValueError(f"dimension {generation.faiss_index.d} does not match "
+                                     f"the encoder's {old.faiss_index.d}")
+            except Exception as e:
+                # Retried only once another version is published.
+                self._failed_version = version
+                metrics.inc("qa_index_reload_failures_total", course=self.course_id)
+                logger.error("Could not load index version %s: %s", version, e)
+                return False
+            self._index = generation
+            if self.answer_cache:
+                self.answer_cache.set_index_version(generation.version)
+            if self.quiz_bank:
+                self.quiz_bank.set_index_version(generation.version)
+                refreshed = self.quiz_bank.refresh(generation.chunk_store)
+                # Only the process that carried the bank over sees the drops, so
+                # one process per server regenerates them.
+                if self.quiz_refill and (refreshed["dropped"] or refreshed["expired"]):
+                    threading.Thread(target=self._refill_quizzes, args=(generation,),
+                                     name=f"quiz-refill-{self.course_id}", daemon=True).start()
+            weakref.finalize(old, logger.info, "Released index version %s.", old.version)
+            metrics.inc("qa_index_reloads_total", course=self.course_id)
+            logger.info("Switched to index version %s (%d vectors).", version, generation.faiss_index.ntotal)
+            return True
+
+    def _refill_quizzes(self, generation):
+        """
+        Generates the quizzes the bank of `generation` is missing, like
+        scripts/generate_quizzes.py, until a newer version is swapped in. Only
+        the worker holding data/quiz_refill.lock runs it; the others skip it.
+        """
+        from src.quiz_generation import generate_quizzes, plan_missing
+        if not self._refilling.acquire(blocking=False):
+            # The running refill stops on the version switch; the next one fills the gaps.
+            return
+        lock_file = None
+        try:
+            lock_file = open(os.path.join(self.data_dir, QUIZ_REFILL_LOCK), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                logger.info("Another process is regenerating the quizzes of course %s.", self.course_id)
+                return
+            token = _pinned_index.set((self, generation))
+            try:
+                vectors, ids, groups = plan_missing(self)
+                if not groups:
+                    return
+                logger.info("Regenerating %d quizzes for index version %s.", len(groups), generation.version)
+
+                def stale():
+                    return self._closed.is_set() or self._index is not generation
+
+                done, failed = generate_quizzes(self, vectors, ids, groups, generation.version, concurrency=4,
+                                                should_stop=stale)
+                metrics.inc("qa_quizzes_regenerated_total", done, course=self.course_id)
+                logger.info("Regenerated %d quizzes for index version %s (%d failed).",
+                            done, generation.version, failed)
+            finally:
+                _pinned_index.reset(token)
+        except Exception:
+            logger.exception("Regenerating the quiz bank failed.")
+        finally:
+            if lock_file is not None:
+                # Closing it releases the lock.
+                lock_file.close()
+            self._refilling.release()
+
+    def _watch_index(self, interval):
+        while not self._closed.wait(interval):
+            version = current_version(self.data_dir)
+            if version and version != self._index.version and version != self._failed_version:
+                self.reload_index(version)
+
+    def close(self):
+        """
+        Stops the engine's own worker threads. Requests still holding the engine
+        can finish; its sqlite stores are closed after the last of them, and its
+        index and chunk store are freed with it.
+        """
+        self._closed.set()
+        if self.query_batcher:
+            self.query_batcher.close()
+        with self._active_lock:
+            if self._active == 0:
+                self._close_stores()
+
+    def _close_stores(self):
+        # Called with _active_lock held.
+        if self._stores_closed:
+            return
+        self._stores_closed = True
+        for store in (self.answer_cache, self.quiz_bank, self.gate_memo, self.sessions):
+            if store is not None:
+                store.close()
+
+    def _embed_and_search(self, requests):
+        """
+        Handles a batch of (query, k, embedding, index generation) requests with
+        one encode call for the queries without an embedding and one search per
+        generation for those with k > 0. Returns an (embedding, chunk ids) pair
+        per request.
+        """
+        metrics.observe("qa_query_batch_size", len(requests), buckets=BATCH_SIZE_BUCKETS)
+        embeddings = [request[2] for request in requests]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            with metrics.span("embed"):
+                encoded = self.encoder.encode([requests[i][0] for i in missing])
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+        ids = [np.empty(0, dtype=np.int64)] * len(requests)
+        # Requests that started before an index swap search the generation they started on.
+        by_generation = {}
+        for i, request in enumerate(requests):
+            if request[1] > 0:
+                by_generation.setdefault(id(request[3]), []).append(i)
+        for searched in by_generation.values():
+            generation = requests[searched[0]][3]
+            k_max = max(requests[i][1] for i in searched)
+            with metrics.span("faiss_search"):
+                _, indices = generation.faiss_index.search(np.vstack([embeddings[i] for i in searched]), k_max)
+            for i, row in zip(searched, indices):
+                ids[i] = row[:requests[i][1]]
+        return list(zip(embeddings, ids))
+
+    def _query(self, query, k, query_embedding=None):
+        request = (query, k, query_embedding, self.index)
+        if self.query_batcher:
+            return self.query_batcher.submit(request)
+        return self._embed_and_search([request])[0]
+
+    def embed_query(self, query):
+        with metrics.span("query_embedding"):
+            return self._query(query, 0)[0]
+
+    def retrieve(self, query, k=3, query_embedding=None):
+        """
+        Returns the ids of the `k` best chunks for the query, best first. In
+        hybrid mode the top `hybrid_pool` of the dense and BM25 rankings are
+        fused by weighted reciprocal rank.
+        """
+        with self.pinned_index() as index:
+            pool = max(k, self.hybrid_pool) if index.bm25 else k
+            # Includes the wait for the batch the query is embedded and searched in.
+            with metrics.span("dense_retrieval"):
+                _, indices = self._query(query, pool, query_embedding)
+            ranked = [int(idx) for idx in indices if idx >= 0]
+            if index.bm25:
+                with metrics.span("bm25"):
+                    keyword_ids, _ = index.bm25.search(query, pool)
+                ranked = reciprocal_rank_fusion(
+                    [(ranked, self.dense_weight), (keyword_ids, self.bm25_weight)], k=self.rrf_k
+                )
+            # The BM25 index can list chunks that are not embedded and indexed yet.
+            return [idx for idx in ranked if idx in index.chunk_store][:k]
+
+    def rank_candidates(self, query, query_embedding=None):
+        """
+        Returns the request's ranked candidate pool: the top `rerank_pool` chunk
+        ids for the query, reranked by the cross-encoder when enabled.
+        """
+        ids = self.retrieve(query, k=self.rerank_pool, query_embedding=query_embedding)
+        if self.reranker:
+            with metrics.span("rerank"):
+                ids = self.reranker.rerank(query, [(idx, self.chunk_store.text(idx)) for idx in ids])
+        return ids
+
+    def context_from_ids(self, ids):
+        return "\n\n".join(self.chunk_store.text(idx) for idx in ids)
+
+    def get_context_from_query(self, query, k=3, query_embedding=None):
+        return self.context_from_ids(self.retrieve(query, k, query_embedding))
+
+    def _submit(self, fn, *args):
+        # Runs in a copy of the caller's context so the task's spans count
+        # towards the request that submitted it.
+        return self._executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def _pack(self, ranked, budget=None):
+        with metrics.span("pack"):
+            return self.context_packer.pack(ranked, budget)
+
+    def _stage_timeout(self, stage, deadline):
+        return min(self.stage_timeouts[stage], deadline - time.monotonic())
+
+    def _stream_complete(self, messages, timeout):
+        return self.llm.stream(messages, timeout)
+
+    def _yes_no(self, gate, messages, timeout):
+        """
+        Returns the gate's verdict, or None if it was skipped for lack of time
+        or did not answer within `timeout` seconds.
+        """
+        with metrics.span(gate):
+            if self.gate_memo:
+                memoized = self.gate_memo.get(CHAT_MODEL, messages)
+                if memoized is not None:
+                    metrics.inc("qa_gate_memo_hits_total", gate=gate)
+                    return memoized
+            verdict = self.llm.yes_no(messages, timeout) if timeout > 0 else None
+        if verdict is None:
+            metrics.inc("qa_gates_skipped_total", gate=gate)
+        elif self.gate_memo:
+            self.gate_memo.put(CHAT_MODEL, messages, verdict)
+        return verdict
+
+    def verify_answer(self, original_question, answer, timeout=None):
+        return self._yes_no("verify", [
+            {"role": "system", "content": "Just say 'Yes' or 'No'. Do not give any other answer."},
+            {"role": "user", "content": f"User: {original_question}\nAttendant: {answer}\nWas the Attendant able to answer the user's question?"}
+        ], self.stage_timeouts["verify"] if timeout is None else timeout)
+
+    def check_syllabus(self, question, timeout=None):
+        s = self.settings
+        return self._yes_no("gate_syllabus", [
+            {"role": "user", "content": (
+                f"This question is from a student in an {s.get('classname', '')} taught by {s.get('professor', '')} "
+                f"with the help of {s.get('assistants', '')}. The class is {s.get('classdescription', '')}. "
+                "I want to know whether this question is likely about logistical details, schedule, nature, teachers, "
+                f"assignments, or the syllabus of the course? Answer Yes or No and nothing else: {question}"
+            )}
+        ], self.stage_timeouts["classifier"] if timeout is None else timeout)
+
+    def check_followup(self, new_question, previous_context, timeout=None):
+        return self._yes_no("gate_followup", [
+            {"role": "user", "content": (
+                f"Consider this new question: {new_question}. The previous question and response was: {previous_context}. "
+                "Would it be helpful to include the previous context to answer the new question? Answer Yes or No."
+            )}
+        ], self.stage_timeouts["classifier"] if timeout is None else timeout)
+
+    def build_prompt(self, question_type, original_question):
+        """
+        Returns the system instructions and the final user query for a question type.
+        """
+        classname = self.settings.get("classname", "")
+        classdescription = self.settings.get("classdescription", "")
+        if question_type == "multiple_choice":
+            prompt_instructions = (
+                f"You are a very truthful, precise TA in a {classname}. You think step by step. A strong graduate student "
+                f"is using you as a tutor. The student would like you to prepare a challenging multiple choice question on "
+                "the requested topic drawing ONLY on the attached context. Do not refer to 'the attached context' explicitly. "
+                "Present the question followed by options A to D. After the question, write <span style='display:none'> then give "
+                "your answer and a short explanation, then close the span with </span>."
+            )
+            final_query = f"Construct a challenging multiple-choice question to test me on a concept related to {original_question}"
+        elif question_type == "answer_check":
+            prompt_instructions = (
+                f"You are a very truthful, precise TA in a {classname}. You think step by step. You are testing a strong graduate student "
+                "on their knowledge. Using the attached context, tell me whether the attached multiple choice answer is correct. "
+                "Draw ONLY on the context for definitions and theoretical content. Do not refer to 'the attached context'. Just state "
+                "your answer and rationale."
+            )
+            final_query = original_question
+        else:
+            prompt_instructions = (
+                f"You are a very truthful, precise TA in a {classname}, a {classdescription}. You think step by step. A strong graduate "
+                "student is asking you questions. Answer in no more than three paragraphs if the answer is found in the attached context. "
+                "Do not restate the question or refer explicitly to the context. If you cannot find the answer in the context, say 'I don't know'."
+            )
+            final_query = original_question
+        return prompt_instructions, final_query
+
+    def answer(self, user_input, last_session=None, session_id=None):
+        """
+        Answers one question. With a `session_id`, the previous turn of that
+        session is loaded from the session store and this turn is recorded
+        there. Without one, `last_session` may pass the context returned as
+        `Answer.session_context` by the previous call for the same user.
+        """
+        for event in self.stream(user_input, last_session, session_id):
+            if event["type"] == "done":
+                return event["answer"]
+
+    def stream(self, user_input, last_session=None, session_id=None):
+        """
+        Answers one question (see answer()) as a stream of events:
+          - {"type": "stage", "stage": ...} when a pipeline stage starts
+            ("classifying", "retrieving", "answering", "verifying", "retrying")
+          - {"type": "token", "text": ...} for each piece of the answer as it arrives;
+            tokens after a "retrying" stage belong to a new answer
+          - {"type": "done", "answer": Answer} once, at the end
+
+        Gates that miss their deadline are skipped. An answer that misses its
+        deadline raises LLMTimeout, except on the retry, which then falls back.
+        """
+        timings = {}
+        start = time.perf_counter()
+        question_type = parse_question_type(user_input)[0]
+        with self._active_lock:
+            self._active += 1
+        try:
+            batching = self.query_batcher.request() if self.query_batcher else nullcontext()
+            with request_timings(timings), self.pinned_index(), batching:
+                for event in self._stream(user_input, last_session, session_id, timings):
+                    if event["type"] == "done":
+                        timings["total"] = time.perf_counter() - start
+                        metrics.inc("qa_requests_total", course=self.course_id, question_type=question_type)
+                        metrics.observe("qa_request_seconds", timings["total"],
+                                        course=self.course_id, question_type=question_type)
+                        logger.info("Stage timings: %s",
+                                    ", ".join(f"{k}={v * 1000:.0f}ms" for k, v in timings.items()))
+                    yield event
+        except Exception as e:
+            metrics.inc("qa_request_errors_total", error=e.__class__.__name__)
+            raise
+        finally:
+            with self._active_lock:
+                self._active -= 1
+                if self._active == 0 and self._closed.is_set():
+                    self._close_stores()
+
+    def _stream(self, user_input, last_session, session_id, timings):
+        deadline = time.monotonic() + self.request_budget
+        question_type, user_input = parse_question_type(user_input)
+        original_question = user_input
+
+        # The previous turn's context is rebuilt from its chunk ids; chunks dropped
+        # by a re-index since then are skipped.
+        last_ids = []
+        if session_id and last_session is None:
+            turn = self.sessions.last_turn(session_id)
+            if turn:
+                last_ids = [idx for idx in turn["chunk_ids"] if idx in self.chunk_store]
+                last_session = self._pack(last_ids, budget=self.session_token_budget).text or None
+
+        # Repeated questions are answered from the cache without any LLM call. Before
+        # the follow-up gate only answers given after this same previous context
+        # match; answers to the question asked on its own once the gate has ruled
+        # it standalone.
+        query_embedding = None
+        if self.answer_cache and question_type == "normal":
+            query_embedding = self.embed_query(user_input)
+            cached = self._cached_answer(query_embedding, context_key(last_session), question_type, timings)
+            if cached is not None:
+                yield from self._serve_cached(session_id, user_input, cached)
+                return
+
+        context = ""
+        ranked = []
+        packed = None
+        is_followup = False
+        if question_type == "normal":
+            # The syllabus and follow-up gates are independent round trips, so run them
+            # concurrently, and start retrieval on the raw question while they are in flight.
+            yield {"type": "stage", "stage": "classifying"}
+            with metrics.span("classifiers"):
+                speculative = self._submit(self.rank_candidates, user_input, query_embedding)
+                timeout = self._stage_timeout("classifier", deadline)
+                syllabus = self._submit(self.check_syllabus, user_input, timeout)
+                followup = self._submit(self.check_followup, user_input, last_session, timeout) if last_session else None
+                # A skipped gate (None) leaves the question as it is.
+                is_syllabus = bool(syllabus.result())
+                followup_result = followup.result() if followup else None
+                is_followup = bool(followup_result)
+
+            if followup_result is False and query_embedding is not None:
+                cached = self._cached_answer(query_embedding, "", question_type, timings)
+                if cached is not None:
+                    speculative.cancel()
+                    yield from self._serve_cached(session_id, user_input, cached)
+                    return
+
+            if is_syllabus:
+                logger.info("Detected syllabus-related question; modifying query accordingly.")
+                original_question = f"I may be asking about a detail on the syllabus for {self.settings.get('classname', '')}. {user_input}"
+            if is_followup:
+                logger.info("Detected follow-up question; incorporating previous context.")
+                original_question = f"I have a follow-up on the previous question and response. {last_session} My new question is: {user_input}"
+
+            # Only the retrieval time not hidden behind the classifiers is counted here.
+            yield {"type": "stage", "stage": "retrieving"}
+            with metrics.span("retrieval"):
+                if is_followup and last_ids:
+                    # The previous turn's chunks lead, followed by the new candidates,
+                    # instead of a search for the rewritten question.
+                    previous = set(last_ids)
+                    ranked = last_ids + [idx for idx in speculative.result() if idx not in previous]
+                    logger.info("Reused the previous turn's context for the follow-up.")
+                elif original_question != user_input and self.rewrite_retrieval != "speculative":
+                    speculative.cancel()
+                    ranked = self.rank_candidates(original_question)
+                    logger.info("Re-retrieved context for the rewritten question.")
+                else:
+                    ranked = speculative.result()
+                packed = self._pack(ranked)
+                context = packed.text
+            logger.info("Retrieved relevant context from course materials.")
+        elif question_type == "multiple_choice":
+            if self.quiz_bank:
+                query_embedding = self.embed_query(original_question)
+                # Quizzes this session was served are left out; once every nearby
+                # one was, a new one is generated.
+                seen = [turn["quiz_id"] for turn in self.sessions.turns(session_id)
+                        if turn.get("quiz_id")] if session_id else []
+                with metrics.span("quiz_lookup"):
+                    quiz = self.quiz_bank.lookup(query_embedding, exclude=seen)
+                metrics.inc("qa_quiz_bank_total", result="miss" if quiz is None else "hit")
+                if quiz is not None:
+                    logger.info("Served a pre-generated quiz (hits=%d, misses=%d).",
+                                self.quiz_bank.hits, self.quiz_bank.misses)
+                    # Its chunks are the context an a: answer check is given.
+                    packed = self._pack([idx for idx in quiz["chunk_ids"] if idx in self.chunk_store])
+                    served = Answer(reply=quiz["quiz"], question_type=question_type, cached=True, timings=timings,
+                                    context_ids=packed.chunk_ids, quiz_id=quiz["quiz_id"],
+                                    session_context=self.context_packer.truncate(packed.text, self.session_token_budget))
+                    if session_id:
+                        self._record_turn(session_id, user_input, served)
+                    yield {"type": "token", "text": served.reply}
+                    yield {"type": "done", "answer": served}
+                    return
+            yield {"type": "stage", "stage": "retrieving"}
+            with metrics.span("retrieval"):
+                ranked = self.rank_candidates(original_question, query_embedding)
+                packed = self._pack(ranked)
+                context = packed.text
+            logger.info("Retrieved relevant context from course materials.")
+        elif last_session:
+            context = last_session
+        else:
+            logger.info("No previous session context available for answer-check.")
+
+        prompt_instructions, final_query = self.build_prompt(question_type, original_question)
+        messages = [
+            {"role": "system", "content": prompt_instructions + "\n\nContext:\n" + context},
+            {"role": "user", "content": final_query}
+        ]
+        logger.info("Sending query to GPT...")
+        yield {"type": "stage", "stage": "answering"}
+        parts = []
+        with metrics.span("answer"):
+            for text in self._stream_complete(messages, self._stage_timeout("answer", deadline)):
+                parts.append(text)
+                yield {"type": "token", "text": text}
+        reply = "".join(parts)
+
+        result = Answer(reply=reply, question_type=question_type, timings=timings)
+        if packed:
+            result.context_tokens.append(packed.tokens)
+            metrics.observe("qa_context_tokens", packed.tokens, buckets=CONTEXT_TOKEN_BUCKETS)
+            result.context_ids = packed.chunk_ids
+        if question_type != "answer_check":
+            result.session_context = self.context_packer.truncate(context, self.session_token_budget)
+
+        if question_type != "multiple_choice":
+            yield {"type": "stage", "stage": "verifying"}
+            result.verified = self.verify_answer(original_question, reply, self._stage_timeout("verify", deadline))
+            if result.verified is None:
+                logger.info("Answer verification skipped.")
+            else:
+                logger.info("Answer verification: %s", "Yes" if result.verified else "No")
+            if result.verified is False:
+                metrics.inc("qa_verification_failures_total", question_type=question_type)
+            if result.verified is False and question_type != "answer_check":
+                if deadline - time.monotonic() < self.retry_min_budget:
+                    logger.info("Not enough time left to retry.")
+                    metrics.inc("qa_fallback_replies_total", reason="no_budget")
+                    result.reply = FALLBACK_REPLY
+                    result.replaced = True
+                else:
+                    metrics.inc("qa_retries_total")
+                    with metrics.span("retry"):
+                        yield from self._retry(result, ranked, packed, prompt_instructions, final_query,
+                                               original_question, deadline)
+            if query_embedding is not None and result.verified:
+                self.answer_cache.store(query_embedding, user_input, result.reply, self.index_version,
+                                        context=context_key(last_session) if is_followup else "",
+                                        chunk_ids=result.context_ids)
+        elif query_embedding is not None and result.context_ids:
+            # Generated on demand: the next request on the topic can be served from the bank.
+            result.quiz_id = self.quiz_bank.add(query_embedding, result.context_ids,
+                                                [self.chunk_store.text(idx) for idx in result.context_ids],
+                                                original_question, reply, self.index_version, served=1)
+        if result.context_tokens:
+            logger.info("Context tokens: %s", " + ".join(str(n) for n in result.context_tokens))
+        if session_id and question_type != "answer_check":
+            self._record_turn(session_id, user_input, result)
+        yield {"type": "done", "answer": result}
+
+    def _cached_answer(self, query_embedding, context, question_type, timings) -> Optional[Answer]:
+        """
+        The answer cached for the question after `context` (a context_key()), or None.
+        """
+        with metrics.span("cache_lookup"):
+            entry = self.answer_cache.lookup(query_embedding, context)
+        metrics.inc("qa_answer_cache_total", result="miss" if entry is None else "hit")
+        if entry is None:
+            return None
+        logger.info("Answered from the semantic cache (hits=%d, misses=%d).",
+                    self.answer_cache.hits, self.answer_cache.misses)
+        # A follow-up continues from the chunks the reply was given with.
+        return Answer(reply=entry["reply"], question_type=question_type, verified=True, cached=True,
+                      timings=timings, context_ids=[idx for idx in entry["chunk_ids"] if idx in self.chunk_store])
+
+    def _serve_cached(self, session_id, user_input, cached):
+        if session_id:
+            self._record_turn(session_id, user_input, cached)
+        yield {"type": "token", "text": cached.reply}
+        yield {"type": "done", "answer": cached}
+
+    def _retry(self, result, ranked, packed, prompt_instructions, final_query, original_question, deadline):
+        """
+        Answers again with alternate context after a failed verification and
+        updates `result`, yielding the same events as the first answer.
+        """
+        logger.info("Attempting follow-up query with alternate context.")
+        yield {"type": "stage", "stage": "retrying"}
+        # The candidates after those in the first context, without another
+        # embed or search. Small corpora may have nothing left; retry with
+        # the top of the pool then.
+        consumed = packed.consumed if packed else 0
+        alternate = self._pack(ranked[consumed:] or ranked)
+        result.context_tokens.append(alternate.tokens)
+        metrics.observe("qa_context_tokens", alternate.tokens, buckets=CONTEXT_TOKEN_BUCKETS)
+        followup_messages = [
+            {"role": "system", "content": prompt_instructions + "\n\nContext:\n" + alternate.text},
+            {"role": "user", "content": final_query}
+        ]
+        result.replaced = True
+        parts = []
+        try:
+            for text in self._stream_complete(followup_messages, self._stage_timeout("answer", deadline)):
+                parts.append(text)
+                yield {"type": "token", "text": text}
+        except LLMTimeout:
+            logger.warning("Retry answer timed out.")
+            metrics.inc("qa_fallback_replies_total", reason="retry_timeout")
+            result.reply = FALLBACK_REPLY
+            return
+        followup_reply = "".join(parts)
+        yield {"type": "stage", "stage": "verifying"}
+        verified = self.verify_answer(original_question, followup_reply, self._stage_timeout("verify", deadline))
+        if verified is False:
+            metrics.inc("qa_verification_failures_total", question_type=result.question_type)
+            metrics.inc("qa_fallback_replies_total", reason="retry_unverified")
+            result.reply = FALLBACK_REPLY
+        else:
+            # An unverifiable retry is still better than the reply that failed.
+            result.reply = followup_reply
+            result.verified = verified
+            result.context_ids = alternate.chunk_ids
+
+    def _record_turn(self, session_id, question, answer):
+        if answer.context_ids:
+            turn = {
+                "question": question,
+                "question_type": answer.question_type,
+                "chunk_ids": [int(idx) for idx in answer.context_ids],
+                "time": time.time(),
+            }
+            if answer.quiz_id:
+                turn["quiz_id"] = answer.quiz_id
+            self.sessions.append(session_id, turn)
@@ -0,0 +1,83 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+
+
+def prompt_key(model, messages):
+    """
+    Hash of the model name and the prompt with whitespace and case normalized,
+    so trivially different spellings of the same question share an entry.
+    """
+    normalized = [
+        {"role": m["role"], "content": re.sub(r"\s+", " ", m["content"]).strip().casefold()}
+        for m in messages
+    ]
+    payload = json.dumps({"model": model, "messages": normalized}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GateMemo:
+    """
+    Persistent memo of yes/no classifier results.
+
+    The gates run at temperature 0 with a five-token answer, so the same prompt
+    always gets the same verdict. Results are kept in a sqlite file shared by
+    all worker processes, capped at `max_entries` with least-recently-used
+    eviction.
+    """
+
+    def __init__(self, path, max_entries=20000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS gates ("
+            " key TEXT PRIMARY KEY,"
+            " result INTEGER NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS gates_last_used ON gates (last_used)")
+        self._conn.commit()
+
+    def get(self, model, messages) -> Optional[bool]:
+        key = prompt_key(model, messages)
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM gates WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE gates SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return bool(row[0])
+
+    def put(self, model, messages, result):
+        key = prompt_key(model, messages)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO gates (key, result, last_used) VALUES (?, ?, ?)",
+                (key, int(result), time.time())
+            )
+            # Trimming needs a full scan of the index, so only do it every so often.
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._conn.execute(
+                    "DELETE FROM gates WHERE key IN ("
+                    " SELECT key FROM gates ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,62 @@
+import os
+import time
+import shutil
+import secrets
+from typing import Optional, Tuple
+
+# Versioned layout written by create_final_data.py:
+#   data/index/<version>/faiss_index.bin, faiss_index_info.json, chunk_store/, bm25/
+#   data/index/CURRENT   name of the version to serve, replaced atomically
+INDEX_DIR = "index"
+CURRENT_FILE = "CURRENT"
+
+
+def current_version(data_dir) -> Optional[str]:
+    """
+    The published index version, or None for the flat layout of older builds
+    (faiss_index.bin and chunk_store/ directly in data/).
+    """
+    try:
+        with open(os.path.join(data_dir, INDEX_DIR, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def index_dir(data_dir, version=None) -> str:
+    """
+    Directory holding the index files of `version`; by default the published
+    one, or data/ itself in the flat layout.
+    """
+    version = version or current_version(data_dir)
+    return os.path.join(data_dir, INDEX_DIR, version) if version else data_dir
+
+
+def new_version_dir(data_dir) -> Tuple[str, str]:
+    """
+    Creates an empty directory for a new index version; returns (version, path).
+    """
+    version = time.strftime("%Y%m%d-%H%M%S") + "-" + secrets.token_hex(3)
+    path = os.path.join(data_dir, INDEX_DIR, version)
+    os.makedirs(path)
+    return version, path
+
+
+def publish_version(data_dir, version, keep=3) -> None:
+    """
+    Points CURRENT at `version` in one rename, so servers switch to a complete
+    index, then deletes all but the `keep` newest versions. Servers still
+    answering with a deleted version keep their open files until they let go.
+    """
+    versions_dir = os.path.join(data_dir, INDEX_DIR)
+    tmp_path = os.path.join(versions_dir, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(versions_dir, CURRENT_FILE))
+    versions = sorted(name for name in os.listdir(versions_dir)
+                      if os.path.isdir(os.path.join(versions_dir, name)))
+    for name in versions[:-keep] if keep > 0 else []:
+        if name != version:
+            shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
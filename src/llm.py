@@ -0,0 +1,210 @@
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Optional
+
+import numpy as np
+import openai
+
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class LLMTimeout(TimeoutError):
+    pass
+
+
+class LatencyTracker:
+    """
+    Recent call latencies of one kind of request, for its p95.
+    """
+
+    def __init__(self, window=500, min_samples=20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, pct) -> Optional[float]:
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            return float(np.percentile(self.samples, pct))
+
+
+class LLMClient:
+    """
+    Shared chat-completion client for all requests of a process.
+
+    Runs one AsyncOpenAI client, and so one pooled set of keep-alive
+    connections, on an event loop in a background thread; the synchronous
+    methods submit coroutines to it and wait with a deadline, so any thread
+    can use them.
+
+    yes_no() is hedged: if a gate has not answered once its recent p95 latency
+    has passed, an identical second request is sent and whichever answers
+    first wins. Gates return None instead of raising when they time out or
+    fail, so the caller can skip them.
+    """
+
+    def __init__(self, model, client=None, max_connections=100, max_keepalive=20,
+                 hedge_percentile=95.0, hedge_min_delay=0.2, hedge_initial_delay=1.5):
+        self.model = model
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_initial_delay = hedge_initial_delay
+        self.gate_latency = LatencyTracker()
+        self.num_gate_calls = 0
+        self.num_hedged = 0
+        self.num_gate_failures = 0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-client", daemon=True)
+        self._thread.start()
+        if client is None:
+            client = self._run(self._make_client(max_connections, max_keepalive))
+        self.client = client
+
+    @staticmethod
+    async def _make_client(max_connections, max_keepalive):
+        # Created on the loop it is used from. Retries are left to the deadlines
+        # and hedging here rather than the client's own backoff.
+        import httpx
+        http_client = openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        )
+        return openai.AsyncOpenAI(http_client=http_client, max_retries=0)
+
+    def _run(self, coroutine, timeout=None):
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    async def _create(self, messages, timeout, **kwargs):
+        return await self.client.chat.completions.create(
+            model=self.model, messages=messages, timeout=timeout, **kwargs
+        )
+
+    def complete(self, messages, timeout, **kwargs) -> str:
+        """
+        One completion; raises LLMTimeout after `timeout` seconds.
+        """
+        try:
+            response = self._run(asyncio.wait_for(self._create(messages, timeout, **kwargs), timeout))
+        except (asyncio.TimeoutError, openai.APITimeoutError) as e:
+            metrics.inc("qa_llm_timeouts_total", call="complete")
+            raise LLMTimeout(f"No completion within {timeout:.1f}s") from e
+        return response.choices[0].message.content
+
+    def stream(self, messages, timeout, **kwargs):
+        """
+        Yields the completion's text deltas as they arrive; raises LLMTimeout if
+        the whole completion has not arrived after `timeout` seconds.
+        """
+        deltas = queue.Queue()
+
+        async def produce():
+            stream = await self._create(messages, timeout, stream=True, **kwargs)
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    deltas.put(chunk.choices[0].delta.content)
+
+        async def run():
+            try:
+                await asyncio.wait_for(produce(), timeout)
+            except BaseException as e:
+                deltas.put(e)
+                if not isinstance(e, Exception):
+                    raise
+            finally:
+                deltas.put(_DONE)
+
+        future = asyncio.run_coroutine_threadsafe(run(), self._loop)
+        try:
+            while True:
+                item = deltas.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, (asyncio.TimeoutError, openai.APITimeoutError)):
+                    metrics.inc("qa_llm_timeouts_total", call="stream")
+                    raise LLMTimeout(f"Completion did not finish within {timeout:.1f}s") from item
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Stops the request if the consumer gives up early.
+            future.cancel()
+
+    def hedge_delay(self) -> float:
+        p95 = self.gate_latency.percentile(self.hedge_percentile)
+        return self.hedge_initial_delay if p95 is None else max(self.hedge_min_delay, p95)
+
+    async def _gate_call(self, messages, timeout):
+        start = time.perf_counter()
+        try:
+            response = await self._create(messages, timeout, max_tokens=5, temperature=0.0)
+        except (asyncio.CancelledError, openai.APITimeoutError):
+            # An attempt that lost to its hedge or ran out of time took at least
+            # this long; leaving it out would pull the p95, and so the hedge
+            # delay, down to the fast calls only.
+            self.gate_latency.record(time.perf_counter() - start)
+            raise
+        self.gate_latency.record(time.perf_counter() - start)
+        return response.choices[0].message.content
+
+    async def _hedged(self, messages, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        hedge_at = loop.time() + self.hedge_delay()
+        pending = {asyncio.ensure_future(self._gate_call(messages, timeout))}
+        hedged = False
+        error = None
+        try:
+            while True:
+                now = loop.time()
+                if now >= deadline:
+                    raise asyncio.TimeoutError()
+                # A failed first attempt is hedged at once.
+                if not hedged and (now >= hedge_at or not pending):
+                    hedged = True
+                    self.num_hedged += 1
+                    metrics.inc("qa_llm_hedged_total")
+                    pending.add(asyncio.ensure_future(self._gate_call(messages, deadline - now)))
+                if not pending:
+                    raise error
+                wait_until = deadline if hedged else min(deadline, hedge_at)
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, wait_until - now),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def yes_no(self, messages, timeout) -> Optional[bool]:
+        """
+        Asks a yes/no gate; returns None if it did not answer in time or failed.
+        """
+        self.num_gate_calls += 1
+        try:
+            # The loop thread enforces the deadline; the wait here only needs slack.
+            result = self._run(self._hedged(messages, timeout), timeout + 1.0)
+        except Exception as e:
+            self.num_gate_failures += 1
+            metrics.inc("qa_llm_gate_failures_total", error=e.__class__.__name__)
+            logger.warning("Gate skipped after %s (%.1fs deadline).", e.__class__.__name__, timeout)
+            return None
+        return result.strip().lower().startswith("y")
@@ -0,0 +1,39 @@
+import os
+import json
+import hashlib
+from typing import Dict, Any
+
+MANIFEST_FILE = "manifest.json"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(data_dir: str) -> Dict[str, Any]:
+    """
+    Loads the ingestion manifest shared by the data scripts:
+      - 'files': {relative path: {'sha256', 'filename', 'chunk_ids'}} for every
+        source document in the last prepare_documents.py run
+      - 'next_chunk_id': first unused chunk id; ids are never reused
+      - 'chunking': chunk_size/overlap the chunks were made with
+      - 'embedding_model': model the stored embeddings were made with
+    """
+    path = os.path.join(data_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'files': {}, 'next_chunk_id': 0, 'chunking': None, 'embedding_model': None}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(data_dir: str, manifest: Dict[str, Any]) -> None:
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, MANIFEST_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
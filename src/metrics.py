@@ -0,0 +1,295 @@
+import os
+import glob
+import json
+import fcntl
+import time
+import bisect
+import secrets
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0)
+
+# Snapshot holding the summed counters and histograms of workers that exited.
+EXITED_SNAPSHOT = "exited.json"
+
+# Stage timings of the request being handled in this context, filled by span().
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (key + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for key, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Metrics:
+    """
+    Process-local counters, gauges and histograms, rendered in the Prometheus
+    text format.
+
+    Recording takes a lock and a few dictionary updates, so it can stay on in
+    production. Each gunicorn worker has its own registry; with
+    enable_snapshots() every worker writes its values to a shared directory
+    every few seconds and render() sums all workers, so a scrape that lands on
+    any worker sees the whole server. Gauges are summed over the workers whose
+    snapshot is recent, so exited workers drop out of them; counters and
+    histograms keep counting the last snapshot of exited workers, so the sums
+    never go down: render() folds the snapshots of processes that are no
+    longer running into one exited.json. Snapshot file names are unique per
+    process, not just per pid, so a worker that reuses an exited worker's pid
+    does not overwrite it. clear_snapshots() empties the directory when a
+    server starts, so its sums do not include earlier runs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._buckets = {}
+        self.snapshot_dir = None
+        self.snapshot_interval = None
+        self._flusher = None
+        self._snapshot_name = self._new_snapshot_name()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # A forked worker starts from zero: what the parent recorded is in the
+        # parent's own snapshot. Its flush thread did not survive the fork.
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._snapshot_name = self._new_snapshot_name()
+        if self.snapshot_dir:
+            self._flusher = None
+            self.enable_snapshots(self.snapshot_dir, self.snapshot_interval)
+
+    @staticmethod
+    def _new_snapshot_name():
+        return f"{os.getpid()}-{secrets.token_hex(4)}.json"
+
+    def inc(self, name, amount=1.0, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + amount
+
+    def set(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            bounds = self._buckets.setdefault(name, tuple(buckets))
+            entry = self._histograms.get(key)
+            if entry is None:
+                # Per-bucket counts (the last one is +Inf), then sum and count.
+                entry = self._histograms[key] = [0] * (len(bounds) + 1) + [0.0, 0]
+            entry[bisect.bisect_left(bounds, value)] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def span(self, stage):
+        """
+        Times a pipeline stage into the qa_stage_seconds histogram and, inside
+        a request (see request_timings()), into that request's timings.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("qa_stage_seconds", elapsed, stage=stage)
+            timings = _request_timings.get()
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + elapsed
+
+    def _snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                "gauges": [[name, list(labels), value] for (name, labels), value in self._gauges.items()],
+                "histograms": [[name, list(labels), list(self._buckets[name]), list(entry)]
+                               for (name, labels), entry in self._histograms.items()],
+            }
+
+    def enable_snapshots(self, snapshot_dir, interval=5.0):
+        """
+        Writes this process's values to `snapshot_dir`/<pid>-<nonce>.json every
+        `interval` seconds. Processes forked afterwards write their own.
+        """
+        os.makedirs(snapshot_dir, exist_ok=True)
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = interval
+
+        def flush_periodically():
+            while True:
+                time.sleep(interval)
+                self.flush()
+
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(target=flush_periodically, name="metrics-flush", daemon=True)
+            self._flusher.start()
+
+    def flush(self):
+        if not self.snapshot_dir:
+            return
+        path = os.path.join(self.snapshot_dir, self._snapshot_name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _compact(self):
+        """
+        Folds the snapshots of processes that are no longer running into
+        exited.json, dropping their gauges. Called with the directory locked.
+        """
+        exited = []
+        for path in glob.glob(os.path.join(self.snapshot_dir, "*.json")):
+            name = os.path.basename(path)
+            try:
+                pid = int(name.split("-", 1)[0])
+            except ValueError:
+                continue
+            if pid != os.getpid() and not _pid_alive(pid):
+                exited.append(path)
+        if not exited:
+            return
+        exited_path = os.path.join(self.snapshot_dir, EXITED_SNAPSHOT)
+        snapshots = []
+        for path in [exited_path] + exited:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    snapshots.append((json.load(f), False))
+            except (OSError, ValueError):
+                continue
+        counters, _, histograms = _sum_snapshots(snapshots)
+        tmp_path = exited_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+                "histograms": [[name, list(labels), list(bounds), entry]
+                               for (name, labels, bounds), entry in histograms.items()],
+            }, f)
+        os.replace(tmp_path, exited_path)
+        for path in exited:
+            os.remove(path)
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format, summed
+        over every worker's snapshot when snapshots are enabled.
+        """
+        snapshots = [(self._snapshot(), True)]
+        if self.snapshot_dir:
+            self.flush()
+            snapshots = []
+            # One process at a time compacts and reads the directory.
+            with open(os.path.join(self.snapshot_dir, ".lock"), "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self._compact()
+                for path in glob.glob(os.path.join(self.snapshot_dir, "*.json")):
+                    try:
+                        fresh = time.time() - os.path.getmtime(path) < 3 * self.snapshot_interval
+                        with open(path, "r", encoding="utf-8") as f:
+                            snapshots.append((json.load(f), fresh))
+                    except (OSError, ValueError):
+                        continue
+        counters, gauges, histograms = _sum_snapshots(snapshots)
+
+        lines = []
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({name for name, _ in values}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for name in sorted({name for name, _, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels, bounds), entry in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip([f"{b:g}" for b in bounds] + ["+Inf"], entry[:-2]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {entry[-2]:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {entry[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _sum_snapshots(snapshots):
+    """
+    Sums (snapshot, fresh) pairs into counter, gauge and histogram dicts; the
+    gauges only of fresh snapshots.
+    """
+    counters = {}
+    gauges = {}
+    histograms = {}
+    for snapshot, fresh in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0.0) + value
+        for name, labels, value in snapshot.get("gauges", []) if fresh else []:
+            key = (name, tuple(map(tuple, labels)))
+            gauges[key] = gauges.get(key, 0.0) + value
+        for name, labels, bounds, entry in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)), tuple(bounds))
+            total = histograms.setdefault(key, [0] * len(entry))
+            for i, value in enumerate(entry):
+                total[i] += value
+    return counters, gauges, histograms
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def clear_snapshots(snapshot_dir):
+    """
+    Deletes the metrics snapshots of an earlier server run. Called once when a
+    server starts, before its workers write theirs.
+    """
+    for path in glob.glob(os.path.join(snapshot_dir, "*")):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+
+
+@contextmanager
+def request_timings(timings):
+    """
+    Collects the spans of the current request into the `timings` dict. Work
+    handed to other threads keeps collecting if it runs in a copy of this
+    context (contextvars.copy_context().run).
+    """
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+# The process-wide registry.
+metrics = Metrics()
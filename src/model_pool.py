@@ -0,0 +1,100 @@
+import os
+import weakref
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.metrics import metrics
+
+# Pools of this process; fork hooks cannot be unregistered, so one hook resets
+# them all instead of each pool registering its own and never being freed.
+_pools = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for pool in list(_pools):
+        pool._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class ModelPool:
+    """
+    Models and clients shared by all engines of a process: one encoder per
+    embedding model, one cross-encoder per rerank model, one LLM client and
+    one thread pool for the classifier gates and speculative retrieval.
+
+    Each is created on first use with the settings of the engine asking for
+    it; an engine serving a single course gets a pool of its own.
+
+    A pool can be filled before a fork (see preload_course() in
+    src/engine.py): a forked child keeps the loaded encoders and
+    cross-encoders, whose weights stay shared with the parent copy-on-write,
+    and starts with no thread pool and no LLM client, whose threads and
+    connections do not survive the fork.
+    """
+
+    def __init__(self, base_dir, max_workers=8):
+        self.base_dir = base_dir
+        self.max_workers = max_workers
+        self._executor = None
+        # Guards the dictionaries and the executor; never held while a model loads.
+        self._lock = threading.Lock()
+        # (kind, model key) -> lock held while that model loads, so a course
+        # loading one model does not hold up the others.
+        self._load_locks = {}
+        self._encoders = {}
+        self._rerankers = {}
+        self._llm = None
+        _pools.add(self)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._executor = None
+        self._llm = None
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def _get_or_load(self, models, kind, key, load):
+        with self._lock:
+            if key in models:
+                return models[key]
+            load_lock = self._load_locks.setdefault((kind, key), threading.Lock())
+        with load_lock:
+            with self._lock:
+                if key in models:
+                    # Loaded by another thread while this one waited.
+                    return models[key]
+            with metrics.span(f"load_{kind}"):
+                model = load()
+            with self._lock:
+                models[key] = model
+            return model
+
+    # The model and client modules (numpy, openai, torch) are imported on first
+    # use, so importing the web app stays fast.
+    def encoder(self, settings):
+        from src.embeddings import load_encoder, encoder_id
+        # Courses embedded with the same model share its encoder.
+        return self._get_or_load(self._encoders, "encoder", encoder_id(settings),
+                                 lambda: load_encoder(settings, self.base_dir))
+
+    def reranker(self, model_name, batch_size=32, max_length=256):
+        from src.rerank import CrossEncoderReranker
+        return self._get_or_load(self._rerankers, "reranker", (model_name, max_length),
+                                 lambda: CrossEncoderReranker(model_name, batch_size=batch_size,
+                                                              max_length=max_length))
+
+    def llm(self, model, max_connections=100, hedge_percentile=95.0):
+        from src.llm import LLMClient
+        with self._lock:
+            if self._llm is None:
+                self._llm = LLMClient(model, max_connections=max_connections, hedge_percentile=hedge_percentile)
+            return self._llm
@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Iterable, List, Optional
+
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+
+def source_hash(chunk_texts: Iterable[str]) -> str:
+    """
+    Identifies the text a quiz was written from, to tell whether it still
+    matches a rebuilt index.
+    """
+    digest = hashlib.sha256()
+    for text in chunk_texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class QuizBank:
+    """
+    Pre-generated multiple-choice questions (m:) with the chunks they were
+    written from.
+
+    Quizzes live in a sqlite file shared by all worker processes, written by
+    scripts/generate_quizzes.py and by on-demand generation. Each has a topic
+    embedding (the mean of its chunks' embeddings, or the question it was
+    generated for); lookup() finds the quizzes nearest to a request in an
+    in-memory FAISS mirror and serves the least served of them, so repeated
+    requests on a topic rotate through its questions; a session is never
+    served a quiz it was served before.
+
+    A quiz belongs to one index version and is only served while that version
+    is; refresh(), run when an index version is loaded, carries quizzes over
+    to it when their chunks are unchanged, keeping its quiz id. Quizzes older
+    than `ttl` seconds are not served.
+    """
+
+    def __init__(self, path, dim, index_version, threshold=0.6, candidates=5, ttl=30 * 24 * 3600):
+        self.dim = dim
+        self.index_version = index_version
+        self.threshold = threshold
+        self.candidates = candidates
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._mirror = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        self._last_id = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS quizzes ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " index_version TEXT NOT NULL,"
+            " embedding BLOB NOT NULL,"
+            " chunk_ids TEXT NOT NULL,"
+            " source_hash TEXT NOT NULL,"
+            " topic TEXT NOT NULL,"
+            " quiz TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " served INTEGER NOT NULL DEFAULT 0,"
+            " origin INTEGER)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(quizzes)")]
+        if "origin" not in columns:
+            # Banks written before quizzes kept their id across index versions.
+            self._conn.execute("ALTER TABLE quizzes ADD COLUMN origin INTEGER")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS quizzes_version ON quizzes (index_version, id)")
+        self._conn.commit()
+        self._sync()
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.array(embedding, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _sync(self):
+        # Mirror rows added since the last sync, including those written by other processes.
+        rows = self._conn.execute(
+            "SELECT id, embedding FROM quizzes WHERE id > ? AND index_version = ? ORDER BY id",
+            (self._last_id, self.index_version)
+        ).fetchall()
+        if not rows:
+            return
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        vectors = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        self._mirror.add_with_ids(vectors, ids)
+        self._last_id = int(ids[-1])
+
+    def set_index_version(self, index_version):
+        """
+        Switches to a reloaded index; only its quizzes are served from now on.
+        """
+        with self._lock:
+            self.index_version = index_version
+            self._mirror.reset()
+            self._last_id = 0
+            self._sync()
+
+    def lookup(self, embedding, exclude=()) -> Optional[dict]:
+        """
+        Returns the least served fresh quiz among the `candidates` nearest to
+        the request that are at least `threshold` cosine-similar, leaving out
+        the quiz ids in `exclude`, as a dict with "quiz_id", "quiz" and
+        "chunk_ids", or None.
+        """
+        query = self._normalize(embedding)
+        now = time.time()
+        exclude = set(exclude)
+        with self._lock:
+            self._sync()
+            best = None
+            if self._mirror.ntotal:
+                scores, ids = self._mirror.search(query, self.candidates + len(exclude))
+                matches = {int(i): float(s) for s, i in zip(scores[0], ids[0]) if i >= 0 and s >= self.threshold}
+                if matches:
+                    marks = ",".join("?" * len(matches))
+                    rows = self._conn.execute(
+                        f"SELECT id, quiz, chunk_ids, served, COALESCE(origin, id) FROM quizzes"
+                        f" WHERE id IN ({marks}) AND created > ?",
+                        (*matches, now - self.ttl)
+                    ).fetchall()
+                    # The nearest `candidates` of those not excluded.
+                    eligible = sorted((row for row in rows if row[4] not in exclude),
+                                      key=lambda row: -matches[row[0]])[:self.candidates]
+                    if eligible:
+                        best = min(eligible, key=lambda row: (row[3], -matches[row[0]]))
+                        self._conn.execute("UPDATE quizzes SET served = served + 1 WHERE id = ?", (best[0],))
+                        self._conn.commit()
+                    stale = set(matches) - {row[0] for row in rows}
+                    if stale:
+                        # Expired, or deleted by a refresh.
+                        self._mirror.remove_ids(np.array(sorted(stale), dtype=np.int64))
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return {"quiz_id": best[4], "quiz": best[1], "chunk_ids": json.loads(best[2])}
+
+    def add(self, embedding, chunk_ids, chunk_texts, topic, quiz, index_version=None, served=0) -> int:
+        """
+        Stores a quiz written from `chunk_ids` (whose texts are `chunk_texts`)
+        under `index_version`, by default the current one, and returns its
+        quiz id. A quiz generated for a request is stored with served=1.
+        """
+        vector = self._normalize(embedding)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO quizzes (index_version, embedding, chunk_ids, source_hash, topic, quiz, created, served)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (index_version or self.index_version, vector.tobytes(), json.dumps([int(i) for i in chunk_ids]),
+                 source_hash(chunk_texts), topic, quiz, time.time(), served)
+            )
+            self._conn.commit()
+            self._sync()
+        return cursor.lastrowid
+
+    def count(self, index_version=None) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM quizzes WHERE index_version = ?", (index_version or self.index_version,)
+            ).fetchone()[0]
+
+    def chunk_sets(self, index_version=None) -> List[List[int]]:
+        """
+        The chunk ids of every quiz of `index_version`.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_ids FROM quizzes WHERE index_version = ?", (index_version or self.index_version,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def refresh(self, chunk_store) -> dict:
+        """
+        Applies the freshness policy for the current index version, whose
+        chunks are in `chunk_store`: quizzes of other versions whose chunks all
+        still exist with the same text are carried over to this version, the
+        others and all expired quizzes are deleted. Returns the counts.
+        """
+        now = time.time()
+        kept = dropped = 0
+        with self._lock:
+            # One writer at a time, so processes reloading together carry each quiz over once.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = self._conn.execute("DELETE FROM quizzes WHERE created <= ?", (now - self.ttl,)).rowcount
+                rows = self._conn.execute(
+                    "SELECT id, chunk_ids, source_hash FROM quizzes WHERE index_version != ?", (self.index_version,)
+                ).fetchall()
+                for quiz_id, chunk_ids, digest in rows:
+                    ids = json.loads(chunk_ids)
+                    if all(idx in chunk_store for idx in ids) and \
+                            source_hash(chunk_store.text(idx) for idx in ids) == digest:
+                        # Copied under a new row id, so other processes' mirrors pick it
+                        # up; origin keeps the quiz id sessions know it by.
+                        self._conn.execute(
+                            "INSERT INTO quizzes (index_version, embedding, chunk_ids, source_hash, topic, quiz,"
+                            " created, served, origin)"
+                            " SELECT ?, embedding, chunk_ids, source_hash, topic, quiz, created, served,"
+                            " COALESCE(origin, id) FROM quizzes WHERE id = ?",
+                            (self.index_version, quiz_id)
+                        )
+                        kept += 1
+                    else:
+                        dropped += 1
+                    self._conn.execute("DELETE FROM quizzes WHERE id = ?", (quiz_id,))
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._sync()
+        if kept or dropped or expired:
+            logger.info("Quiz bank: %d quizzes carried over to index version %s, %d dropped, %d expired.",
+                        kept, self.index_version, dropped, expired)
+        return {"carried_over": kept, "dropped": dropped, "expired": expired}
+
+    def clear(self, index_version=None) -> int:
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM quizzes WHERE index_version = ?", (index_version or self.index_version,)
+            ).rowcount
+            self._conn.commit()
+            self._mirror.reset()
+            self._last_id = 0
+            self._sync()
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._mirror.reset()
+            self._conn.close()
@@ -0,0 +1,151 @@
+import os
+import math
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import faiss
+
+from src.embedding_store import embeddings_exist, open_embeddings, read_embedding_meta
+from src.index_versions import INDEX_DIR
+
+logger = logging.getLogger(__name__)
+
+# Quizzes are written from this many chunks nearest a cluster centroid.
+CHUNKS_PER_QUIZ = 3
+
+
+def embeddings_dir(data_dir: str, version: str) -> str:
+    """
+    The directory holding the embeddings index `version` was built from:
+    its version directory, or data/ for the flat layout and for versions
+    built before create_final_data.py linked them there.
+    """
+    directory = os.path.join(data_dir, INDEX_DIR, version)
+    return directory if embeddings_exist(directory) else data_dir
+
+
+def indexed_embeddings(data_dir: str, chunk_store, version: str):
+    """
+    The normalized embeddings of the chunks in index `version` (whose chunk
+    store is `chunk_store`), and their chunk ids.
+    """
+    directory = embeddings_dir(data_dir, version)
+    vectors = open_embeddings(directory)
+    ids = np.fromiter((record['chunk_id'] for record in read_embedding_meta(directory)), dtype=np.int64)
+    keep = np.array([int(idx) in chunk_store for idx in ids], dtype=bool)
+    selected = np.ascontiguousarray(vectors[keep], dtype=np.float32)
+    faiss.normalize_L2(selected)
+    return selected, ids[keep]
+
+
+def cluster_chunks(vectors: np.ndarray, clusters: int, seed: int = 1234) -> List[List[int]]:
+    """
+    Groups the rows of `vectors` into `clusters` by spherical k-means; each
+    cluster lists its rows nearest to the centroid first.
+    """
+    kmeans = faiss.Kmeans(vectors.shape[1], clusters, niter=20, seed=seed, spherical=True)
+    kmeans.train(vectors)
+    _, labels = kmeans.index.search(vectors, 1)
+    labels = labels.ravel()
+    similarity = np.einsum('ij,ij->i', vectors, kmeans.centroids[labels])
+    members = []
+    for cluster in range(clusters):
+        rows = np.flatnonzero(labels == cluster)
+        members.append([int(row) for row in rows[np.argsort(-similarity[rows])]])
+    return members
+
+
+def plan_quizzes(members: List[List[int]], ids: np.ndarray, used: set, per_cluster: int,
+                 chunks_per_quiz: int) -> List[List[int]]:
+    """
+    Rows of up to `per_cluster` groups of `chunks_per_quiz` chunks per cluster,
+    nearest the centroid first, leaving out chunks a stored quiz was written
+    from and counting those quizzes against the cluster's share.
+    """
+    groups = []
+    for rows in members:
+        existing = sum(1 for row in rows if int(ids[row]) in used)
+        free = [row for row in rows if int(ids[row]) not in used]
+        wanted = max(0, per_cluster - math.ceil(existing / chunks_per_quiz))
+        for start in range(0, min(len(free), wanted * chunks_per_quiz), chunks_per_quiz):
+            groups.append(free[start:start + chunks_per_quiz])
+    return groups
+
+
+def plan_missing(engine, clusters: Optional[int] = None, per_cluster: Optional[int] = None,
+                 chunks_per_quiz: int = CHUNKS_PER_QUIZ) -> Tuple[np.ndarray, np.ndarray, List[List[int]]]:
+    """
+    Clusters the chunks of the engine's index (default: the square root of
+    their number of clusters) and plans the quizzes its bank is missing.
+    Returns the chunk embeddings, their chunk ids and the planned groups of rows.
+    Call it with the engine pinned to one index generation.
+    """
+    if not embeddings_exist(embeddings_dir(engine.data_dir, engine.index_version)):
+        return np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.int64), []
+    vectors, ids = indexed_embeddings(engine.data_dir, engine.chunk_store, engine.index_version)
+    if not len(ids):
+        return vectors, ids, []
+    clusters = min(len(ids), clusters or max(1, int(math.sqrt(len(ids)))))
+    logger.info("Clustering %d chunks into %d clusters...", len(ids), clusters)
+    members = cluster_chunks(vectors, clusters)
+    used = {idx for chunk_ids in engine.quiz_bank.chunk_sets() for idx in chunk_ids}
+    per_cluster = per_cluster or int(engine.settings.get('quiz_per_cluster', 2))
+    return vectors, ids, plan_quizzes(members, ids, used, per_cluster, chunks_per_quiz)
+
+
+def generate_quiz(engine, chunk_ids: List[int], timeout: float) -> Dict[str, str]:
+    """
+    Writes one multiple-choice question from the chunks with the m: prompt.
+    """
+    filename = engine.chunk_store.get(chunk_ids[0])['filename']
+    topic = os.path.splitext(os.path.basename(filename))[0]
+    prompt_instructions, final_query = engine.build_prompt("multiple_choice", topic)
+    messages = [
+        {"role": "system", "content": prompt_instructions + "\n\nContext:\n" + engine.context_from_ids(chunk_ids)},
+        {"role": "user", "content": final_query}
+    ]
+    return {'topic': topic, 'quiz': engine.llm.complete(messages, timeout)}
+
+
+def generate_quizzes(engine, vectors: np.ndarray, ids: np.ndarray, groups: List[List[int]], version: str,
+                     concurrency: int = 8, timeout: float = 60.0,
+                     on_done: Optional[Callable[[int, int], None]] = None,
+                     should_stop: Optional[Callable[[], bool]] = None) -> Tuple[int, int]:
+    """
+    Generates the planned quizzes `concurrency` at a time and stores each under
+    `version` with its chunk ids and topic embedding. Calls on_done(done,
+    failed) after each; once should_stop() is true, the rest are cancelled
+    and not stored. Returns (done, failed).
+    """
+    done = failed = 0
+    bank = engine.quiz_bank
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # In copies of the caller's context, so they use the index generation it is pinned to.
+        futures = {
+            pool.submit(contextvars.copy_context().run, generate_quiz, engine, [int(ids[row]) for row in rows],
+                        timeout): rows
+            for rows in groups
+        }
+        for future in as_completed(futures):
+            if should_stop and should_stop():
+                for pending in futures:
+                    pending.cancel()
+                break
+            rows = futures[future]
+            chunk_ids = [int(ids[row]) for row in rows]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                logger.warning("Quiz from chunks %s failed: %s", chunk_ids, e)
+                continue
+            topic_embedding = vectors[rows].mean(axis=0)
+            bank.add(topic_embedding, chunk_ids, [engine.chunk_store.text(idx) for idx in chunk_ids],
+                     result['topic'], result['quiz'], index_version=version)
+            done += 1
+            if on_done:
+                on_done(done, failed)
+    return done, failed
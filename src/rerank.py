@@ -0,0 +1,36 @@
+from typing import List, Tuple
+
+import numpy as np
+
+# Multilingual MS MARCO model, for courses in any language; English-only courses
+# can set rerank_model to the smaller cross-encoder/ms-marco-MiniLM-L-6-v2.
+DEFAULT_RERANK_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+# Tokens of (query, chunk) scored per pair. prepare_documents.py chunks are 200
+# words; the cost of a pair grows with its length, so longer ones are cut here.
+DEFAULT_MAX_LENGTH = 256
+
+
+class CrossEncoderReranker:
+    """
+    Scores (query, chunk) pairs jointly with a small cross-encoder on the CPU,
+    which ranks a candidate pool more accurately than the bi-encoder and BM25
+    scores it was retrieved with. torch is only imported when this is created.
+    """
+
+    def __init__(self, model_name=DEFAULT_RERANK_MODEL, batch_size=32, max_length=DEFAULT_MAX_LENGTH):
+        from sentence_transformers import CrossEncoder
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+
+    def rerank(self, query: str, candidates: List[Tuple[int, str]]) -> List[int]:
+        """
+        Orders (chunk_id, text) candidates by relevance to the query and returns
+        their ids, best first. Equal scores keep the retrieval order.
+        """
+        if not candidates:
+            return []
+        scores = np.asarray(self.model.predict(
+            [(query, text) for _, text in candidates], batch_size=self.batch_size, show_progress_bar=False
+        ))
+        return [candidates[i][0] for i in np.argsort(-scores, kind="stable")]
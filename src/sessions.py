@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import sqlite3
+import secrets
+import threading
+from typing import List, Optional
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(16)
+
+
+class SessionStore:
+    """
+    Conversation history per session id, kept in a sqlite file shared by all
+    worker processes.
+
+    Each turn records the question, its type and the ids of the chunks its
+    answer was given with, not their text, so a follow-up can rebuild or reuse
+    that context without searching again. A session keeps its last `max_turns`
+    turns and expires `ttl` seconds after its last turn; beyond `max_sessions`
+    the least recently active sessions are dropped.
+    """
+
+    def __init__(self, path, ttl=3600, max_turns=5, max_sessions=10000):
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " turns TEXT NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+        self._conn.commit()
+
+    def turns(self, session_id) -> List[dict]:
+        """
+        Returns the session's turns, oldest first; empty for unknown or expired sessions.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT turns FROM sessions WHERE session_id = ? AND updated >= ?",
+                (session_id, time.time() - self.ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def last_turn(self, session_id) -> Optional[dict]:
+        """
+        The most recent turn that has context ids (answer checks have none).
+        """
+        for turn in reversed(self.turns(session_id)):
+            if turn.get("chunk_ids"):
+                return turn
+        return None
+
+    def append(self, session_id, turn: dict) -> None:
+        with self._lock:
+            now = time.time()
+            row = self._conn.execute(
+                "SELECT turns FROM sessions WHERE session_id = ? AND updated >= ?",
+                (session_id, now - self.ttl)
+            ).fetchone()
+            turns = (json.loads(row[0]) if row else []) + [turn]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, turns, updated) VALUES (?, ?, ?)",
+                (session_id, json.dumps(turns[-self.max_turns:], ensure_ascii=False), now)
+            )
+            # Eviction scans the index, so only do it every so often.
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._conn.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+                self._conn.execute(
+                    "DELETE FROM sessions WHERE session_id IN ("
+                    " SELECT session_id FROM sessions ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                    (self.max_sessions,)
+                )
+            self._conn.commit()
+
+    def clear(self, session_id) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,19 @@
+import os
+
+# Project root (parent directory of src/).
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Course served from settings.txt and data/ in the project root.
+DEFAULT_COURSE = "default"
+
+
+def read_settings(file_name):
+    settings = {}
+    with open(file_name, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            settings[key.strip()] = value.strip()
+    return settings
@@ -0,0 +1,33 @@
+import logging
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+
+def load_encoding(model: str):
+    """
+    Returns the model's tiktoken encoding, or None when its BPE file cannot be
+    loaded (tiktoken downloads it on first use, which fails offline).
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('cl100k_base')
+    except Exception as e:
+        logger.warning("Could not load the tokenizer for %s (%s); estimating token counts.",
+                       model, e.__class__.__name__)
+        return None
+
+
+def count_tokens(encoding, text: str) -> int:
+    """
+    Tokens in `text` with an encoding from load_encoding, or an estimate when
+    there is none.
+    """
+    if encoding is None:
+        # Roughly one token per three UTF-8 bytes errs on the high side for
+        # both Latin and Cyrillic text.
+        return len(text.encode('utf-8')) // 3 + 1
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from src.answer_cache import SemanticCache, context_key
+
+QUESTION = [1.0, 0.0, 0.0, 0.0]
+OTHER_QUESTION = [0.0, 1.0, 0.0, 0.0]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = SemanticCache(str(tmp_path / "answer_cache.sqlite"), dim=4, index_version="v1")
+    yield cache
+    cache.close()
+
+
+def test_context_key():
+    assert context_key(None) == ""
+    assert context_key("") == ""
+    assert context_key("previous turn") == context_key("previous turn") != ""
+
+
+def test_standalone_answer_is_served_to_standalone_questions(cache):
+    cache.store(QUESTION, "q", "standalone answer", chunk_ids=[4, 2])
+    assert cache.lookup(QUESTION) == {"reply": "standalone answer", "chunk_ids": [4, 2]}
+
+
+def test_standalone_answer_is_not_served_inside_a_conversation(cache):
+    cache.store(QUESTION, "what about the second one?", "standalone answer")
+    assert cache.lookup(QUESTION, context_key("an earlier turn")) is None
+
+
+def test_followup_answer_is_only_served_after_the_same_context(cache):
+    earlier = context_key("an earlier turn")
+    cache.store(QUESTION, "what about the second one?", "follow-up answer", context=earlier)
+    assert cache.lookup(QUESTION, earlier)["reply"] == "follow-up answer"
+    assert cache.lookup(QUESTION, context_key("another turn")) is None
+    assert cache.lookup(QUESTION) is None
+
+
+def test_lookup_skips_entries_of_other_contexts_for_a_matching_one(cache):
+    earlier = context_key("an earlier turn")
+    cache.store(QUESTION, "q", "standalone answer")
+    cache.store(QUESTION, "q", "follow-up answer", context=earlier)
+    assert cache.lookup(QUESTION)["reply"] == "standalone answer"
+    assert cache.lookup(QUESTION, earlier)["reply"] == "follow-up answer"
+
+
+def test_dissimilar_question_misses(cache):
+    cache.store(QUESTION, "q", "answer")
+    assert cache.lookup(OTHER_QUESTION) is None
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_expired_entries_are_not_served(tmp_path):
+    cache = SemanticCache(str(tmp_path / "answer_cache.sqlite"), dim=4, index_version="v1", ttl=0.01)
+    cache.store(QUESTION, "q", "answer")
+    time.sleep(0.02)
+    assert cache.lookup(QUESTION) is None
+    cache.close()
+
+
+def test_entries_of_another_index_version_are_dropped(tmp_path):
+    path = str(tmp_path / "answer_cache.sqlite")
+    cache = SemanticCache(path, dim=4, index_version="v1")
+    cache.store(QUESTION, "q", "answer")
+    # Answered from an index that was reloaded since.
+    cache.store(OTHER_QUESTION, "q2", "stale answer", index_version="v0")
+    assert cache.lookup(OTHER_QUESTION) is None
+    cache.close()
+
+    reopened = SemanticCache(path, dim=4, index_version="v2")
+    assert reopened.lookup(QUESTION) is None
+    reopened.close()
+
+
+def test_entries_are_shared_between_instances(tmp_path):
+    path = str(tmp_path / "answer_cache.sqlite")
+    writer = SemanticCache(path, dim=4, index_version="v1")
+    reader = SemanticCache(path, dim=4, index_version="v1")
+    writer.store(QUESTION, "q", "answer", chunk_ids=[7])
+    assert reader.lookup(QUESTION) == {"reply": "answer", "chunk_ids": [7]}
+    writer.close()
+    reader.close()
@@ -0,0 +1,42 @@
+from src.bm25 import BM25Index, bm25_index_exists, reciprocal_rank_fusion, tokenize, write_bm25_index
+
+
+def test_tokenize_splits_latin_and_cyrillic_words():
+    assert tokenize("Пределни РАЗХОДИ, EC-203!") == ["пределни", "разходи", "ec", "203"]
+
+
+def test_search_ranks_by_bm25(tmp_path):
+    index_dir = str(tmp_path / "bm25")
+    write_bm25_index(index_dir, [
+        (10, "marginal cost of electricity"),
+        (11, "marginal cost marginal cost"),
+        (12, "game theory"),
+    ])
+    assert bm25_index_exists(index_dir)
+    index = BM25Index(index_dir)
+    ids, scores = index.search("marginal cost", k=5)
+    assert list(ids) == [11, 10]
+    assert scores[0] > scores[1] > 0
+    assert list(index.search("unknown words", k=5)[0]) == []
+
+
+def test_rebuilding_replaces_the_index(tmp_path):
+    index_dir = str(tmp_path / "bm25")
+    write_bm25_index(index_dir, [(1, "old text")])
+    old = BM25Index(index_dir)
+    write_bm25_index(index_dir, [(2, "new text")])
+    assert list(BM25Index(index_dir).search("new", k=5)[0]) == [2]
+    # An index opened before the rebuild keeps reading its own files.
+    assert list(old.search("old", k=5)[0]) == [1]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["bm25"]
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([([1, 2, 3], 1.0), ([3, 4], 1.0)], k=60)
+    assert fused[0] == 3
+    assert set(fused) == {1, 2, 3, 4}
+
+
+def test_reciprocal_rank_fusion_weights():
+    fused = reciprocal_rank_fusion([([1], 1.0), ([2], 2.0)], k=60)
+    assert fused == [2, 1]
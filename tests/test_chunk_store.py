@@ -0,0 +1,28 @@
+import pytest
+
+from src.chunk_store import ChunkStore, write_chunk_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    write_chunk_store(str(tmp_path / "chunk_store"), [
+        {'filename': 'a.pdf', 'chunk_index': 0, 'chunk_text': 'first', 'chunk_id': 20},
+        {'filename': 'b.pdf', 'chunk_index': 3, 'chunk_text': 'второ', 'chunk_id': 5},
+    ])
+    store = ChunkStore(str(tmp_path / "chunk_store"))
+    yield store
+    store.close()
+
+
+def test_lookup_by_chunk_id(store):
+    assert len(store) == 2
+    assert store.text(5) == 'второ'
+    assert store.get(20) == {'chunk_id': 20, 'filename': 'a.pdf', 'chunk_index': 0, 'chunk_text': 'first'}
+    assert 5 in store and 6 not in store
+
+
+def test_unknown_chunk_id_raises_key_error(store):
+    with pytest.raises(KeyError):
+        store.text(6)
+    with pytest.raises(KeyError):
+        store.get(-1)
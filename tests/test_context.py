@@ -0,0 +1,97 @@
+import pytest
+
+import src.context
+from src.context import TITLE_PREFIX, ContextPacker, overlap_length
+
+
+class FakeChunkStore:
+    def __init__(self, chunks):
+        # chunk id -> (filename, chunk_index, text without the title prefix)
+        self.chunks = chunks
+
+    def get(self, chunk_id):
+        filename, chunk_index, text = self.chunks[chunk_id]
+        return {'chunk_id': chunk_id, 'filename': filename, 'chunk_index': chunk_index,
+                'chunk_text': TITLE_PREFIX.format(filename) + text}
+
+
+@pytest.fixture
+def make_packer(monkeypatch):
+    # Token counts fall back to the byte estimate, so no tokenizer is downloaded.
+    monkeypatch.setattr(src.context, "load_encoding", lambda model: None)
+
+    def make(chunks, budget=1000):
+        return ContextPacker(FakeChunkStore(chunks), "gpt-4o-mini", budget=budget)
+    return make
+
+
+def test_overlap_length():
+    assert overlap_length("a b c d".split(), "c d e".split()) == 2
+    assert overlap_length("a b c".split(), "d e".split()) == 0
+    assert overlap_length([], "a".split()) == 0
+
+
+def test_render_merges_consecutive_chunks_without_their_overlap(make_packer):
+    packer = make_packer({
+        1: ("a.pdf", 3, "alpha beta gamma the"),
+        2: ("a.pdf", 4, "gamma the delta"),
+    })
+    chunks = [packer._words(1), packer._words(2)]
+    assert packer.render(chunks) == TITLE_PREFIX.format("a.pdf") + "alpha beta gamma the delta"
+
+
+def test_render_keeps_chunks_further_apart_separate(make_packer):
+    packer = make_packer({
+        1: ("a.pdf", 3, "alpha beta gamma the"),
+        2: ("a.pdf", 9, "the omega psi chi"),
+    })
+    rendered = packer.render([packer._words(1), packer._words(2)])
+    assert rendered.split(src.context.PASSAGE_SEPARATOR) == [
+        TITLE_PREFIX.format("a.pdf") + "alpha beta gamma the",
+        TITLE_PREFIX.format("a.pdf") + "the omega psi chi",
+    ]
+
+
+def test_render_orders_passages_by_best_rank(make_packer):
+    packer = make_packer({
+        1: ("a.pdf", 0, "first file"),
+        2: ("b.pdf", 0, "second file"),
+    })
+    rendered = packer.render([packer._words(2), packer._words(1)])
+    assert rendered.startswith(TITLE_PREFIX.format("b.pdf"))
+
+
+def test_pack_consumes_every_candidate_that_fits(make_packer):
+    packer = make_packer({i: ("a.pdf", i * 10, f"word{i} " * 5) for i in range(3)})
+    packed = packer.pack([2, 0, 1])
+    assert packed.chunk_ids == [2, 0, 1]
+    assert packed.consumed == 3
+    assert packed.tokens == packer.count(packed.text)
+
+
+def test_pack_cuts_the_first_candidate_that_does_not_fit(make_packer):
+    packer = make_packer({i: ("a.pdf", i * 10, " ".join(f"w{i}x{j}" for j in range(40))) for i in range(4)})
+    budget = packer.count(packer.render([packer._words(0)])) + 20
+    packed = packer.pack([0, 1, 2, 3], budget=budget)
+    assert packed.tokens <= budget
+    # Chunk 1 is included in part and counted as consumed; 2 and 3 are left for a retry.
+    assert packed.chunk_ids == [0, 1]
+    assert packed.consumed == 2
+    assert "w1x0" in packed.text and "w1x39" not in packed.text
+
+
+def test_pack_does_not_consume_a_candidate_it_cannot_fit_at_all(make_packer):
+    packer = make_packer({i: ("a.pdf", i * 10, " ".join(f"w{i}x{j}" for j in range(40))) for i in range(2)})
+    budget = packer.count(packer.render([packer._words(0)]))
+    packed = packer.pack([0, 1], budget=budget)
+    assert packed.chunk_ids == [0]
+    assert packed.consumed == 1
+
+
+def test_truncate_cuts_at_a_word_boundary(make_packer):
+    packer = make_packer({})
+    text = " ".join(f"word{i}" for i in range(100))
+    truncated = packer.truncate(text, 20)
+    assert packer.count(truncated) <= 20
+    assert text.startswith(truncated) and text[len(truncated)] == " "
+    assert packer.truncate("short", 20) == "short"
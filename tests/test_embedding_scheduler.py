@@ -0,0 +1,49 @@
+import pytest
+
+from src.embedding_scheduler import TokenBucket, parse_duration, retry_delay
+
+
+def test_parse_duration():
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("1s") == 1.0
+    assert parse_duration("6m0s") == 360.0
+    assert parse_duration("1h2m3.5s") == pytest.approx(3723.5)
+    assert parse_duration("") == 0.0
+    assert parse_duration(None) == 0.0
+
+
+def test_retry_delay_prefers_retry_after_ms():
+    assert retry_delay({'retry-after-ms': '1500', 'retry-after': '9'}, attempt=0) == 1.5
+
+
+def test_retry_delay_uses_retry_after_seconds():
+    assert retry_delay({'retry-after': '2.5'}, attempt=0) == 2.5
+
+
+def test_retry_delay_uses_the_longest_rate_limit_reset():
+    headers = {'x-ratelimit-reset-tokens': '1m0s', 'x-ratelimit-reset-requests': '20ms'}
+    assert retry_delay(headers, attempt=0) == 60.0
+
+
+def test_retry_delay_backs_off_exponentially_without_headers():
+    assert retry_delay(None, attempt=0) == 1.0
+    assert retry_delay({}, attempt=3) == 8.0
+    assert retry_delay(None, attempt=10) == 60.0
+
+
+def test_token_bucket_admits_up_to_its_capacity():
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.try_acquire(60) == 0.0
+    # Refills at one unit per second.
+    assert bucket.try_acquire(1) == pytest.approx(1.0, abs=0.05)
+
+
+def test_token_bucket_caps_requests_larger_than_its_capacity():
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.try_acquire(1000) == 0.0
+
+
+def test_token_bucket_drain_empties_it():
+    bucket = TokenBucket(per_minute=600)
+    bucket.drain()
+    assert bucket.try_acquire(10) == pytest.approx(1.0, abs=0.05)